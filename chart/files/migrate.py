@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Online migration runner for the cofrap database.
+
+Applies the `*.up.sql` migrations of a directory (the db-migrations
+ConfigMap in the chart's Job) or of chart/values.yaml (--values), in name
+order, and records each one in a `schema_migrations` table with its
+checksum: a migration runs once, and a migration changed after it was
+applied stops the run. A session advisory lock keeps two runners apart.
+
+Every statement runs with a short `lock_timeout` (--lock-timeout): a
+migration that cannot get its lock at once gives up instead of queueing
+the logins behind it, and is retried with a jittered exponential backoff
+(--retries). Directives in the SQL choose how a migration runs:
+
+    -- migrate:no-transaction
+        Statements run one by one outside a transaction, as
+        CREATE INDEX CONCURRENTLY requires. An invalid index left by an
+        interrupted CREATE INDEX CONCURRENTLY is dropped before the retry.
+        Statements must be idempotent (IF NOT EXISTS): a failed migration
+        is run again from its first statement.
+
+    -- migrate:backfill table=users key=id batch=1000
+        The migration is one statement run on successive key ranges,
+        `%(start)s` to `%(end)s` inclusive (a literal % is written %%), each
+        range in its own short transaction. Other `%(name)s` placeholders
+        take the values given with --param name=value. The position is saved with each
+        batch, so an interrupted backfill resumes where it stopped. Before
+        each batch the runner waits while the replication lag or the number
+        of active sessions is above its limits, sizes the batch to last
+        about --batch-seconds, and pauses so that it works at most
+        --duty-cycle of the time. Rows inserted after the backfill started
+        are the application's job (write the new column on insert first).
+
+Without a directive, the migration runs in one transaction with its record
+in schema_migrations.
+
+Usage:
+    PGHOST=localhost PGUSER=postgres PGPASSWORD=password PGDATABASE=cofrap \\
+        python chart/files/migrate.py up --values chart/values.yaml
+    python chart/files/migrate.py status --dir /migrations
+
+Needs psycopg2, and PyYAML for --values (pip install psycopg2-binary
+-r scripts/test_requirements.txt); the chart's Job reads --dir only.
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import random
+import re
+import sys
+import time
+
+import psycopg2
+import psycopg2.errors
+
+ADVISORY_LOCK = 0x636f66726170  # "cofrap"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version TEXT PRIMARY KEY,
+        checksum CHAR(64) NOT NULL,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        applied_at TIMESTAMPTZ,
+        duration_ms BIGINT,
+        backfill_position BIGINT
+    )
+"""
+
+DIRECTIVE = re.compile(r"^\s*--\s*migrate:([a-z-]+)(.*)$", re.M)
+PLACEHOLDER = re.compile(r"(?<!%)%\((\w+)\)s")
+CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w\".]+)", re.I)
+
+# Retried after a backoff: the lock (or the deadlock victim) may be free next time
+RETRYABLE = (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected)
+
+
+def duty_cycle(text):
+    value = float(text)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError(f"{text} is not in (0, 1]")
+    return value
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply the database migrations online.")
+    parser.add_argument("command", choices=["up", "status"])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--dir", default="/migrations", help="directory of *.up.sql files")
+    source.add_argument("--values", help="read migrations.migrations from this values.yaml instead")
+    parser.add_argument("--dsn", default="", help="libpq connection string (default: PG* variables)")
+    parser.add_argument("--create-database", action="store_true", help="create the database if it is missing")
+    parser.add_argument("--wait", type=float, default=0, help="seconds to wait for the database to accept connections")
+    parser.add_argument("--target", help="stop after this migration")
+    parser.add_argument("--lock-timeout", default="2s", help="lock_timeout of every statement")
+    parser.add_argument("--retries", type=int, default=10, help="attempts after a lock timeout")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="first backoff, in seconds")
+    parser.add_argument("--batch-seconds", type=float, default=0.5, help="target duration of a backfill batch")
+    parser.add_argument("--max-batch", type=int, default=50000)
+    parser.add_argument("--duty-cycle", type=duty_cycle, default=0.5,
+                        help="share of the time a backfill works, in (0, 1]")
+    parser.add_argument("--max-replication-lag", type=float, default=5.0, help="seconds, pauses the backfill")
+    parser.add_argument("--max-active-sessions", type=int, default=20, help="pauses the backfill above this")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="value of a %%(NAME)s placeholder in backfill statements (repeatable)")
+    args = parser.parse_args()
+    args.params = {}
+    for param in args.param:
+        name, sep, value = param.partition("=")
+        if not sep or not name:
+            parser.error(f"--param {param}: expected NAME=VALUE")
+        args.params[name] = value
+    return args
+
+
+class Migration:
+    """One migration file and the way it must be run."""
+
+    def __init__(self, name, sql):
+        self.version = name[:-len(".up.sql")] if name.endswith(".up.sql") else name
+        self.sql = sql
+        self.checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        self.transaction = True
+        self.backfill = None
+        for match in DIRECTIVE.finditer(sql):
+            directive, options = match.group(1), match.group(2).split()
+            if directive == "no-transaction":
+                self.transaction = False
+            elif directive == "backfill":
+                options = dict(option.partition("=")[::2] for option in options)
+                if "table" not in options:
+                    raise ValueError(f"{name}: migrate:backfill needs table=<name>")
+                self.backfill = {"table": options["table"], "key": options.get("key", "id"),
+                                 "batch": int(options.get("batch", 1000))}
+            else:
+                raise ValueError(f"{name}: unknown directive migrate:{directive}")
+
+
+def load_migrations(args):
+    if args.values:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("--values needs PyYAML: pip install -r scripts/test_requirements.txt")
+        with open(args.values) as f:
+            items = yaml.safe_load(f)["migrations"]["migrations"]
+        files = [(item["name"], item["content"]) for item in items]
+    else:
+        files = []
+        for path in glob.glob(os.path.join(args.dir, "*.up.sql")):
+            with open(path) as f:
+                files.append((os.path.basename(path), f.read()))
+    migrations = sorted((Migration(name, sql) for name, sql in files), key=lambda m: m.version)
+    if args.target:
+        if args.target not in {m.version for m in migrations}:
+            raise ValueError(f"unknown target migration {args.target}")
+        migrations = [m for m in migrations if m.version <= args.target]
+    return migrations
+
+
+def split_statements(sql):
+    """Splits a script on top-level semicolons, skipping quotes, dollar quotes and comments."""
+    statements, start, i, n = [], 0, 0, len(sql)
+    while i < n:
+        if sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = n if i < 0 else i
+        elif sql.startswith("/*", i):
+            i = sql.find("*/", i + 2)
+            i = n if i < 0 else i + 2
+        elif sql[i] in "'\"":
+            end = sql.find(sql[i], i + 1)
+            i = n if end < 0 else end + 1
+        elif sql[i] == "$" and re.match(r"\$\w*\$", sql[i:]):
+            tag = re.match(r"\$\w*\$", sql[i:]).group(0)
+            end = sql.find(tag, i + len(tag))
+            i = n if end < 0 else end + len(tag)
+        elif sql[i] == ";":
+            statements.append(sql[start:i])
+            start = i = i + 1
+        else:
+            i += 1
+    statements.append(sql[start:])
+    # Keep statements with more than comments in them
+    return [s.strip() for s in statements
+            if re.sub(r"--[^\n]*|/\*.*?\*/", "", s, flags=re.S).strip()]
+
+
+def connect(args):
+    deadline = time.monotonic() + args.wait
+    while True:
+        try:
+            return psycopg2.connect(args.dsn)
+        except psycopg2.OperationalError as e:
+            missing = "does not exist" in str(e)
+            if missing and args.create_database:
+                create_database(args)
+                continue
+            if missing or time.monotonic() >= deadline:
+                raise
+            print("Waiting for PostgreSQL...", flush=True)
+            time.sleep(1)
+
+
+def create_database(args):
+    dsn = psycopg2.extensions.parse_dsn(args.dsn)
+    name = dsn.pop("dbname", None) or os.getenv("PGDATABASE")
+    conn = psycopg2.connect(**dsn, dbname="postgres")
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if not cursor.fetchone():
+                print(f"Creating database {name}")
+                cursor.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        conn.close()
+
+
+class Runner:
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+
+    def retrying(self, what, attempt_once):
+        """Runs `attempt_once()`, retried with a backoff while it times out on a lock."""
+        for attempt in range(self.args.retries + 1):
+            try:
+                return attempt_once()
+            except RETRYABLE as e:
+                if not self.conn.autocommit:
+                    self.conn.rollback()
+                if attempt == self.args.retries:
+                    raise
+                delay = self.args.retry_delay * (2 ** min(attempt, 6)) * (0.5 + random.random() / 2)
+                print(f"  🔒 {what}: {type(e).__name__}, retry {attempt + 1}/{self.args.retries} in {delay:.1f}s",
+                      flush=True)
+                time.sleep(delay)
+
+    def applied(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT version, checksum, applied_at IS NOT NULL, backfill_position FROM schema_migrations")
+            rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        self.conn.commit()
+        return rows
+
+    def record(self, cursor, migration, started):
+        cursor.execute(
+            """
+            INSERT INTO schema_migrations (version, checksum, applied_at, duration_ms)
+            VALUES (%s, %s, NOW(), %s)
+            ON CONFLICT (version) DO UPDATE
+                SET checksum = EXCLUDED.checksum, applied_at = NOW(), duration_ms = EXCLUDED.duration_ms
+            """,
+            (migration.version, migration.checksum, int((time.monotonic() - started) * 1000))
+        )
+
+    def run_in_transaction(self, migration):
+        started = time.monotonic()
+
+        def attempt():
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", (self.args.lock_timeout,))
+                cursor.execute(migration.sql)
+                self.record(cursor, migration, started)
+            self.conn.commit()
+        self.retrying(migration.version, attempt)
+
+    def run_statements(self, migration):
+        started = time.monotonic()
+        self.conn.autocommit = True
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, false)", (self.args.lock_timeout,))
+                for statement in split_statements(migration.sql):
+                    index = CONCURRENT_INDEX.search(statement)
+
+                    def attempt(statement=statement, index=index):
+                        if index:
+                            self.drop_invalid_index(cursor, index.group(1))
+                        cursor.execute(statement)
+                    label = split_statements(re.sub(r"^\s*--[^\n]*\n", "", statement, flags=re.M))[0]
+                    self.retrying(f"{migration.version}: {label.splitlines()[0][:60]}", attempt)
+                self.record(cursor, migration, started)
+                cursor.execute("SELECT set_config('lock_timeout', '0', false)")
+        finally:
+            self.conn.autocommit = False
+
+    @staticmethod
+    def drop_invalid_index(cursor, name):
+        """Drops the invalid index an interrupted CREATE INDEX CONCURRENTLY leaves behind."""
+        cursor.execute(
+            "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+        row = cursor.fetchone()
+        if row and row[0]:
+            print(f"  🧹 dropping invalid index {name}", flush=True)
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    def load(self):
+        """Replication lag of the slowest standby, in seconds, and active client sessions."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(EXTRACT(EPOCH FROM MAX(replay_lag)), 0) FROM pg_stat_replication")
+            lag = float(cursor.fetchone()[0])
+            cursor.execute(
+                "SELECT COUNT(*) FROM pg_stat_activity WHERE state = 'active' "
+                "AND backend_type = 'client backend' AND pid <> pg_backend_pid()")
+            active = cursor.fetchone()[0]
+        self.conn.commit()
+        return lag, active
+
+    def throttle(self):
+        while True:
+            lag, active = self.load()
+            if lag <= self.args.max_replication_lag and active <= self.args.max_active_sessions:
+                return
+            print(f"  ⏸️  replication lag {lag:.1f}s, {active} active sessions: waiting", flush=True)
+            time.sleep(1)
+
+    def run_backfill(self, migration, position):
+        options = migration.backfill
+        missing = set(PLACEHOLDER.findall(migration.sql)) - {"start", "end"} - set(self.args.params)
+        if missing:
+            raise RuntimeError(f"{migration.version} needs --param {', '.join(sorted(missing))}")
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"SELECT MIN({options['key']}), MAX({options['key']}) FROM {options['table']}")
+            low, high = cursor.fetchone()
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+                (migration.version, migration.checksum))
+        self.conn.commit()
+
+        started = time.monotonic()
+        start = low if position is None else position + 1
+        batch = options["batch"]
+        rows = 0
+        while low is not None and start <= high:
+            self.throttle()
+            end = min(start + batch - 1, high)
+            batch_started = time.monotonic()
+
+            def attempt(start=start, end=end):
+                with self.conn.cursor() as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (self.args.lock_timeout,))
+                    cursor.execute(migration.sql, {**self.args.params, "start": start, "end": end})
+                    count = max(cursor.rowcount, 0)
+                    cursor.execute("UPDATE schema_migrations SET backfill_position = %s WHERE version = %s",
+                                   (end, migration.version))
+                self.conn.commit()
+                return count
+            rows += self.retrying(f"{migration.version} [{start}, {end}]", attempt)
+
+            elapsed = time.monotonic() - batch_started
+            print(f"  {options['key']} {end}/{high}: {rows} rows, batch {batch} in {elapsed:.2f}s", flush=True)
+            # Next batch sized to --batch-seconds, then rest to keep the duty cycle
+            ratio = self.args.batch_seconds / max(elapsed, 1e-3)
+            batch = int(max(1, min(self.args.max_batch, batch * min(2.0, max(0.5, ratio)))))
+            time.sleep(elapsed * (1 - self.args.duty_cycle) / self.args.duty_cycle)
+            start = end + 1
+
+        with self.conn.cursor() as cursor:
+            self.record(cursor, migration, started)
+        self.conn.commit()
+
+    def up(self, migrations):
+        applied = self.applied()
+        for migration in migrations:
+            checksum, done, position = applied.get(migration.version, (None, False, None))
+            if done:
+                if checksum != migration.checksum:
+                    raise RuntimeError(f"{migration.version} was changed after it was applied: "
+                                       "write a new migration instead")
+                continue
+            mode = ("backfill" if migration.backfill else
+                    "transaction" if migration.transaction else "no transaction")
+            print(f"▶️  {migration.version} ({mode})", flush=True)
+            started = time.monotonic()
+            if migration.backfill:
+                self.run_backfill(migration, position)
+            elif migration.transaction:
+                self.run_in_transaction(migration)
+            else:
+                self.run_statements(migration)
+            print(f"✅ {migration.version} applied in {time.monotonic() - started:.1f}s", flush=True)
+
+    def status(self, migrations):
+        applied = self.applied()
+        for migration in migrations:
+            checksum, done, position = applied.get(migration.version, (None, False, None))
+            if done:
+                state = "applied" if checksum == migration.checksum else "CHANGED since applied"
+            elif position is not None:
+                state = f"backfill interrupted after key {position}"
+            else:
+                state = "pending"
+            print(f"{migration.version:<40} {state}")
+
+
+def main():
+    args = parse_args()
+    try:
+        migrations = load_migrations(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 2
+    if not migrations:
+        print("❌ No migration found")
+        return 2
+
+    conn = connect(args)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK,))
+            if not cursor.fetchone()[0]:
+                print("❌ Another migration runner holds the lock")
+                return 1
+            cursor.execute(SCHEMA)
+        conn.commit()
+        runner = Runner(conn, args)
+        if args.command == "status":
+            runner.status(migrations)
+        else:
+            runner.up(migrations)
+            print("✅ Database is up to date")
+    except (psycopg2.Error, RuntimeError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,13 +13,20 @@ export interface OpenFaaSResponse<T = any> {
   [key: string]: any;
 }
 
+export interface ConditionalResponse<T = any> {
+  notModified: boolean;
+  etag: string | null;
+  result: OpenFaaSResponse<T> | null;
+}
+
 export class OpenFaaSClient {
   /**
    * Make a request to an OpenFaaS function
    */
   static async callFunction<T = any>(
     functionName: string, 
-    payload: any
+    payload: any,
+    extraHeaders: Record<string, string> = {}
   ): Promise<OpenFaaSResponse<T>> {
     try {
       console.log(`Calling OpenFaaS function: ${functionName}`);
@@ -29,6 +36,7 @@ export class OpenFaaSClient {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...extraHeaders
         },
         body: JSON.stringify(payload),
       });
@@ -59,6 +67,77 @@ export class OpenFaaSClient {
     }
   }
 
+  /**
+   * Make a conditional request to an OpenFaaS function: a 304 Not Modified
+   * answer is reported as such instead of being treated as an error
+   */
+  static async callFunctionConditional<T = any>(
+    functionName: string,
+    payload: any,
+    extraHeaders: Record<string, string> = {}
+  ): Promise<ConditionalResponse<T>> {
+    try {
+      const response = await fetch(`${OPENFAAS_GATEWAY}/${functionName}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          ...extraHeaders
+        },
+        body: JSON.stringify(payload),
+      });
+      const etag = response.headers.get('etag');
+
+      if (response.status === 304) {
+        return { notModified: true, etag, result: null };
+      }
+
+      if (!response.ok) {
+        const errorText = await response.text();
+        console.error(`OpenFaaS function ${functionName} error: ${response.status} - ${errorText}`);
+
+        return {
+          notModified: false,
+          etag: null,
+          result: {
+            status: 'error',
+            message: `Function error: ${response.status}`,
+            error: errorText
+          }
+        };
+      }
+
+      return { notModified: false, etag, result: await response.json() };
+    } catch (error) {
+      console.error(`Error calling OpenFaaS function ${functionName}:`, error);
+
+      return {
+        notModified: false,
+        etag: null,
+        result: {
+          status: 'error',
+          message: 'Internal server error',
+          error: error instanceof Error ? error.message : 'Unknown error'
+        }
+      };
+    }
+  }
+
+  /**
+   * Headers from the incoming request that must reach the function
+   */
+  static forwardedHeaders(request: Request): Record<string, string> {
+    const headers: Record<string, string> = {};
+    const idempotencyKey = request.headers.get('idempotency-key');
+    if (idempotencyKey) {
+      headers['Idempotency-Key'] = idempotencyKey;
+    }
+    const ifNoneMatch = request.headers.get('if-none-match');
+    if (ifNoneMatch) {
+      headers['If-None-Match'] = ifNoneMatch;
+    }
+    return headers;
+  }
+
   /**
    * Validate common request parameters
    */
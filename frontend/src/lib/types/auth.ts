@@ -3,6 +3,9 @@ export interface User {
   username: string;
   has_2fa: boolean;
   expired: boolean;
+  // Signed session token from authenticate-user, when the functions issue one
+  token?: string;
+  token_expires_at?: number;
 }
 
 export interface AuthResponse {
@@ -10,6 +13,8 @@ export interface AuthResponse {
   message: string;
   user_id?: number;
   has_2fa?: boolean;
+  token?: string;
+  token_expires_at?: number;
   error?: string;
 }
 
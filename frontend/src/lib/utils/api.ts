@@ -9,7 +9,11 @@ import type {
 const API_BASE = '/api/auth';
 
 export class AuthAPI {
-  private static async makeRequest<T>(endpoint: string, data: any): Promise<T> {
+  private static async makeRequest<T>(
+    endpoint: string, 
+    data: any, 
+    extraHeaders: Record<string, string> = {}
+  ): Promise<T> {
     try {
       console.log(`Making API request to SvelteKit endpoint: ${API_BASE}/${endpoint}`);
       
@@ -17,7 +21,8 @@ export class AuthAPI {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'Accept': 'application/json'
+          'Accept': 'application/json',
+          ...extraHeaders
         },
         body: JSON.stringify(data),
       });
@@ -39,12 +44,28 @@ export class AuthAPI {
     }
   }
 
-  static async createUser(username: string): Promise<CreateUserResponse> {
-    return this.makeRequest<CreateUserResponse>('create-user', { username });
+  /**
+   * Retrying with the same idempotency key replays the first response
+   * instead of running the function again.
+   */
+  private static idempotencyHeaders(idempotencyKey?: string): Record<string, string> {
+    return idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {};
   }
 
-  static async setup2FA(username: string): Promise<Generate2FAResponse> {
-    return this.makeRequest<Generate2FAResponse>('setup-2fa', { username });
+  static async createUser(username: string, idempotencyKey?: string): Promise<CreateUserResponse> {
+    return this.makeRequest<CreateUserResponse>(
+      'create-user', 
+      { username }, 
+      this.idempotencyHeaders(idempotencyKey)
+    );
+  }
+
+  static async setup2FA(username: string, idempotencyKey?: string): Promise<Generate2FAResponse> {
+    return this.makeRequest<Generate2FAResponse>(
+      'setup-2fa', 
+      { username }, 
+      this.idempotencyHeaders(idempotencyKey)
+    );
   }
 
   static async authenticate(
@@ -59,7 +80,47 @@ export class AuthAPI {
     return this.makeRequest<AuthResponse>('authenticate', payload);
   }
 
+  // Last status and ETag per username, revalidated with If-None-Match
+  private static statusCache = new Map<string, { etag: string; status: CheckUserResponse }>();
+
+  /**
+   * Repeated checks of the same user send the last ETag: an unchanged
+   * status comes back as 304 without a body and the cached one is returned.
+   */
   static async checkUserStatus(username: string): Promise<CheckUserResponse> {
-    return this.makeRequest<CheckUserResponse>('check-user', { username });
+    const cached = this.statusCache.get(username);
+    try {
+      const response = await fetch(`${API_BASE}/check-user`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Accept': 'application/json',
+          ...(cached ? { 'If-None-Match': cached.etag } : {})
+        },
+        body: JSON.stringify({ username }),
+      });
+
+      if (response.status === 304 && cached) {
+        return cached.status;
+      }
+
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ message: 'Unknown error' }));
+        console.error(`HTTP ${response.status}:`, errorData);
+        throw new Error(`HTTP error! status: ${response.status}, message: ${errorData.message || 'Unknown error'}`);
+      }
+
+      const status: CheckUserResponse = await response.json();
+      const etag = response.headers.get('etag');
+      if (etag) {
+        this.statusCache.set(username, { etag, status });
+      } else {
+        this.statusCache.delete(username);
+      }
+      return status;
+    } catch (error) {
+      console.error('API Error (check-user):', error);
+      throw error;
+    }
   }
 }
@@ -17,14 +17,23 @@ export const POST: RequestHandler = async ({ request }) => {
 
     console.log(`Proxying check-user-status request for user: ${body.username}`);
     
-    // Call OpenFaaS function via internal cluster DNS
-    const result = await OpenFaaSClient.callFunction('check-user-status', body);
+    // Call OpenFaaS function via internal cluster DNS, forwarding If-None-Match
+    const { notModified, etag, result } = await OpenFaaSClient.callFunctionConditional(
+      'check-user-status', 
+      body, 
+      OpenFaaSClient.forwardedHeaders(request)
+    );
+    const headers: Record<string, string> = etag ? { ETag: etag } : {};
+    
+    if (notModified) {
+      return new Response(null, { status: 304, headers });
+    }
     
-    if (result.status === 'error') {
+    if (!result || result.status === 'error') {
       return json(result, { status: 500 });
     }
     
-    return json(result);
+    return json(result, { headers });
   } catch (error) {
     console.error('Error in check-user-status proxy:', error);
     return json(
@@ -18,7 +18,11 @@ export const POST: RequestHandler = async ({ request }) => {
     console.log(`Proxying generate-2fa request for user: ${body.username}`);
     
     // Call OpenFaaS function via internal cluster DNS
-    const result = await OpenFaaSClient.callFunction('generate-2fa', body);
+    const result = await OpenFaaSClient.callFunction(
+      'generate-2fa', 
+      body, 
+      OpenFaaSClient.forwardedHeaders(request)
+    );
     
     if (result.status === 'error') {
       return json(result, { status: 500 });
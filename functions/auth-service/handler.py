@@ -0,0 +1,60 @@
+"""
+Ce module fournit une fonction OpenFaaS regroupant les quatre fonctions
+d'authentification dans un seul processus.
+
+Les handlers de `generate-password`, `generate-2fa`, `authenticate-user` et
+`check-user-status` sont chargés tels quels (voir `common.loader`) et la requête
+est routée selon son chemin :
+
+- `/generate-password`
+- `/generate-2fa`
+- `/authenticate-user`
+- `/check-user-status`
+
+`GET /metrics` renvoie l'état de la limite de concurrence de la réplique
+(voir `common.limiter`), commune aux quatre fonctions.
+
+Les quatre handlers partagent le même paquet `common`, donc le même pool de
+connexions, la même configuration et le même état chaud. Le contrat de
+requête et de réponse de chaque fonction est inchangé ; les images séparées
+de `stack.yaml` restent utilisables (voir `stack.auth-service.yaml`).
+"""
+import os
+import json
+from .common import limiter
+from .common.loader import load_handler
+
+FUNCTIONS = ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Loaded at import time so the pre-forking server shares them between workers
+ROUTES = {
+    f"/{name}": load_handler(os.path.join(_BASE_DIR, name)).handle
+    for name in FUNCTIONS
+}
+
+def handle(event, context):
+    """Point d'entrée principal du service regroupé.
+
+    Args:
+        event: L'objet événement contenant les détails de la requête. Son chemin
+               (`event.path`) désigne la fonction à appeler.
+        context: L'objet contexte d'exécution, transmis tel quel au handler.
+
+    Returns:
+        dict: La réponse HTTP du handler désigné, ou une erreur 404 si le chemin est inconnu.
+    """
+    if limiter.is_metrics_request(event):
+        return limiter.metrics_response()
+    path = (getattr(event, 'path', None) or '/').rstrip('/')
+    target = ROUTES.get(path)
+    if target is None:
+        return {
+            "statusCode": 404,
+            "body": json.dumps({
+                "error": f"Unknown function path: {path or '/'}",
+                "available": sorted(ROUTES)
+            })
+        }
+    return target(event, context)
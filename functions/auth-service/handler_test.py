@@ -0,0 +1,29 @@
+import json
+
+from .handler import handle
+
+
+class Event:
+    def __init__(self, path, body=b''):
+        self.path = path
+        self.body = body
+        self.headers = {}
+
+
+def test_unknown_path_returns_404():
+    response = handle(Event('/unknown'), None)
+    assert response["statusCode"] == 404
+    assert "/check-user-status" in json.loads(response["body"])["available"]
+
+
+def test_request_is_routed_with_its_contract():
+    response = handle(Event('/check-user-status/', b'{not json'), None)
+    assert response["statusCode"] == 400
+    assert json.loads(response["body"]) == {"error": "Invalid JSON in request body"}
+
+
+def test_handlers_share_common_modules():
+    import sys
+    pools = {sys.modules[f"{name.replace('-', '_')}.common.db"] for name in
+             ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]}
+    assert len(pools) == 1
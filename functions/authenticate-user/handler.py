@@ -7,73 +7,13 @@ la gestion de l'expiration         if not user:
                 "body": json.dumps({"error": "Invalid credentials"})
             }mptes et l'interaction avec une base de données PostgreSQL.
 """
-import os
 import json
-import bcrypt
 import pyotp
-import psycopg2
-from psycopg2 import sql
-from cryptography.fernet import Fernet, InvalidToken
 from datetime import datetime, timezone, timedelta
-from dotenv import load_dotenv
+from .common import capture, config, db, deadline, hashing, limiter, repository, responses, tokens, validation
+from .common.crypto import decrypt_secret
 
 
-# Load environment variables at module level
-load_dotenv()
-
-# Constants
-ACCOUNT_EXPIRY_DAYS = 180  # 6 mois
-
-def get_db_connection():
-    """Crée et retourne une connexion à la base de données."""
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', '5432')
-        )
-        return conn
-    except Exception as e:
-        raise Exception(f"Failed to connect to database: {str(e)}")
-
-def get_encryption_key():
-    """Récupère la clé de chiffrement à partir des variables d'environnement."""
-    key = os.getenv('ENCRYPTION_KEY')
-    if not key:
-        raise ValueError("ENCRYPTION_KEY environment variable not set")
-    
-    # Ensure the key is the correct length (32 bytes, base64-encoded)
-    key = key.encode('utf-8')
-    if len(key) != 44:  # 32 bytes = 44 base64 characters
-        raise ValueError("ENCRYPTION_KEY must be 32 bytes, base64-encoded")
-    
-    return key
-
-def decrypt_secret(encrypted_secret):
-    """Déchiffre le secret TOTP.
-
-    Args:
-        encrypted_secret (str): Le secret chiffré encodé en base64.
-
-    Returns:
-        str or None: Le secret déchiffré, ou None si aucun secret chiffré n'est fourni.
-
-    Raises:
-        ValueError: Si la clé de chiffrement n'est pas définie ou si le jeton est invalide.
-    """
-    if not encrypted_secret:
-        return None
-        
-    key = get_encryption_key()
-    f = Fernet(key)
-    try:
-        decrypted = f.decrypt(encrypted_secret.encode('utf-8'))
-        return decrypted.decode('utf-8')
-    except InvalidToken:
-        raise ValueError("Invalid encryption token")
-
 def check_password(stored_password, provided_password):
     """Vérifie le mot de passe fourni par rapport au mot de passe stocké.
 
@@ -88,7 +28,7 @@ def check_password(stored_password, provided_password):
         ValueError: Si la vérification du mot de passe échoue pour une raison inattendue.
     """
     try:
-        return bcrypt.checkpw(provided_password.encode('utf-8'), stored_password.encode('utf-8'))
+        return hashing.check_password(provided_password, stored_password)
     except Exception as e:
         raise ValueError(f"Password verification failed: {str(e)}")
 
@@ -127,10 +67,20 @@ def is_account_expired(gendate_timestamp):
         return True
         
     creation_date = datetime.fromtimestamp(gendate_timestamp / 1000, timezone.utc)
-    expiry_date = creation_date + timedelta(days=ACCOUNT_EXPIRY_DAYS)
+    expiry_date = creation_date + timedelta(days=config.get().account_expiry_days)
     return datetime.now(timezone.utc) > expiry_date
 
 
+LOGIN = validation.Schema(required=('username', 'password'), optional=('totp_code', 'context'),
+                          missing="Username and password are required")
+# Password is not required for 2FA setup verification
+SETUP = validation.Schema(required=('username', 'totp_code'), optional=('password', 'context'),
+                          missing="Username and TOTP code are required for 2FA setup verification")
+
+
+@capture.captured('authenticate-user')
+@limiter.limited('authenticate-user')
+@deadline.bounded('authenticate-user')
 def handle(event, context):
     """Point d'entrée principal pour la fonction d'authentification OpenFaaS.
 
@@ -139,17 +89,21 @@ def handle(event, context):
 
     Le processus comprend :
     1. Analyse de la requête entrante.
-    2. Validation des entrées (nom d'utilisateur et mot de passe).
-    3. Connexion à la base de données.
-    4. Récupération des informations de l'utilisateur.
-    5. Vérification du mot de passe.
-    6. Si l'authentification à deux facteurs (2FA) est activée :
+    2. Validation des entrées selon le contexte (`common.validation`), avant toute lecture.
+    3. Récupération des informations de l'utilisateur dans le dépôt (`common.repository`).
+    4. Vérification du mot de passe.
+    5. Si l'authentification à deux facteurs (2FA) est activée :
         a. Vérification de la présence du code TOTP.
         b. Déchiffrement du secret MFA stocké.
         c. Vérification du code TOTP.
-    7. Vérification de l'expiration du compte (basée sur la date de création et un indicateur 'expired').
-    8. Mise à jour de l'état d'expiration dans la base de données si nécessaire.
-    9. Renvoi d'une réponse HTTP appropriée (succès, échec, compte expiré, etc.).
+    6. Vérification de l'expiration du compte (basée sur la date de création et un indicateur 'expired').
+    7. Mise à jour de l'état d'expiration dans le dépôt si nécessaire.
+    8. Renvoi d'une réponse HTTP appropriée (succès, échec, compte expiré, etc.).
+       Une connexion réussie reçoit un jeton de session signé (`common.tokens`)
+       lorsque `SESSION_KEYS` est défini.
+
+    Les lectures et la vérification bcrypt sont bornées par l'échéance de la
+    requête (`common.deadline`) : une fois dépassée, la réponse est un 504.
 
     Args:
         event: L'objet événement contenant les détails de la requête (par exemple, corps, en-têtes).
@@ -162,51 +116,22 @@ def handle(event, context):
               Le corps est une chaîne JSON avec des détails sur le résultat de l'authentification.
     """
     
-    conn = None
-    cursor = None
     try:
-        # Parse incoming request
+        # Parse and validate the request based on its context
         try:
-            body = json.loads(event.body) if hasattr(event, 'body') and event.body else {}
-            username = body.get('username')
-            password = body.get('password')
-            totp_code = body.get('totp_code')
-            context_param = body.get('context')  # Get the context
-        except json.JSONDecodeError:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Invalid JSON in request body"})
-            }
-        
-        # Validate input based on context
-        if context_param == '2fa_setup_verification':
-            if not username or not totp_code:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Username and TOTP code are required for 2FA setup verification"})
-                }
-            # Password is not required for 2FA setup verification
-        else:  # Normal login
-            if not username or not password:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Username and password are required"})
-                }
-        
-        # Connect to database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+            body = validation.parse_body(event)
+            context_param = body.get('context')
+            schema = SETUP if context_param == '2fa_setup_verification' else LOGIN
+            fields = schema.validate(body)
+        except validation.ValidationError as e:
+            return responses.invalid_request(e)
+        username = fields['username']
+        password = fields['password']
+        totp_code = fields['totp_code']
         
         # Get user data
-        cursor.execute(
-            """
-            SELECT id, password, mfa, gendate, expired 
-            FROM users 
-            WHERE username = %s
-            """,
-            (username,)
-        )
-        user = cursor.fetchone()
+        users = repository.get_repository()
+        user = users.get_user_auth(username)
         
         if not user:
             return {
@@ -236,8 +161,7 @@ def handle(event, context):
                 # Check account expiration before confirming setup
                 is_expired_by_time_setup = is_account_expired(gendate)
                 if is_expired_by_time_setup and not is_expired:
-                    cursor.execute("UPDATE users SET expired = TRUE WHERE id = %s", (user_id,))
-                    conn.commit()
+                    users.mark_expired(username)
                     is_expired = True
                 
                 if is_expired or is_expired_by_time_setup:
@@ -255,6 +179,8 @@ def handle(event, context):
                         "has_2fa": True
                     })
                 }
+            except deadline.DeadlineExceeded:
+                raise
             except Exception as e:
                 return {
                     "statusCode": 500,
@@ -264,7 +190,8 @@ def handle(event, context):
 
         # --- Normal Login Logic (if not 2fa_setup_verification context) ---
         # Check password
-        password_valid = check_password(stored_password, password)
+        with deadline.step('bcrypt'):
+            password_valid = check_password(stored_password, password)
         if not password_valid:
             return {
                 "statusCode": 401,
@@ -300,14 +227,7 @@ def handle(event, context):
         
         # Update expired status if needed
         if is_expired_by_time and not is_expired:
-            update_query = """
-                UPDATE users 
-                SET expired = TRUE 
-                WHERE id = %s
-                RETURNING expired
-            """
-            cursor.execute(update_query, (user_id,))
-            conn.commit()
+            users.mark_expired(username)
             is_expired = True
         
         # Prepare response
@@ -321,27 +241,28 @@ def handle(event, context):
             }
         
         # Authentication successful
+        result = {
+            "status": "success",
+            "message": "Authentication successful",
+            "user_id": user_id,
+            "has_2fa": bool(encrypted_mfa)
+        }
+        if tokens.enabled():
+            result["token"], result["token_expires_at"] = tokens.issue(user_id, username, bool(encrypted_mfa))
         return {
             "statusCode": 200,
-            "body": json.dumps({
-                "status": "success",
-                "message": "Authentication successful",
-                "user_id": user_id,
-                "has_2fa": bool(encrypted_mfa)
-            })
+            "body": json.dumps(result)
         }
         
+    except db.DatabaseUnavailable as e:
+        return responses.service_unavailable(e)
+        
+    except deadline.DeadlineExceeded:
+        return responses.deadline_exceeded()
+        
     except Exception as e:
-        if conn:
-            conn.rollback()
         error_msg = str(e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"An error occurred: {error_msg}"})
         }
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
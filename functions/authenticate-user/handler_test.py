@@ -1,3 +1,9 @@
+import json
+import time
+
+import bcrypt
+
+from . import handler
 from .handler import handle
 
 # Test your handler here
@@ -8,3 +14,41 @@ from .handler import handle
 def test_handle():
     # assert handle("input") == "input"
     pass
+
+
+class Event:
+    def __init__(self, payload):
+        self.body = json.dumps(payload).encode()
+        self.headers = {}
+        self.method = "POST"
+        self.query = {}
+        self.path = "/"
+
+
+def test_authenticate_against_memory_repository(monkeypatch):
+    users = handler.repository.MemoryRepository()
+    monkeypatch.setattr(handler.repository, "get_repository", lambda: users)
+    password_hash = bcrypt.hashpw(b"Passw0rd!", bcrypt.gensalt(rounds=4)).decode()
+    users.create_user("alice", password_hash, int(time.time() * 1000))
+    users.create_user("bob", password_hash, int((time.time() - 400 * 86400) * 1000))
+
+    assert handle(Event({"username": "alice", "password": "Passw0rd!"}), None)["statusCode"] == 200
+    assert handle(Event({"username": "alice", "password": "wrong"}), None)["statusCode"] == 401
+    assert handle(Event({"username": "carol", "password": "Passw0rd!"}), None)["statusCode"] == 401
+    assert handle(Event({"username": "bob", "password": "Passw0rd!"}), None)["statusCode"] == 403
+    assert users.get_user_auth("bob").expired is True
+
+
+def test_successful_login_returns_a_session_token(monkeypatch):
+    users = handler.repository.MemoryRepository()
+    monkeypatch.setattr(handler.repository, "get_repository", lambda: users)
+    cfg = handler.config.Config({"SESSION_KEYS": "k1:" + "a" * 43})
+    monkeypatch.setattr(handler.config, "get", lambda: cfg)
+    password_hash = bcrypt.hashpw(b"Passw0rd!", bcrypt.gensalt(rounds=4)).decode()
+    user_id = users.create_user("alice", password_hash, int(time.time() * 1000))
+
+    body = json.loads(handle(Event({"username": "alice", "password": "Passw0rd!"}), None)["body"])
+
+    claims = handler.tokens.verify(body["token"])
+    assert claims["sub"] == str(user_id)
+    assert claims["exp"] == body["token_expires_at"]
@@ -1,30 +1,54 @@
 """
 Ce module fournit une fonction OpenFaaS pour vérifier le statut d'un utilisateur.
-Il interroge la base de données pour déterminer si un utilisateur existe,
+Il interroge le dépôt des comptes (`common.repository`) pour déterminer si un utilisateur existe,
 si son compte a expiré et s'il a activé l'authentification à deux facteurs (2FA).
+
+Chaque réponse pour un compte existant porte un `ETag` dérivé de la version
+de la ligne (colonne `version`, incrémentée à chaque écriture) : une requête
+avec `If-None-Match` reçoit `304` après une simple lecture de cette version.
+
+Une requête `GET` avec `?format=csv` ou `?format=ndjson` exporte le statut de
+tous les comptes (voir `handle_export`).
 """
-import os
+import io
+import csv
+import hmac
+import itertools
 import json
-import psycopg2
-from psycopg2 import sql
-from datetime import datetime, timezone
-from dotenv import load_dotenv
-
-def get_db_connection():
-    """Crée et retourne une connexion à la base de données."""
-    load_dotenv()
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', '5432')
-        )
-        return conn
-    except Exception as e:
-        raise Exception(f"Failed to connect to database: {str(e)}")
+from .common import capture, config, db, deadline, limiter, repository, responses, validation
+from .common.events import get_header
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson"
+}
+EXPORT_FIELDS = ["username", "exists", "expired", "has_2fa"]
+
+def make_etag(user_id, version):
+    """ETag d'un compte : identifiant et version de la ligne."""
+    return f'"{user_id}.{version}"'
+
+def etag_matches(if_none_match, etag):
+    """Indique si l'en-tête `If-None-Match` désigne `etag` (comparaison faible)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
 
+REQUEST = validation.Schema(required=('username',), missing="Username is required")
+
+
+def account_status(status):
+    """Construit le statut d'un compte existant à partir d'un `repository.UserStatus`."""
+    return {
+        "exists": True,
+        "expired": bool(status.expired or status.expired_by_time),
+        "has_2fa": bool(status.has_2fa)
+    }
+
+@capture.captured('check-user-status')
+@limiter.limited('check-user-status')
+@deadline.bounded('check-user-status')
 def handle(event, context):
     """Point d'entrée principal pour la fonction de vérification du statut de l'utilisateur.
 
@@ -32,15 +56,15 @@ def handle(event, context):
     Il attend un corps JSON contenant 'username'.
 
     Le processus comprend :
-    1. Analyse de la requête entrante pour obtenir le nom d'utilisateur.
-    2. Connexion à la base de données.
-    3. Interrogation de la base de données pour obtenir les informations sur l'utilisateur :
+    1. Analyse et validation de la requête entrante (`common.validation`).
+    2. Avec `If-None-Match`, lecture de la seule version du compte et réponse 304 si elle n'a pas changé.
+    3. Lecture du statut de l'utilisateur dans le dépôt :
         - Si l'authentification à deux facteurs (2FA) est activée.
         - Si le compte est marqué comme expiré.
         - Si le compte a expiré en fonction de sa date de création (plus de 6 mois).
     4. Si le compte a expiré en fonction du temps et n'est pas déjà marqué comme expiré,
-       mise à jour de l'indicateur d'expiration dans la base de données.
-    5. Renvoi d'une réponse HTTP avec le statut de l'utilisateur :
+       mise à jour de l'indicateur d'expiration dans le dépôt.
+    5. Renvoi d'une réponse HTTP avec le statut de l'utilisateur et son `ETag` :
         - 'exists': booléen indiquant si l'utilisateur existe.
         - 'expired': booléen indiquant si le compte est expiré.
         - 'has_2fa': booléen indiquant si la 2FA est activée.
@@ -54,42 +78,37 @@ def handle(event, context):
         dict: Un dictionnaire représentant la réponse HTTP, contenant 'statusCode' et 'body'.
               Le corps est une chaîne JSON avec les informations sur le statut de l'utilisateur.
     """
-    
-    conn = None
-    cursor = None
+    if getattr(event, 'method', None) == 'GET' and (getattr(event, 'query', None) or {}).get('format'):
+        return handle_export(event)
+
     try:
-        # Parse incoming request
+        # Parse and validate the request before any I/O
         try:
-            body = json.loads(event.body) if hasattr(event, 'body') and event.body else {}
-            username = body.get('username')
-        except json.JSONDecodeError:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Invalid JSON in request body"})
-            }
+            username = REQUEST.parse(event)['username']
+        except validation.ValidationError as e:
+            return responses.invalid_request(e)
         
-        if not username:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Username is required"})
-            }
+        users = repository.get_repository()
+        expiry_days = config.get().account_expiry_days
         
-        # Connect to database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Conditional request: answer 304 from the row version alone when nothing changed.
+        # A stale version (expired by time, not flagged yet) is about to change: run the full check.
+        if_none_match = get_header(event, 'If-None-Match')
+        if if_none_match:
+            current = users.get_version(username, expiry_days)
+            if current and not current.stale:
+                etag = make_etag(current.id, current.version)
+                if etag_matches(if_none_match, etag):
+                    return {
+                        "statusCode": 304,
+                        "headers": {"ETag": etag},
+                        "body": ""
+                    }
         
         # Query user status
-        query = sql.SQL("""
-            SELECT mfa IS NOT NULL, expired, 
-                   EXTRACT(EPOCH FROM NOW() - to_timestamp(gendate/1000)) > (6 * 30 * 24 * 3600) as is_expired_by_time
-            FROM users 
-            WHERE username = %s
-        """)
-        
-        cursor.execute(query, (username,))
-        result = cursor.fetchone()
+        status = users.get_status(username, expiry_days)
         
-        if not result:
+        if not status:
             return {
                 "statusCode": 200,
                 "body": json.dumps({
@@ -99,44 +118,116 @@ def handle(event, context):
                 })
             }
         
-        has_2fa, is_expired, is_expired_by_time = result
-        
         # If account is expired by time, update the expired flag
-        if is_expired_by_time and not is_expired:
-            update_query = "UPDATE users SET expired = TRUE WHERE username = %s"
-            cursor.execute(update_query, (username,))
-            conn.commit()
-            is_expired = True
-        
-        cursor.close()
-        conn.close()
+        if status.expired_by_time and not status.expired:
+            version = users.mark_expired(username)
+            status = status._replace(expired=True, version=version or status.version)
         
         return {
             "statusCode": 200,
-            "body": json.dumps({
-                "exists": True,
-                "expired": bool(is_expired or is_expired_by_time),
-                "has_2fa": bool(has_2fa)
-            })
+            "headers": {"ETag": make_etag(status.id, status.version)},
+            "body": json.dumps(account_status(status))
         }
         
-    except Exception as e:
-        error_msg = str(e)
-        
-        # Clean up database connections safely
-        try:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
-        except Exception as cursor_error:
-            print(f"Error closing cursor: {cursor_error}")
+    except db.DatabaseUnavailable as e:
+        return responses.service_unavailable(e)
         
-        try:
-            if 'conn' in locals() and conn:
-                conn.close()
-        except Exception as conn_error:
-            print(f"Error closing connection: {conn_error}")
+    except deadline.DeadlineExceeded:
+        return responses.deadline_exceeded()
         
+    except Exception as e:
+        error_msg = str(e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"An error occurred: {error_msg}"})
         }
+
+
+def _export_rows(chunk_size, expiry_days):
+    """Parcourt le statut de tous les comptes par paquets d'au plus `chunk_size` comptes."""
+    for batch in repository.get_repository().iter_status(chunk_size, expiry_days):
+        yield [dict(username=username, **account_status(status)) for username, status in batch]
+
+
+def _csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(status) + "\n" for status in batch).encode('utf-8')
+
+
+def handle_export(event):
+    """Exporte le statut de tous les comptes en CSV ou en NDJSON.
+
+    L'export est désactivé tant que `EXPORT_TOKEN` n'est pas défini et exige
+    l'en-tête `Authorization: Bearer <EXPORT_TOKEN>`. Le corps de la réponse
+    est un générateur : le serveur pré-forké (`common.prefork`) l'envoie au fil
+    de la lecture, si bien que la mémoire utilisée ne dépend pas du nombre de
+    comptes. Les colonnes `password` et `mfa` ne sont jamais lues.
+
+    Args:
+        event: L'objet événement ; `event.query['format']` vaut `csv` ou `ndjson`.
+
+    Returns:
+        dict: La réponse HTTP, dont le corps est un itérable d'octets.
+    """
+    cfg = config.get()
+    token = cfg.export_token
+    if not token:
+        return {
+            "statusCode": 404,
+            "body": json.dumps({"error": "Export is disabled"})
+        }
+    authorization = get_header(event, 'Authorization', '')
+    if not hmac.compare_digest(authorization.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Invalid export token"})
+        }
+
+    export_format = event.query.get('format')
+    if export_format not in EXPORT_FORMATS:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": f"Unsupported export format, use one of: {', '.join(EXPORT_FORMATS)}"})
+        }
+
+    # Borrow the first connection now so an unavailable database still gets a proper 503
+    try:
+        batches = _export_rows(cfg.export_chunk_size, cfg.account_expiry_days)
+        first = next(batches, [])
+    except db.DatabaseUnavailable as e:
+        return responses.service_unavailable(e)
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": f"An error occurred: {str(e)}"})
+        }
+
+    def stream():
+        encode = _csv_chunks if export_format == "csv" else _ndjson_chunks
+        try:
+            yield from encode(itertools.chain([first] if first else [], batches))
+        finally:
+            # Releases the connection if the client disconnects mid-export
+            batches.close()
+
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": EXPORT_FORMATS[export_format],
+            "Content-Disposition": f'attachment; filename="user-status.{export_format}"'
+        },
+        "body": stream()
+    }
@@ -1,10 +1,158 @@
+import json
+import time
+
+from . import handler
 from .handler import handle
 
-# Test your handler here
 
-# To disable testing, you can set the build_arg `TEST_ENABLED=false` on the CLI or in your stack.yml
-# https://docs.openfaas.com/reference/yaml/#function-build-args-build-args
+class FakeEvent:
+    def __init__(self, fmt, token="secret"):
+        self.method = "GET"
+        self.query = {"format": fmt}
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.body = b""
+        self.path = "/"
+
+
+class FakeCursor:
+    def __init__(self, conn, name=None):
+        self.conn = conn
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.queries.append(query)
+
+    def fetchone(self):
+        return self.conn.rows.pop(0) if self.conn.rows else None
+
+    def close(self):
+        pass
+
+    def fetchmany(self, size):
+        batch, self.conn.rows = self.conn.rows[:size], self.conn.rows[size:]
+        return batch
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.queries = []
+
+    def cursor(self, name=None):
+        return FakeCursor(self, name)
+
+    def rollback(self):
+        pass
+
+    def commit(self):
+        pass
+
+
+def _patch_config(monkeypatch, **values):
+    cfg = handler.config.Config(values)
+    monkeypatch.setattr(handler.config, "get", lambda: cfg)
+
+
+def _patch_db(monkeypatch, rows):
+    conn = FakeConnection(rows)
+    released = []
+    _patch_config(monkeypatch, EXPORT_TOKEN="secret", EXPORT_CHUNK_SIZE="2", STORAGE_BACKEND="postgres")
+    monkeypatch.setattr(handler.db, "database_targets", lambda: ["default"])
+    monkeypatch.setattr(handler.db, "get_target_connection", lambda target: conn)
+    monkeypatch.setattr(handler.db, "release_db_connection", released.append)
+    return conn, released
+
+
+ROWS = [
+    ("alice", 1, 1, True, False, False),
+    ("bob", 2, 1, False, False, True),
+    ("carol, jr", 3, 2, False, True, False),
+]
+
+
+def test_export_csv_streams_every_row(monkeypatch):
+    conn, released = _patch_db(monkeypatch, ROWS)
+
+    response = handle(FakeEvent("csv"), None)
+    body = b"".join(response["body"]).decode("utf-8")
+
+    assert response["statusCode"] == 200
+    assert body.splitlines() == [
+        "username,exists,expired,has_2fa",
+        "alice,True,False,True",
+        "bob,True,True,False",
+        '"carol, jr",True,True,False',
+    ]
+    assert released == [conn]
+    assert not any("password" in query or "SELECT mfa," in query for query in conn.queries)
+
+
+def test_export_ndjson_releases_connection_when_client_disconnects(monkeypatch):
+    conn, released = _patch_db(monkeypatch, ROWS)
+
+    response = handle(FakeEvent("ndjson"), None)
+    first = next(response["body"])
+    response["body"].close()
+
+    assert [json.loads(line)["username"] for line in first.decode("utf-8").splitlines()] == ["alice", "bob"]
+    assert released == [conn]
+
+
+def test_export_requires_token(monkeypatch):
+    _patch_db(monkeypatch, ROWS)
+
+    assert handle(FakeEvent("csv", token="wrong"), None)["statusCode"] == 401
+    _patch_config(monkeypatch)
+    assert handle(FakeEvent("csv"), None)["statusCode"] == 404
+
+
+class StatusEvent:
+    def __init__(self, if_none_match=None):
+        self.method = "POST"
+        self.query = {}
+        self.headers = {"If-None-Match": if_none_match} if if_none_match else {}
+        self.body = json.dumps({"username": "alice"}).encode()
+        self.path = "/"
+
+
+def _memory_repository(monkeypatch):
+    users = handler.repository.MemoryRepository()
+    _patch_config(monkeypatch)
+    monkeypatch.setattr(handler.repository, "get_repository", lambda: users)
+    return users
+
+
+def test_status_answers_304_until_the_account_changes(monkeypatch):
+    users = _memory_repository(monkeypatch)
+    users.create_user("alice", "hash", int(time.time() * 1000))
+
+    first = handle(StatusEvent(), None)
+    etag = first["headers"]["ETag"]
+    assert json.loads(first["body"]) == {"exists": True, "expired": False, "has_2fa": False}
+
+    assert handle(StatusEvent(f"W/{etag}"), None) == {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+    users.set_mfa("alice", "encrypted")
+    changed = handle(StatusEvent(etag), None)
+    assert changed["statusCode"] == 200
+    assert changed["headers"]["ETag"] != etag
+    assert json.loads(changed["body"])["has_2fa"] is True
+
+
+def test_status_flags_account_expired_by_time(monkeypatch):
+    users = _memory_repository(monkeypatch)
+    users.create_user("alice", "hash", int((time.time() - 200 * 86400) * 1000))
+    stale_etag = handler.make_etag(*users.get_version("alice", 180)[:2])
+
+    response = handle(StatusEvent(stale_etag), None)
 
-def test_handle():
-    # assert handle("input") == "input"
-    pass
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["expired"] is True
+    assert users.get_status("alice", 180).expired is True
+    assert response["headers"]["ETag"] == handler.make_etag(*users.get_version("alice", 180)[:2])
@@ -0,0 +1,10 @@
+"""
+Code partagé entre les fonctions OpenFaaS du projet.
+
+Ce paquet est copié dans le contexte de build de chaque fonction
+(voir `configuration.copy` dans `stack.yaml`) et s'importe depuis un handler
+avec un import relatif, par exemple `from .common import db`.
+
+Chaque sous-module n'importe que ses propres dépendances afin qu'une fonction
+n'ait à installer que les bibliothèques des modules qu'elle utilise.
+"""
@@ -0,0 +1,159 @@
+"""
+Capture optionnelle du trafic reçu par les handlers, pour le rejouer.
+
+Lorsque `CAPTURE_FILE` est défini, chaque requête (ou une fraction
+`CAPTURE_SAMPLE` d'entre elles) ajoute une ligne JSON à ce fichier : instant
+de réception, fonction, forme de la requête, statut et durée du handler. Le
+fichier est relu par `scripts/replay-traffic.py`.
+
+Seule la forme de la requête est conservée, jamais son contenu : les champs
+présents, le `context` d'`authenticate-user`, la présence d'un code TOTP.
+Le nom d'utilisateur et l'`Idempotency-Key` sont remplacés par une empreinte
+HMAC (clé `CAPTURE_SALT`) qui permet de relier les requêtes d'un même
+utilisateur sans le nommer ; mots de passe, codes, secrets et corps de
+réponse ne sont jamais écrits.
+
+Variables d'environnement :
+    CAPTURE_FILE: fichier NDJSON de capture ; la capture est désactivée sans lui.
+    CAPTURE_SAMPLE: fraction des requêtes capturées (par défaut 1).
+    CAPTURE_SALT: clé des empreintes ; à partager entre répliques pour relier
+        leurs captures (par défaut une clé aléatoire par processus maître).
+    CAPTURE_MAX_MB: taille au-delà de laquelle la capture s'arrête (par défaut 100).
+"""
+import functools
+import hashlib
+import hmac
+import json
+import os
+import random
+import secrets
+import time
+
+from .events import get_body, get_header
+
+CAPTURE_FILE = os.getenv('CAPTURE_FILE')
+CAPTURE_SAMPLE = float(os.getenv('CAPTURE_SAMPLE', '1'))
+CAPTURE_SALT = (os.getenv('CAPTURE_SALT') or secrets.token_hex(16)).encode('utf-8')
+CAPTURE_MAX_BYTES = int(float(os.getenv('CAPTURE_MAX_MB', '100')) * 1024 * 1024)
+
+# Response "status" values that are safe to record (never free text)
+_OUTCOMES = {"success", "expired"}
+
+_fd = None
+_fd_pid = None
+
+
+def pseudonym(value):
+    """Empreinte stable et non réversible d'un identifiant."""
+    if value is None:
+        return None
+    return hmac.new(CAPTURE_SALT, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+
+def _identifier(value):
+    """Conserve une valeur seulement si c'est un identifiant court (pas du texte libre)."""
+    if isinstance(value, str) and value.isidentifier() and len(value) <= 32:
+        return value
+    return None
+
+
+def describe_request(event):
+    """Forme assainie d'une requête : aucun secret n'en fait partie."""
+    body = get_body(event)
+    record = {
+        "method": getattr(event, 'method', None),
+        "query": sorted((getattr(event, 'query', None) or {}).keys()),
+        "body_bytes": len(body),
+        "idempotency_key": pseudonym(get_header(event, 'Idempotency-Key')),
+        "conditional": bool(get_header(event, 'If-None-Match')),
+    }
+    try:
+        payload = json.loads(body) if body else {}
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        record["invalid_json"] = True
+        return record
+    if not isinstance(payload, dict):
+        record["invalid_json"] = True
+        return record
+    record.update(
+        fields=sorted(key for key in payload
+                      if payload[key] not in (None, "") and key.isidentifier() and len(key) <= 32),
+        user=pseudonym(payload.get('username') or None),
+        context=_identifier(payload.get('context')),
+        has_totp=bool(payload.get('totp_code')),
+    )
+    return record
+
+
+def describe_response(response):
+    """Issue d'une réponse : statut HTTP et indicateurs non sensibles."""
+    response = response or {}
+    record = {"status": response.get("statusCode", 200)}
+    headers = response.get("headers") or {}
+    if isinstance(headers, dict) and headers.get("Idempotent-Replayed"):
+        record["replayed"] = True
+    body = response.get("body")
+    if isinstance(body, str) and body.startswith('{'):
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            return record
+        if payload.get("status") in _OUTCOMES:
+            record["outcome"] = payload["status"]
+        if isinstance(payload.get("exists"), bool):
+            record["exists"] = payload["exists"]
+    return record
+
+
+def _write(record):
+    """Ajoute une ligne au fichier de capture (une seule écriture `O_APPEND` par ligne)."""
+    global _fd, _fd_pid
+    pid = os.getpid()
+    if _fd_pid != pid:
+        # One descriptor per worker: lines from different workers never interleave
+        _fd = os.open(CAPTURE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        _fd_pid = pid
+    if os.fstat(_fd).st_size >= CAPTURE_MAX_BYTES:
+        return
+    os.write(_fd, (json.dumps(record, separators=(',', ':')) + "\n").encode('utf-8'))
+
+
+def _record(function_name, event, response, ts, start):
+    duration_ms = (time.perf_counter() - start) * 1000
+    try:
+        record = {"ts": round(ts, 6), "function": function_name}
+        record.update(describe_request(event))
+        record.update(describe_response(response))
+        record["duration_ms"] = round(duration_ms, 3)
+        _write(record)
+    except Exception as e:
+        # Capture must never fail a request
+        print(f"Failed to capture request: {e}")
+
+
+def captured(function_name):
+    """Décorateur qui capture les requêtes d'un handler `handle(event, context)`.
+
+    Sans `CAPTURE_FILE`, le handler est retourné tel quel : la capture ne
+    coûte rien lorsqu'elle est désactivée.
+    """
+    def decorator(handle):
+        if not CAPTURE_FILE:
+            return handle
+
+        @functools.wraps(handle)
+        def wrapper(event, context):
+            if random.random() >= CAPTURE_SAMPLE:
+                return handle(event, context)
+            ts = time.time()
+            start = time.perf_counter()
+            response = None
+            try:
+                response = handle(event, context)
+            finally:
+                # An exception becomes a 500 in the server: record it as such
+                _record(function_name, event, response or {"statusCode": 500}, ts, start)
+            return response
+        return wrapper
+    return decorator
+
@@ -0,0 +1,44 @@
+import json
+
+from . import capture
+
+
+class Event:
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.method = "POST"
+        self.query = {}
+        self.path = "/"
+
+
+def test_captured_request_contains_no_secrets(monkeypatch, tmp_path):
+    path = tmp_path / "capture.ndjson"
+    monkeypatch.setattr(capture, "CAPTURE_FILE", str(path))
+    monkeypatch.setattr(capture, "CAPTURE_SAMPLE", 1.0)
+
+    @capture.captured("authenticate-user")
+    def handle(event, context):
+        return {"statusCode": 200, "body": json.dumps({"status": "success", "password": "Secr3t!pass"})}
+
+    body = json.dumps({"username": "alice", "password": "Secr3t!pass", "totp_code": "123456"})
+    handle(Event(body.encode(), {"Idempotency-Key": "key-1"}), None)
+
+    line = path.read_text()
+    for secret in ("alice", "Secr3t!pass", "123456", "key-1"):
+        assert secret not in line
+    record = json.loads(line)
+    assert record["function"] == "authenticate-user"
+    assert record["fields"] == ["password", "totp_code", "username"]
+    assert record["has_totp"] is True
+    assert record["status"] == 200 and record["outcome"] == "success"
+    assert record["user"] == capture.pseudonym("alice")
+
+
+def test_disabled_capture_returns_handler_unchanged(monkeypatch):
+    monkeypatch.setattr(capture, "CAPTURE_FILE", None)
+
+    def handle(event, context):
+        return {"statusCode": 200}
+
+    assert capture.captured("check-user-status")(handle) is handle
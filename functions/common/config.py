@@ -0,0 +1,287 @@
+"""
+Configuration partagée par les handlers, lue une seule fois et rechargeable.
+
+Les valeurs viennent du fichier `.env` du paquet de la fonction (le
+répertoire parent de `common`, ou `CONFIG_FILE`), puis des secrets OpenFaaS
+montés dans `SECRETS_DIR` (voir `SECRET_FILES`), puis des variables
+d'environnement, qui ont priorité. Les clés ne doivent pas figurer dans le
+fichier `.env` ni dans `stack.yaml`, qui sont versionnés. Elles sont converties et validées une fois
+dans un objet `Config` immuable ; les handlers obtiennent l'instance courante
+avec `get()` au début de chaque requête.
+
+La configuration est rechargée sans redémarrage :
+- lorsque le fichier `.env` ou un secret change (date de modification vérifiée au plus
+  toutes les `CONFIG_CHECK_INTERVAL` secondes, lors d'un appel à `get()`) ;
+- à la réception de `SIGHUP` (le serveur pré-forké le relaie à ses workers).
+
+Une configuration invalide au rechargement est ignorée : l'ancienne reste en
+vigueur et l'erreur est journalisée. Au démarrage, elle lève `ConfigError`.
+"""
+import base64
+import binascii
+import os
+import re
+import signal
+import threading
+import time
+
+from dotenv import dotenv_values
+
+from .sharding import ShardMap
+
+CONFIG_FILE = os.getenv('CONFIG_FILE') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+CONFIG_CHECK_INTERVAL = float(os.getenv('CONFIG_CHECK_INTERVAL', '5'))  # secondes
+SECRETS_DIR = os.getenv('SECRETS_DIR', '/var/openfaas/secrets')
+
+# Setting -> OpenFaaS secret (`secrets:` of the function in stack.yaml), read from SECRETS_DIR
+SECRET_FILES = {
+    'SESSION_KEYS': 'session-keys',
+    'HASH_SERVICE_TOKEN': 'hash-service-token',
+}
+
+
+class ConfigError(ValueError):
+    """Une valeur de configuration est absente ou invalide."""
+
+
+class Config:
+    """Configuration validée, immuable une fois construite.
+
+    Attributes:
+        db_name, db_user, db_password, db_host (str): Base unique, sans sharding.
+        db_port (int): Port de la base unique.
+        db_shards (ShardMap or None): Carte des shards (`DB_SHARDS`).
+        db_shards_previous (ShardMap or None): Ancienne carte pendant un re-sharding.
+        encryption_key (bytes or None): Clé Fernet des secrets TOTP (`ENCRYPTION_KEY`).
+        account_expiry_days (int): Durée de validité d'un compte, en jours.
+        export_token (str or None): Jeton exigé par l'export de `check-user-status`.
+        export_chunk_size (int): Lignes lues par paquet lors de l'export.
+        storage_backend (str): Stockage des comptes, `postgres` ou `memory` (voir `common.repository`).
+        session_keys (tuple or None): Clés HMAC des jetons de session, `(kid, clé)`, la
+            première signe (voir `common.tokens`).
+        session_token_ttl (int): Durée de validité d'un jeton de session, en secondes.
+        session_revocation_file (str or None): Fichier des jetons révoqués.
+        request_timeout (float): Budget d'une requête, en secondes (`REQUEST_TIMEOUT`,
+            ou le `exec_timeout` du watchdog ; voir `common.deadline`).
+        bcrypt_rounds (int): Coût bcrypt des nouveaux hash, et le plus élevé accepté par
+            `hash-passwords` (voir `common.hashing`).
+        hash_service_token (str or None): Jeton partagé avec `hash-passwords` ; sans lui,
+            le service refuse toute requête.
+    """
+
+    def __init__(self, values):
+        self.db_name = values.get('DB_NAME')
+        self.db_user = values.get('DB_USER')
+        self.db_password = values.get('DB_PASSWORD')
+        self.db_host = values.get('DB_HOST')
+        self.db_port = _int(values, 'DB_PORT', 5432)
+        self.db_shards = _shards(values, 'DB_SHARDS')
+        self.db_shards_previous = _shards(values, 'DB_SHARDS_PREVIOUS')
+        self.encryption_key = _encryption_key(values.get('ENCRYPTION_KEY'))
+        self.account_expiry_days = _int(values, 'ACCOUNT_EXPIRY_DAYS', 6 * 30)
+        self.export_token = values.get('EXPORT_TOKEN') or None
+        self.export_chunk_size = _int(values, 'EXPORT_CHUNK_SIZE', 1000)
+        self.storage_backend = _choice(values, 'STORAGE_BACKEND', ('postgres', 'memory'))
+        self.session_keys = _session_keys(values.get('SESSION_KEYS'))
+        self.session_token_ttl = _int(values, 'SESSION_TOKEN_TTL', 900)
+        self.session_revocation_file = values.get('SESSION_REVOCATION_FILE') or None
+        self.request_timeout = _duration(values, 'REQUEST_TIMEOUT', 'exec_timeout', 10.0)
+        self.bcrypt_rounds = _int(values, 'BCRYPT_ROUNDS', 12)
+        if not 4 <= self.bcrypt_rounds <= 31:
+            raise ConfigError("BCRYPT_ROUNDS must be from 4 to 31")
+        self.hash_service_token = values.get('HASH_SERVICE_TOKEN') or None
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            raise AttributeError("Config is immutable")
+        super().__setattr__(name, value)
+
+    @property
+    def database(self):
+        """Paramètres qui déterminent les connexions : leur changement recrée les pools."""
+        return (self.db_name, self.db_user, self.db_password, self.db_host, self.db_port,
+                self.db_shards and tuple(self.db_shards.dsns),
+                self.db_shards_previous and tuple(self.db_shards_previous.dsns))
+
+
+def _int(values, name, default):
+    raw = values.get(name)
+    if raw in (None, ''):
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ConfigError(f"{name} must be an integer")
+    if value <= 0:
+        raise ConfigError(f"{name} must be positive")
+    return value
+
+
+def _choice(values, name, choices):
+    value = (values.get(name) or choices[0]).strip().lower()
+    if value not in choices:
+        raise ConfigError(f"{name} must be one of: {', '.join(choices)}")
+    return value
+
+
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def _duration(values, name, fallback, default):
+    """Durée en secondes : `10`, `2.5s`, `500ms` ou `1m30s` (format Go du watchdog)."""
+    source = name if values.get(name) else fallback
+    raw = (values.get(source) or '').strip()
+    if not raw:
+        return default
+    if re.fullmatch(r'\d+(\.\d+)?', raw):
+        seconds = float(raw)
+    elif re.fullmatch(r'(\d+(\.\d+)?(ms|s|m|h))+', raw):
+        seconds = sum(float(amount) * _DURATION_UNITS[unit]
+                      for amount, _, unit in re.findall(r'(\d+(\.\d+)?)(ms|s|m|h)', raw))
+    else:
+        raise ConfigError(f"{source} must be a duration such as 10s or 500ms")
+    if seconds <= 0:
+        raise ConfigError(f"{source} must be positive")
+    return seconds
+
+
+def _shards(values, name):
+    text = (values.get(name) or '').strip()
+    if not text:
+        return None
+    try:
+        return ShardMap.parse(text)
+    except ValueError as e:
+        raise ConfigError(f"{name}: {e}")
+
+
+def _encryption_key(raw):
+    if not raw:
+        return None
+    key = raw.encode('utf-8')
+    try:
+        decoded = base64.urlsafe_b64decode(key)
+    except (binascii.Error, ValueError):
+        decoded = b''
+    if len(key) != 44 or len(decoded) != 32:  # 32 bytes = 44 base64 characters
+        raise ConfigError("ENCRYPTION_KEY must be 32 bytes, base64-encoded")
+    return key
+
+
+def _session_keys(raw):
+    """`kid:clé,kid:clé` -> ((kid, octets), ...) ; clés d'au moins 32 octets en base64url."""
+    if not raw or not raw.strip():
+        return None
+    keys = []
+    for item in raw.split(','):
+        kid, _, encoded = item.strip().partition(':')
+        if not re.fullmatch(r'[A-Za-z0-9_-]{1,32}', kid):
+            raise ConfigError("SESSION_KEYS: key ids must be 1-32 characters from [A-Za-z0-9_-]")
+        try:
+            key = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        except (binascii.Error, ValueError):
+            key = b''
+        if len(key) < 32:
+            raise ConfigError(f"SESSION_KEYS: key {kid} must be at least 32 bytes, base64url-encoded")
+        if kid in dict(keys):
+            raise ConfigError(f"SESSION_KEYS: duplicate key id {kid}")
+        keys.append((kid, key))
+    return tuple(keys)
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _secret_paths():
+    return [os.path.join(SECRETS_DIR, name) for name in SECRET_FILES.values()]
+
+
+def _stamps():
+    """Dates de modification du fichier `.env` et des secrets : un changement déclenche le rechargement."""
+    return tuple(_file_stamp(path) for path in [CONFIG_FILE] + _secret_paths())
+
+
+def _read_secrets():
+    """Valeurs des secrets OpenFaaS présents dans `SECRETS_DIR`."""
+    values = {}
+    for name, secret in SECRET_FILES.items():
+        try:
+            with open(os.path.join(SECRETS_DIR, secret)) as f:
+                values[name] = f.read().strip()
+        except FileNotFoundError:
+            continue
+    return values
+
+
+def load(path=None):
+    """Lit et valide la configuration (fichier `CONFIG_FILE`, secrets, puis environnement)."""
+    path = path or CONFIG_FILE
+    values = dict(dotenv_values(path)) if os.path.exists(path) else {}
+    values.update(_read_secrets())
+    values.update(os.environ)
+    return Config(values)
+
+
+_lock = threading.Lock()
+_reload_requested = False
+_current = None
+_stamp = None
+_next_check = 0.0
+
+
+def reload():
+    """Recharge la configuration ; conserve l'ancienne si la nouvelle est invalide.
+
+    Returns:
+        Config: La configuration en vigueur après le rechargement.
+    """
+    global _current, _stamp, _reload_requested
+    with _lock:
+        _reload_requested = False
+        stamp = _stamps()
+        try:
+            _current = load()
+        except ConfigError as e:
+            if _current is None:
+                raise
+            print(f"Configuration reload failed, keeping the previous one: {e}")
+        _stamp = stamp
+        return _current
+
+
+def get():
+    """Retourne la configuration courante, rechargée si nécessaire."""
+    global _next_check
+    if _current is None or _reload_requested:
+        return reload()
+    now = time.monotonic()
+    if now >= _next_check:
+        _next_check = now + CONFIG_CHECK_INTERVAL
+        if _stamps() != _stamp:
+            return reload()
+    return _current
+
+
+def request_reload(signum=None, frame=None):
+    """Demande un rechargement au prochain `get()` (sûr dans un gestionnaire de signal)."""
+    global _reload_requested
+    _reload_requested = True
+
+
+def install_reload_signal():
+    """Recharge la configuration sur `SIGHUP` (depuis le thread principal uniquement)."""
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, request_reload)
+
+
+if signal.getsignal(signal.SIGHUP) is signal.SIG_DFL:
+    install_reload_signal()
+
+# Parsed and validated at import: an invalid configuration stops the function at startup
+reload()
@@ -0,0 +1,72 @@
+import pytest
+
+from . import config
+
+KEY = "bA8tcGhp8hZsSSqIEv1hGUvrfUuiyB8XMCICfSmrV3k="
+
+
+@pytest.fixture
+def env_file(monkeypatch, tmp_path):
+    path = tmp_path / ".env"
+    path.write_text(f"DB_NAME=cofrap\nDB_PORT=5432\nENCRYPTION_KEY=\"{KEY}\"\n")
+    for name in ("DB_NAME", "DB_PORT", "ENCRYPTION_KEY", "ACCOUNT_EXPIRY_DAYS", "SESSION_KEYS",
+                 "HASH_SERVICE_TOKEN"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(config, "CONFIG_FILE", str(path))
+    monkeypatch.setattr(config, "SECRETS_DIR", str(tmp_path / "secrets"))
+    monkeypatch.setattr(config, "CONFIG_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(config, "_current", None)
+    monkeypatch.setattr(config, "_stamp", None)
+    monkeypatch.setattr(config, "_next_check", 0.0)
+    return path
+
+
+def test_invalid_values_are_rejected():
+    with pytest.raises(config.ConfigError, match="ENCRYPTION_KEY"):
+        config.Config({"ENCRYPTION_KEY": "too-short"})
+    with pytest.raises(config.ConfigError, match="DB_PORT"):
+        config.Config({"DB_PORT": "postgres"})
+    with pytest.raises(config.ConfigError, match="DB_SHARDS"):
+        config.Config({"DB_SHARDS": ","})
+    with pytest.raises(config.ConfigError, match="BCRYPT_ROUNDS"):
+        config.Config({"BCRYPT_ROUNDS": "32"})
+
+
+def test_environment_overrides_file(env_file, monkeypatch):
+    monkeypatch.setenv("DB_NAME", "other")
+
+    cfg = config.get()
+
+    assert cfg.db_name == "other"
+    assert cfg.db_port == 5432
+    assert cfg.encryption_key == KEY.encode("utf-8")
+    assert cfg.account_expiry_days == 180
+    with pytest.raises(AttributeError):
+        cfg.db_name = "changed"
+
+
+def test_file_change_is_reloaded_and_invalid_change_ignored(env_file):
+    first = config.get()
+    assert config.get() is first
+
+    env_file.write_text("DB_NAME=cofrap\nACCOUNT_EXPIRY_DAYS=90\n")
+    second = config.get()
+    assert second.account_expiry_days == 90
+
+    env_file.write_text("DB_NAME=cofrap\nACCOUNT_EXPIRY_DAYS=soon\n")
+    assert config.get() is second
+
+    config.request_reload()
+    assert config.get() is second
+
+
+def test_session_keys_are_read_from_openfaas_secret(env_file, tmp_path):
+    assert config.get().session_keys is None
+
+    secrets = tmp_path / "secrets"
+    secrets.mkdir()
+    (secrets / "session-keys").write_text("k2:" + "b" * 43 + "\n")
+    (secrets / "hash-service-token").write_text("hash-token\n")
+    cfg = config.get()
+    assert [kid for kid, _ in cfg.session_keys] == ["k2"]
+    assert cfg.hash_service_token == "hash-token"
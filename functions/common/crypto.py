@@ -0,0 +1,68 @@
+"""
+Chiffrement des secrets TOTP stockés dans la colonne `users.mfa`.
+
+Les secrets sont chiffrés avec Fernet et la clé `ENCRYPTION_KEY`
+(32 octets encodés en base64), validée une fois par `common.config`.
+"""
+from cryptography.fernet import Fernet, InvalidToken
+
+from . import config
+
+# One Fernet instance per key: rebuilt only when the configuration changes
+_fernets = {}
+
+
+def get_encryption_key():
+    """Récupère la clé de chiffrement de la configuration courante."""
+    key = config.get().encryption_key
+    if not key:
+        raise ValueError("ENCRYPTION_KEY environment variable not set")
+    return key
+
+
+def _fernet():
+    key = get_encryption_key()
+    f = _fernets.get(key)
+    if f is None:
+        _fernets.clear()
+        f = _fernets[key] = Fernet(key)
+    return f
+
+
+def encrypt_secret(secret):
+    """Chiffre le secret TOTP avant de le stocker.
+
+    Args:
+        secret (str): Le secret TOTP à chiffrer.
+
+    Returns:
+        str: Le secret chiffré, encodé en base64.
+
+    Raises:
+        ValueError: Si la clé de chiffrement n'est pas définie.
+    """
+    encrypted = _fernet().encrypt(secret.encode('utf-8'))
+    return encrypted.decode('utf-8')
+
+
+def decrypt_secret(encrypted_secret):
+    """Déchiffre le secret TOTP.
+
+    Args:
+        encrypted_secret (str): Le secret chiffré encodé en base64.
+
+    Returns:
+        str or None: Le secret déchiffré, ou None si aucun secret chiffré n'est fourni.
+
+    Raises:
+        ValueError: Si la clé de chiffrement n'est pas définie ou si le jeton est invalide.
+    """
+    if not encrypted_secret:
+        return None
+        
+    f = _fernet()
+    try:
+        decrypted = f.decrypt(encrypted_secret.encode('utf-8'))
+        return decrypted.decode('utf-8')
+    except InvalidToken:
+        raise ValueError("Invalid encryption token")
@@ -0,0 +1,334 @@
+"""
+Accès partagé à la base de données PostgreSQL.
+
+Chaque processus possède son propre pool de connexions, créé paresseusement
+au premier emprunt. Le pool est recréé lorsque le PID change, ce qui permet
+au serveur pré-forké (`common.prefork`) d'importer les handlers une seule fois
+dans le processus maître sans partager de socket PostgreSQL entre les workers.
+
+Les connexions sont ouvertes avec un `connect_timeout` et un `statement_timeout`
+et passent par un disjoncteur (`CircuitBreaker`) : après plusieurs échecs
+consécutifs, les emprunts sont refusés immédiatement avec `DatabaseUnavailable`
+au lieu d'attendre le timeout de connexion du système. Le retour à la normale
+se fait par des sondes « semi-ouvertes » espacées d'un délai exponentiel
+avec gigue, pour ne pas submerger une base qui redémarre.
+
+Lorsque `DB_SHARDS` est défini (voir `common.sharding`), chaque shard a son
+propre pool et son propre disjoncteur, et `get_user_connection()` choisit le
+shard qui détient l'utilisateur.
+
+Les paramètres de connexion viennent de `common.config` ; lorsqu'ils changent
+au rechargement de la configuration, les pools existants sont abandonnés :
+leurs connexions empruntées sont fermées à leur retour et les nouvelles
+connexions utilisent les nouveaux paramètres.
+"""
+import os
+import random
+import threading
+import time
+import psycopg2
+from psycopg2 import pool
+
+from . import config
+
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '4'))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '3'))  # secondes
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000'))
+DB_BREAKER_THRESHOLD = int(os.getenv('DB_BREAKER_THRESHOLD', '5'))
+DB_BREAKER_RESET = float(os.getenv('DB_BREAKER_RESET', '2'))  # secondes
+DB_BREAKER_MAX_RESET = float(os.getenv('DB_BREAKER_MAX_RESET', '60'))  # secondes
+
+# Per-process state: one pool and one circuit breaker per database
+_pools = {}
+_breakers = {}
+_owners = {}
+_pool_pid = None
+_pool_settings = None
+_pool_lock = threading.Lock()
+
+_DEFAULT = 'default'
+
+
+class DatabaseUnavailable(Exception):
+    """La base de données est considérée indisponible (disjoncteur ouvert).
+
+    Attributes:
+        retry_after (int): Délai conseillé, en secondes, avant de réessayer.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Database temporarily unavailable")
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+class CircuitBreaker:
+    """Disjoncteur à trois états : fermé, ouvert et semi-ouvert.
+
+    - fermé : les appels passent ; `threshold` échecs consécutifs l'ouvrent.
+    - ouvert : les appels sont refusés jusqu'à l'échéance du délai de reprise.
+    - semi-ouvert : un seul appel de sonde est autorisé à la fois ; un succès
+      referme le disjoncteur, un échec le rouvre avec un délai doublé.
+
+    Le délai de reprise est tiré uniformément entre la moitié et la totalité
+    de `reset_timeout * 2**n` (plafonné à `max_reset_timeout`), de sorte que
+    les workers et les répliques ne sondent pas la base au même instant.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=DB_BREAKER_THRESHOLD, reset_timeout=DB_BREAKER_RESET,
+                 max_reset_timeout=DB_BREAKER_MAX_RESET, clock=time.monotonic, rng=random.random):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.clock = clock
+        self.rng = rng
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Vérifie qu'un appel peut être tenté.
+
+        Raises:
+            DatabaseUnavailable: Si le disjoncteur est ouvert ou qu'une sonde est déjà en cours.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = self.clock()
+            if self.state == self.OPEN and now >= self.open_until:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return
+            raise DatabaseUnavailable(max(self.open_until - now, self.reset_timeout))
+
+    def record_success(self):
+        """Enregistre un appel réussi et referme le disjoncteur."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+            self.probe_in_flight = False
+
+    def cancel_probe(self):
+        """Libère la sonde en cours sans changer l'état (appel non abouti côté base)."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        """Enregistre un échec et ouvre le disjoncteur si nécessaire."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                backoff = min(self.max_reset_timeout, self.reset_timeout * (2 ** self.trips))
+                self.open_until = self.clock() + backoff * (0.5 + self.rng() / 2)
+                self.state = self.OPEN
+                self.trips += 1
+                self.probe_in_flight = False
+
+
+def _connect_kwargs(target, cfg):
+    """Paramètres de connexion d'une base : un DSN de shard ou les variables DB_*."""
+    kwargs = {
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+        'options': f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    }
+    if target == _DEFAULT:
+        kwargs.update(
+            dbname=cfg.db_name,
+            user=cfg.db_user,
+            password=cfg.db_password,
+            host=cfg.db_host,
+            port=cfg.db_port
+        )
+    else:
+        kwargs['dsn'] = target
+    return kwargs
+
+
+def _get_pool(target=_DEFAULT):
+    """Retourne le pool et le disjoncteur d'une base pour le processus courant."""
+    global _pool_pid, _pool_settings
+    pid = os.getpid()
+    cfg = config.get()
+    if _pool_pid == pid and _pool_settings == cfg.database and target in _pools:
+        return _pools[target], _breakers[target]
+
+    with _pool_lock:
+        if _pool_pid != pid:
+            # Pools inherited through fork() belong to the parent: drop the
+            # references without closing them, closing would terminate the
+            # parent's sessions on the shared sockets.
+            _pools.clear()
+            _breakers.clear()
+            _owners.clear()
+            _pool_pid = pid
+        if _pool_settings != cfg.database:
+            # Connection settings changed: idle connections go away with the
+            # old pools, borrowed ones are closed when released.
+            _pools.clear()
+            _breakers.clear()
+            _pool_settings = cfg.database
+        if target not in _pools:
+            _pools[target] = pool.ThreadedConnectionPool(0, DB_POOL_MAX, **_connect_kwargs(target, cfg))
+            _breakers[target] = CircuitBreaker()
+        return _pools[target], _breakers[target]
+
+
+def _target_for(key):
+    shards = config.get().db_shards
+    if shards is None or key is None:
+        return shards.dsns[0] if shards is not None else _DEFAULT
+    return shards.dsn_for(key)
+
+
+def _borrow(target):
+    p, breaker = _get_pool(target)
+    breaker.before_call()
+    try:
+        conn = p.getconn()
+        if conn.closed:
+            p.putconn(conn, close=True)
+            conn = p.getconn()
+    except pool.PoolError as e:
+        # Pool exhausted: says nothing about the database health
+        breaker.cancel_probe()
+        raise Exception(f"Failed to connect to database: {str(e)}")
+    except Exception as e:
+        breaker.record_failure()
+        raise Exception(f"Failed to connect to database: {str(e)}")
+    _owners[id(conn)] = (p, breaker)
+    return conn
+
+
+def get_db_connection(shard_key=None):
+    """Emprunte une connexion au pool du processus courant.
+
+    La connexion doit être rendue avec `release_db_connection()`.
+
+    Args:
+        shard_key (str, optional): Valeur qui détermine le shard dans la carte
+            courante ; le premier shard est utilisé si elle est absente.
+
+    Raises:
+        DatabaseUnavailable: Si le disjoncteur est ouvert.
+        Exception: Si la connexion à la base de données échoue ou si le pool est épuisé.
+    """
+    return _borrow(_target_for(shard_key))
+
+
+def database_targets():
+    """Liste les bases à parcourir pour lire tous les utilisateurs.
+
+    Sans sharding, c'est la base configurée par les variables DB_* ; pendant
+    un re-sharding, les shards de l'ancienne carte absents de la nouvelle
+    sont ajoutés, un utilisateur en cours de déplacement pouvant alors être lu deux fois.
+    """
+    cfg = config.get()
+    if cfg.db_shards is None:
+        return [_DEFAULT]
+    targets = list(cfg.db_shards.dsns)
+    if cfg.db_shards_previous is not None:
+        targets += [dsn for dsn in cfg.db_shards_previous.dsns if dsn not in targets]
+    return targets
+
+
+def get_target_connection(target):
+    """Emprunte une connexion à une base donnée par `database_targets()`."""
+    return _borrow(target)
+
+
+def _user_exists(conn, username):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def get_user_connection(username):
+    """Emprunte une connexion au shard qui détient l'utilisateur `username`.
+
+    En dehors d'un re-sharding, c'est le shard donné par la carte courante.
+    Pendant un re-sharding (`DB_SHARDS_PREVIOUS` défini), un utilisateur que
+    la nouvelle carte place ailleurs que l'ancienne est cherché d'abord dans
+    son nouveau shard puis dans l'ancien ; un utilisateur absent des deux est
+    créé dans le nouveau shard.
+    """
+    cfg = config.get()
+    target = _target_for(username)
+    if cfg.db_shards_previous is None or cfg.db_shards is None or username is None:
+        return _borrow(target)
+
+    previous = cfg.db_shards_previous.dsn_for(username)
+    if previous == target:
+        return _borrow(target)
+
+    conn = _borrow(target)
+    try:
+        if _user_exists(conn, username):
+            return conn
+        old = _borrow(previous)
+    except Exception:
+        release_db_connection(conn)
+        raise
+    try:
+        if _user_exists(old, username):
+            release_db_connection(conn)
+            return old
+    except Exception:
+        release_db_connection(old)
+        release_db_connection(conn)
+        raise
+    release_db_connection(old)
+    return conn
+
+
+def release_db_connection(conn):
+    """Rend une connexion au pool.
+
+    Toute transaction encore ouverte est annulée pour que la connexion soit
+    propre au prochain emprunt ; une connexion cassée est fermée, retirée du
+    pool et comptée comme un échec par le disjoncteur.
+    """
+    if conn is None:
+        return
+    owner = _owners.pop(id(conn), None)
+    p, breaker = owner if owner is not None else _get_pool(_DEFAULT)
+    if conn.closed:
+        breaker.record_failure()
+        p.putconn(conn, close=True)
+        return
+    try:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        # A connection from a pool retired by a configuration change is closed
+        p.putconn(conn, close=p not in _pools.values())
+        breaker.record_success()
+    except psycopg2.Error:
+        breaker.record_failure()
+        p.putconn(conn, close=True)
+
+
+def close_all():
+    """Ferme toutes les connexions des pools du processus courant."""
+    global _pool_pid, _pool_settings
+    with _pool_lock:
+        if _pool_pid == os.getpid():
+            for p in _pools.values():
+                p.closeall()
+        _pools.clear()
+        _breakers.clear()
+        _owners.clear()
+        _pool_pid = None
+        _pool_settings = None
@@ -0,0 +1,56 @@
+import pytest
+
+from .db import CircuitBreaker, DatabaseUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(threshold=3, reset_timeout=2, max_reset_timeout=10, clock=clock, rng=lambda: 1.0)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+
+    with pytest.raises(DatabaseUnavailable) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == 2
+
+
+def test_breaker_allows_single_half_open_probe():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now = 2.5
+    breaker.before_call()
+    with pytest.raises(DatabaseUnavailable):
+        breaker.before_call()
+
+    breaker.record_success()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_doubles_backoff():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now = 2.5
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.open_until == pytest.approx(2.5 + 4)
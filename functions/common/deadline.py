@@ -0,0 +1,181 @@
+"""
+Échéance des requêtes, propagée à la base de données et aux calculs coûteux.
+
+Le proxy, la passerelle et la fonction ont chacun leur timeout : sans
+échéance, une requête que le client a déjà abandonnée exécute quand même sa
+lecture, bcrypt et son commit jusqu'au bout. Un handler décoré par
+`bounded()` reçoit une échéance au début de chaque requête :
+
+    échéance = début + min(X-Request-Timeout, REQUEST_TIMEOUT) - DEADLINE_MARGIN_MS
+
+où `début` est l'en-tête `X-Start-Time` ajouté par la passerelle OpenFaaS
+(nanosecondes depuis l'epoch, le temps passé en file d'attente est donc
+décompté) ou, à défaut, l'arrivée dans le handler. `X-Request-Timeout` est
+le budget annoncé par le client, en secondes ; `REQUEST_TIMEOUT` vaut par
+défaut le `exec_timeout` du watchdog (voir `common.config`). La marge laisse
+le temps d'écrire la réponse.
+
+Pendant la requête :
+- chaque transaction de `common.repository` reçoit un `statement_timeout` et
+  un `lock_timeout` tirés du temps restant (`db_timeouts()`), lorsqu'il est
+  plus court que le `statement_timeout` des connexions ;
+- les étapes coûteuses (bcrypt, rendu du QR code) passent par `step()`, qui
+  les saute lorsque le temps restant ne couvre pas leur durée habituelle,
+  mesurée dans le processus (moyenne mobile).
+
+Une échéance dépassée lève `DeadlineExceeded`, que les handlers traduisent
+en réponse 504 ; chaque dépassement est compté par fonction et par étape
+dans `deadline_expired_total` (voir `common.limiter`).
+"""
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from . import config, limiter, responses
+from .events import get_header
+
+DEADLINE_MARGIN = float(os.getenv('DEADLINE_MARGIN_MS', '50')) / 1000  # secondes
+# Share of the statement budget a transaction may spend waiting for a lock
+LOCK_TIMEOUT_SHARE = 0.5
+SMOOTHING = 0.2
+
+_local = threading.local()
+# Per-process moving average of each step duration, in seconds
+_estimates = {}
+
+
+class DeadlineExceeded(Exception):
+    """L'échéance de la requête est dépassée, ou le temps restant ne couvre pas l'étape.
+
+    Attributes:
+        step (str): L'étape qui n'a pas pu être menée à bien.
+    """
+
+    def __init__(self, step):
+        super().__init__(f"Request deadline exceeded ({step})")
+        self.step = step
+
+
+def _header_float(event, name):
+    try:
+        value = float(get_header(event, name))
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
+
+def start(event, function_name):
+    """Fixe l'échéance de la requête courante d'après ses en-têtes et la configuration."""
+    now = time.time()
+    started = _header_float(event, 'X-Start-Time')
+    started = min(now, started / 1e9) if started else now
+    budget = config.get().request_timeout
+    requested = _header_float(event, 'X-Request-Timeout')
+    if requested:
+        budget = min(budget, requested)
+    _local.deadline = time.monotonic() + (started + budget - DEADLINE_MARGIN - now)
+    _local.function = function_name
+
+
+def clear():
+    """Retire l'échéance de la requête courante."""
+    _local.deadline = None
+    _local.function = None
+
+
+def current_function():
+    """Fonction qui sert la requête courante, ou None hors d'une requête bornée."""
+    return getattr(_local, 'function', None)
+
+
+def remaining():
+    """Temps restant avant l'échéance, en secondes, ou None hors d'une requête bornée."""
+    deadline = getattr(_local, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired(step):
+    """Compte un dépassement à l'étape `step` et retourne l'exception à lever."""
+    limiter.deadline_expired(current_function(), step)
+    return DeadlineExceeded(step)
+
+
+def check(step, needed=0.0):
+    """Vérifie qu'il reste plus de `needed` secondes.
+
+    Raises:
+        DeadlineExceeded: Si ce n'est pas le cas.
+    """
+    left = remaining()
+    if left is not None and left <= needed:
+        raise expired(step)
+
+
+def estimate(step):
+    """Durée habituelle de l'étape `step` dans ce processus, en secondes (0 si inconnue)."""
+    return _estimates.get(step, 0.0)
+
+
+@contextmanager
+def step(name, skippable=True):
+    """Exécute une étape coûteuse et mesure sa durée.
+
+    Args:
+        name (str): Nom de l'étape (`bcrypt`, `qr`).
+        skippable (bool): Si False, l'étape est seulement mesurée, par exemple
+            lorsqu'elle suit une écriture déjà validée.
+
+    Raises:
+        DeadlineExceeded: Si le temps restant ne couvre pas sa durée habituelle.
+    """
+    if skippable:
+        check(name, estimate(name))
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    previous = _estimates.get(name)
+    _estimates[name] = elapsed if previous is None else previous + (elapsed - previous) * SMOOTHING
+
+
+def db_timeouts(default_ms):
+    """`statement_timeout` et `lock_timeout` (ms) tirés du temps restant.
+
+    Returns:
+        tuple or None: None hors d'une requête bornée ou si le temps restant
+        dépasse `default_ms`, le timeout déjà appliqué aux connexions.
+
+    Raises:
+        DeadlineExceeded: Si l'échéance est dépassée.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    budget_ms = int(left * 1000)
+    if budget_ms <= 0:
+        raise expired('database')
+    if budget_ms >= default_ms:
+        return None
+    return budget_ms, max(1, int(budget_ms * LOCK_TIMEOUT_SHARE))
+
+
+def bounded(function_name):
+    """Décorateur qui borne un handler `handle(event, context)` par l'échéance de la requête.
+
+    Une requête déjà hors délai à son arrivée reçoit une réponse 504 sans être traitée.
+    """
+    def decorator(handle):
+        @functools.wraps(handle)
+        def wrapper(event, context):
+            start(event, function_name)
+            try:
+                check('received')
+                return handle(event, context)
+            except DeadlineExceeded:
+                return responses.deadline_exceeded()
+            finally:
+                clear()
+        return wrapper
+    return decorator
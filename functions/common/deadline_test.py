@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from . import config, deadline, limiter
+
+
+class Event:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+        self.method = "POST"
+        self.path = "/"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    cfg = config.Config({"REQUEST_TIMEOUT": "2s"})
+    monkeypatch.setattr(config, "get", lambda: cfg)
+    monkeypatch.setattr(deadline, "_estimates", {})
+    limiter.reset()
+    yield
+    deadline.clear()
+    limiter.reset()
+
+
+def test_request_queued_past_its_deadline_is_not_served():
+    calls = []
+
+    @deadline.bounded("authenticate-user")
+    def handle(event, context):
+        calls.append(event)
+        return {"statusCode": 200}
+
+    queued_since = time.time() - 3
+    response = handle(Event({"X-Start-Time": str(int(queued_since * 1e9))}), None)
+    assert response["statusCode"] == 504
+    assert not calls
+    assert deadline.remaining() is None
+    assert 'deadline_expired_total{function="authenticate-user",step="received"} 1' in limiter.metrics()
+
+    assert handle(Event(), None)["statusCode"] == 200
+
+
+def test_budget_is_the_smallest_of_header_and_configuration():
+    deadline.start(Event({"X-Request-Timeout": "0.5"}), "check-user-status")
+    assert 0.4 < deadline.remaining() <= 0.5 - deadline.DEADLINE_MARGIN
+    statement_ms, lock_ms = deadline.db_timeouts(5000)
+    assert 400 < statement_ms <= 450 and lock_ms == statement_ms // 2
+    assert deadline.db_timeouts(100) is None
+
+    deadline.start(Event({"X-Request-Timeout": "garbage"}), "check-user-status")
+    assert 1.9 < deadline.remaining() <= 2
+
+
+def test_expensive_step_is_skipped_when_it_cannot_finish():
+    deadline.start(Event({"X-Request-Timeout": "0.3"}), "generate-password")
+    with deadline.step("bcrypt"):
+        time.sleep(0.2)
+    assert deadline.estimate("bcrypt") >= 0.2
+
+    with pytest.raises(deadline.DeadlineExceeded) as excinfo:
+        with deadline.step("bcrypt"):
+            pytest.fail("step should have been skipped")
+    assert excinfo.value.step == "bcrypt"
+    assert 'deadline_expired_total{function="generate-password",step="bcrypt"} 1' in limiter.metrics()
+
+    with deadline.step("bcrypt", skippable=False):
+        pass
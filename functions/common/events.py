@@ -0,0 +1,29 @@
+"""
+Accès aux informations de la requête reçue par un handler.
+
+Selon le serveur qui appelle le handler (template `python3-http`, serveur
+pré-forké ou tests), `event.headers` peut être un objet d'en-têtes Flask,
+un `email.message.Message` ou un simple dictionnaire.
+"""
+
+
+def get_header(event, name, default=None):
+    """Retourne la valeur d'un en-tête de la requête, sans tenir compte de la casse."""
+    headers = getattr(event, 'headers', None)
+    if not headers:
+        return default
+    value = headers.get(name)
+    if value is None and isinstance(headers, dict):
+        lowered = name.lower()
+        for key, candidate in headers.items():
+            if key.lower() == lowered:
+                return candidate
+    return default if value is None else value
+
+
+def get_body(event):
+    """Retourne le corps brut de la requête en octets."""
+    body = getattr(event, 'body', None) or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return body
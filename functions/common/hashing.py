@@ -0,0 +1,236 @@
+"""
+Hachage et vérification bcrypt, dans le processus ou par le service dédié.
+
+bcrypt occupe un cœur pendant environ 250 ms par appel (coût 12). Exécuté
+dans `generate-password` et `authenticate-user`, il impose de dimensionner
+ces fonctions, qui attendent surtout la base, pour le calcul. Lorsque
+`HASH_SERVICE_URL` est défini, le hachage est délégué à la fonction
+`hash-passwords`, mise à l'échelle et placée sur des nœuds de calcul
+indépendamment des autres.
+
+Côté client :
+- les appels concurrents d'un processus (serveur à threads, scripts) sont
+  regroupés en un seul lot pendant au plus `HASH_BATCH_WINDOW_MS`, ou jusqu'à
+  `HASH_BATCH_MAX` éléments ;
+- les lots partent sur au plus `HASH_SERVICE_POOL` connexions HTTP
+  persistantes (keep-alive) par processus, recréées après un fork ;
+- si le service est injoignable, répond en erreur ou dépasse
+  `HASH_SERVICE_TIMEOUT`, le calcul est fait dans le processus et le service
+  n'est plus sollicité pendant `HASH_SERVICE_RETRY` secondes.
+
+Un lot est une liste d'éléments `{"op": "hash", "password", "rounds"}` ou
+`{"op": "verify", "password", "hash"}` ; le résultat d'un hachage est le hash,
+celui d'une vérification est un booléen, ou None si le hash stocké est invalide.
+`execute()` les calcule en parallèle (bcrypt libère le GIL) ; c'est aussi ce
+qu'exécute le service.
+
+Variables d'environnement :
+    HASH_SERVICE_URL: URL de la fonction `hash-passwords` ; sans elle, tout est local.
+    HASH_SERVICE_TIMEOUT: timeout d'un lot, en secondes (par défaut 5).
+    HASH_SERVICE_POOL: connexions persistantes par processus (par défaut 2).
+    HASH_SERVICE_RETRY: durée du repli local après un échec, en secondes (par défaut 5).
+    HASH_BATCH_WINDOW_MS: attente maximale pour compléter un lot (par défaut 2).
+    HASH_BATCH_MAX: taille maximale d'un lot (par défaut 32).
+    HASH_THREADS: threads de calcul d'un lot (par défaut le nombre de cœurs).
+
+Le jeton partagé (`HASH_SERVICE_TOKEN`, envoyé en `Authorization: Bearer`) et le
+coût bcrypt (`BCRYPT_ROUNDS`) viennent de `common.config` : le jeton est le
+secret OpenFaaS `hash-service-token`, monté dans le service et chez ses clients.
+"""
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import bcrypt
+
+from . import config
+
+HASH_SERVICE_URL = os.getenv('HASH_SERVICE_URL')
+HASH_SERVICE_TIMEOUT = float(os.getenv('HASH_SERVICE_TIMEOUT', '5'))
+HASH_SERVICE_POOL = int(os.getenv('HASH_SERVICE_POOL', '2'))
+HASH_SERVICE_RETRY = float(os.getenv('HASH_SERVICE_RETRY', '5'))
+HASH_BATCH_WINDOW = float(os.getenv('HASH_BATCH_WINDOW_MS', '2')) / 1000
+HASH_BATCH_MAX = int(os.getenv('HASH_BATCH_MAX', '32'))
+HASH_THREADS = int(os.getenv('HASH_THREADS') or os.cpu_count() or 1)
+
+# Lowest cost bcrypt accepts; the highest accepted in a batch is config.bcrypt_rounds
+MIN_ROUNDS = 4
+
+_local = threading.local()
+_batcher = None
+_batcher_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_down_until = 0.0
+
+
+class ServiceError(Exception):
+    """Le service de hachage n'a pas traité le lot."""
+
+
+def _execute_item(item):
+    password = item['password'].encode('utf-8')
+    if item['op'] == 'hash':
+        rounds = item.get('rounds') or config.get().bcrypt_rounds
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+    try:
+        return bcrypt.checkpw(password, item['hash'].encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return None
+
+
+def execute(items):
+    """Calcule un lot dans le processus, en parallèle sur `HASH_THREADS` threads."""
+    global _executor, _executor_pid
+    if len(items) < 2 or HASH_THREADS < 2:
+        return [_execute_item(item) for item in items]
+    if _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(HASH_THREADS, thread_name_prefix='bcrypt')
+        _executor_pid = os.getpid()
+    return list(_executor.map(_execute_item, items))
+
+
+def _connection():
+    """Connexion persistante du thread courant au service."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        url = urlsplit(HASH_SERVICE_URL)
+        factory = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        conn = _local.conn = factory(url.hostname, url.port, timeout=HASH_SERVICE_TIMEOUT)
+    return conn
+
+
+def _post(items):
+    """Envoie un lot au service et retourne ses résultats."""
+    url = urlsplit(HASH_SERVICE_URL)
+    body = json.dumps({"items": items}).encode('utf-8')
+    headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+    token = config.get().hash_service_token
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    for attempt in range(2):
+        conn = _connection()
+        reused = conn.sock is not None
+        try:
+            conn.request('POST', url.path or '/', body, headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            _local.conn = None
+            # An idle keep-alive connection closed by the server: retry once on a new one
+            if reused and attempt == 0 and not isinstance(e, TimeoutError):
+                continue
+            raise ServiceError(str(e) or type(e).__name__)
+        if response.status != 200:
+            raise ServiceError(f"HTTP {response.status}")
+        try:
+            results = json.loads(payload)["results"]
+        except (ValueError, KeyError, TypeError):
+            raise ServiceError("invalid response")
+        if not isinstance(results, list) or len(results) != len(items):
+            raise ServiceError("result count mismatch")
+        return results
+
+
+class _Batcher:
+    """Regroupe les éléments soumis par les threads du processus en lots."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.senders = ThreadPoolExecutor(HASH_SERVICE_POOL, thread_name_prefix='hash-service')
+        threading.Thread(target=self._collect, name='hash-batcher', daemon=True).start()
+
+    def submit(self, items):
+        future = Future()
+        self.queue.put((items, future))
+        return future
+
+    def _collect(self):
+        while True:
+            jobs = [self.queue.get()]
+            count = len(jobs[0][0])
+            until = time.monotonic() + HASH_BATCH_WINDOW
+            while count < HASH_BATCH_MAX:
+                left = until - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    job = self.queue.get(timeout=left)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                count += len(job[0])
+            self.senders.submit(self._send, jobs)
+
+    @staticmethod
+    def _send(jobs):
+        try:
+            results = _post([item for items, _ in jobs for item in items])
+        except Exception as e:
+            for _, future in jobs:
+                future.set_exception(e)
+            return
+        start = 0
+        for items, future in jobs:
+            future.set_result(results[start:start + len(items)])
+            start += len(items)
+
+
+def _get_batcher():
+    """Regroupeur du processus courant, recréé après un fork."""
+    global _batcher
+    if _batcher is None or _batcher.pid != os.getpid():
+        with _batcher_lock:
+            if _batcher is None or _batcher.pid != os.getpid():
+                _batcher = _Batcher()
+    return _batcher
+
+
+def _run(items):
+    """Calcule un lot par le service si possible, sinon dans le processus."""
+    global _down_until
+    if HASH_SERVICE_URL and time.monotonic() >= _down_until:
+        try:
+            batcher = _get_batcher()
+            futures = [batcher.submit(items[i:i + HASH_BATCH_MAX])
+                       for i in range(0, len(items), HASH_BATCH_MAX)]
+            return [result for future in futures for result in future.result()]
+        except ServiceError as e:
+            _down_until = time.monotonic() + HASH_SERVICE_RETRY
+            print(f"Hash service unavailable, hashing in process: {e}")
+    return execute(items)
+
+
+def hash_many(passwords, rounds=None):
+    """Hash bcrypt (str) de chaque mot de passe ; `rounds` par défaut : `BCRYPT_ROUNDS`."""
+    return _run([{"op": "hash", "password": password, "rounds": rounds} for password in passwords])
+
+
+def verify_many(pairs):
+    """Vérifie des couples `(mot de passe, hash)` ; None pour un hash invalide."""
+    return _run([{"op": "verify", "password": password, "hash": hashed} for password, hashed in pairs])
+
+
+def hash_password(password, rounds=None):
+    """Hash bcrypt d'un mot de passe."""
+    return hash_many([password], rounds)[0]
+
+
+def check_password(password, hashed):
+    """Le mot de passe correspond au hash.
+
+    Raises:
+        ValueError: Si le hash n'est pas un hash bcrypt.
+    """
+    valid = verify_many([(password, hashed)])[0]
+    if valid is None:
+        raise ValueError("Invalid bcrypt hash")
+    return valid
@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bcrypt
+import pytest
+
+from . import hashing
+
+
+@pytest.fixture
+def service(monkeypatch):
+    calls = {"connections": 0, "batches": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            calls["connections"] += 1
+
+        def do_POST(self):
+            items = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["items"]
+            calls["batches"].append(len(items))
+            body = json.dumps({"results": hashing.execute(items)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(hashing, "HASH_SERVICE_URL", f"http://127.0.0.1:{server.server_port}/")
+    monkeypatch.setattr(hashing, "HASH_BATCH_WINDOW", 0.05)
+    monkeypatch.setattr(hashing, "_batcher", None)
+    monkeypatch.setattr(hashing, "_down_until", 0.0)
+    yield calls
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_calls_share_batches_and_connections(service):
+    hashes = [None] * 8
+
+    def run(i):
+        hashes[i] = hashing.hash_password(f"password-{i}", rounds=4)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(bcrypt.checkpw(f"password-{i}".encode(), hashes[i].encode()) for i in range(8))
+    assert sum(service["batches"]) == 8 and len(service["batches"]) < 8
+
+    assert hashing.verify_many([("password-0", hashes[0]), ("wrong", hashes[1]), ("x", "not a hash")]) == \
+        [True, False, None]
+    assert hashing.check_password("password-2", hashes[2])
+    assert service["connections"] <= hashing.HASH_SERVICE_POOL
+
+
+def test_unreachable_service_falls_back_in_process(monkeypatch, capsys):
+    monkeypatch.setattr(hashing, "HASH_SERVICE_URL", "http://127.0.0.1:9/")
+    monkeypatch.setattr(hashing, "_batcher", None)
+    monkeypatch.setattr(hashing, "_down_until", 0.0)
+
+    hashed = hashing.hash_password("Passw0rd!", rounds=4)
+    assert hashing.check_password("Passw0rd!", hashed)
+    assert hashing._down_until > 0
+    # Only the first call paid for the failed attempt
+    assert capsys.readouterr().out.count("Hash service unavailable") == 1
+    with pytest.raises(ValueError):
+        hashing.check_password("Passw0rd!", "not a hash")
@@ -0,0 +1,236 @@
+"""
+Prise en charge de l'en-tête `Idempotency-Key`.
+
+Lorsqu'une requête porte un `Idempotency-Key`, la réponse du handler est
+conservée dans la table `idempotency_keys` pendant `IDEMPOTENCY_TTL` secondes
+et rejouée telle quelle pour toute requête ultérieure portant la même clé,
+sans refaire le travail cryptographique ni les écritures en base.
+
+La première requête « réserve » la clé par un `INSERT ... ON CONFLICT` ;
+les doublons concurrents attendent que la réponse soit enregistrée (au plus
+`IDEMPOTENCY_WAIT` secondes) puis la rejouent. Une réservation dont le
+détenteur a disparu expire après `IDEMPOTENCY_LEASE` secondes.
+
+Les réponses contiennent des secrets (mot de passe, secret TOTP) : elles sont
+chiffrées avec une clé Fernet dérivée de l'`Idempotency-Key` elle-même, et seule
+une empreinte de la clé est stockée. La base ne permet donc pas de les relire.
+"""
+import base64
+import functools
+import hashlib
+import json
+import os
+import random
+import time
+from cryptography.fernet import Fernet, InvalidToken
+
+from . import db, responses, slowlog
+from .events import get_body, get_header
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # secondes
+IDEMPOTENCY_LEASE = int(os.getenv('IDEMPOTENCY_LEASE', '30'))  # secondes
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '10'))  # secondes
+PURGE_PROBABILITY = 0.01
+MAX_KEY_LENGTH = 255
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+CLAIM_QUERY = """
+    INSERT INTO idempotency_keys (function, key_hash, request_hash, status, expires_at)
+    VALUES (%s, %s, %s, 'pending', NOW() + make_interval(secs => %s))
+    ON CONFLICT (function, key_hash) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash,
+            status = 'pending',
+            status_code = NULL,
+            response = NULL,
+            created_at = NOW(),
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at < NOW()
+    RETURNING 1
+"""
+
+
+def _key_hash(function_name, key):
+    return hashlib.sha256(f"{function_name}:{key}".encode('utf-8')).hexdigest()
+
+
+def _cipher(key):
+    derived = hashlib.sha256(b"idempotency-response:" + key.encode('utf-8')).digest()
+    return Fernet(base64.urlsafe_b64encode(derived))
+
+
+def _json_error(status_code, message, headers=None):
+    response = {
+        "statusCode": status_code,
+        "body": json.dumps({"error": message})
+    }
+    if headers:
+        response["headers"] = headers
+    return response
+
+
+def _execute(query, params, fetch=False, shard_key=None):
+    """Exécute une requête sur une connexion empruntée puis rendue aussitôt."""
+    conn = db.get_db_connection(shard_key)
+    cursor = None
+    try:
+        cursor = slowlog.Cursor(conn.cursor(), 'idempotency')
+        cursor.execute(query, params)
+        row = cursor.fetchone() if fetch else None
+        conn.commit()
+        return row
+    finally:
+        if cursor:
+            cursor.close()
+        db.release_db_connection(conn)
+
+
+def _store(function_name, key_hash, key, response):
+    """Enregistre la réponse d'une requête réservée et prolonge la clé jusqu'au TTL."""
+    payload = json.dumps({
+        "headers": response.get("headers") or {},
+        "body": response.get("body", "")
+    })
+    _execute(
+        """
+        UPDATE idempotency_keys
+        SET status = 'done', status_code = %s, response = %s,
+            expires_at = NOW() + make_interval(secs => %s)
+        WHERE function = %s AND key_hash = %s
+        """,
+        (response.get("statusCode", 200), _cipher(key).encrypt(payload.encode('utf-8')).decode('utf-8'),
+         IDEMPOTENCY_TTL, function_name, key_hash),
+        shard_key=key_hash
+    )
+
+
+def _purge_expired(shard_key):
+    """Supprime un lot de clés expirées du shard de `shard_key` (appelé sur une fraction des requêtes)."""
+    _execute(
+        """
+        DELETE FROM idempotency_keys
+        WHERE ctid IN (SELECT ctid FROM idempotency_keys WHERE expires_at < NOW() LIMIT 500)
+        """,
+        (),
+        shard_key=shard_key
+    )
+
+
+def _release(function_name, key_hash):
+    """Supprime une réservation pour que la requête puisse être rejouée."""
+    _execute("DELETE FROM idempotency_keys WHERE function = %s AND key_hash = %s",
+             (function_name, key_hash), shard_key=key_hash)
+
+
+def _replay(key, status_code, stored):
+    """Reconstruit la réponse enregistrée."""
+    try:
+        payload = json.loads(_cipher(key).decrypt(stored.encode('utf-8')))
+    except (InvalidToken, ValueError):
+        return _json_error(500, "Stored idempotent response could not be read")
+    headers = dict(payload.get("headers") or {})
+    headers[REPLAYED_HEADER] = "true"
+    return {
+        "statusCode": status_code,
+        "headers": headers,
+        "body": payload.get("body", "")
+    }
+
+
+def _wait_for_response(function_name, key_hash, key, request_hash):
+    """Attend la fin d'une requête concurrente portant la même clé puis rejoue sa réponse."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    delay = 0.05
+    while True:
+        row = _execute(
+            """
+            SELECT request_hash, status, status_code, response
+            FROM idempotency_keys
+            WHERE function = %s AND key_hash = %s AND expires_at >= NOW()
+            """,
+            (function_name, key_hash),
+            fetch=True,
+            shard_key=key_hash
+        )
+        if row is None:
+            # The owner released or lost its claim: let the caller retry it
+            return None
+        stored_request_hash, status, status_code, stored = row
+        if stored_request_hash != request_hash:
+            return _json_error(422, "Idempotency-Key already used with a different request")
+        if status == 'done':
+            return _replay(key, status_code, stored)
+        if time.monotonic() + delay > deadline:
+            return _json_error(409, "A request with this Idempotency-Key is already in progress",
+                               headers={"Retry-After": "1"})
+        time.sleep(delay * (0.5 + random.random()))
+        delay = min(delay * 2, 0.5)
+
+
+def run(function_name, event, compute):
+    """Exécute `compute()` au plus une fois par `Idempotency-Key`.
+
+    Sans en-tête `Idempotency-Key`, `compute()` est simplement appelé. Seules
+    les réponses définitives (statut < 500) sont conservées ; une erreur serveur
+    libère la clé pour qu'un nouvel essai refasse le travail.
+
+    Args:
+        function_name (str): Nom de la fonction, qui isole les clés entre fonctions.
+        event: L'objet événement de la requête.
+        compute (callable): Produit la réponse HTTP du handler.
+
+    Returns:
+        dict: La réponse HTTP calculée ou rejouée.
+    """
+    key = get_header(event, HEADER)
+    if not key:
+        return compute()
+    if len(key) > MAX_KEY_LENGTH:
+        return _json_error(400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    key_hash = _key_hash(function_name, key)
+    request_hash = hashlib.sha256(get_body(event)).hexdigest()
+
+    try:
+        for _ in range(2):
+            claimed = _execute(CLAIM_QUERY, (function_name, key_hash, request_hash, IDEMPOTENCY_LEASE),
+                               fetch=True, shard_key=key_hash)
+            if claimed:
+                break
+            replayed = _wait_for_response(function_name, key_hash, key, request_hash)
+            if replayed is not None:
+                return replayed
+        else:
+            return _json_error(409, "A request with this Idempotency-Key is already in progress",
+                               headers={"Retry-After": "1"})
+    except db.DatabaseUnavailable as e:
+        return responses.service_unavailable(e)
+    except Exception as e:
+        return _json_error(500, f"An error occurred: {str(e)}")
+
+    response = None
+    try:
+        response = compute()
+    finally:
+        try:
+            if response is not None and response.get("statusCode", 200) < 500:
+                _store(function_name, key_hash, key, response)
+            else:
+                _release(function_name, key_hash)
+            if random.random() < PURGE_PROBABILITY:
+                _purge_expired(key_hash)
+        except Exception as e:
+            # The lease will expire on its own; the computed response is still valid
+            print(f"Failed to record idempotent response: {e}")
+    return response
+
+
+def idempotent(function_name):
+    """Décorateur appliquant `run()` à un handler `handle(event, context)`."""
+    def decorator(handle):
+        @functools.wraps(handle)
+        def wrapper(event, context):
+            return run(function_name, event, lambda: handle(event, context))
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from . import idempotency  # noqa: E402
+
+
+class Event:
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+
+
+def test_without_key_runs_handler_directly():
+    calls = []
+    response = idempotency.run('generate-2fa', Event(b'{}'), lambda: calls.append(1) or {"statusCode": 200})
+    assert calls == [1]
+    assert response == {"statusCode": 200}
+
+
+def test_overlong_key_is_rejected():
+    event = Event(b'{}', {'Idempotency-Key': 'k' * 300})
+    response = idempotency.run('generate-2fa', event, lambda: {"statusCode": 200})
+    assert response["statusCode"] == 400
+
+
+def test_stored_response_replays_with_marker_header(monkeypatch):
+    stored = {}
+
+    def fake_execute(query, params, fetch=False, shard_key=None):
+        if query is idempotency.CLAIM_QUERY:
+            if 'row' in stored:
+                return None
+            stored['row'] = [params[2], 'pending', None, None]
+            return (1,)
+        if query.strip().startswith('UPDATE'):
+            stored['row'][1:] = ['done', params[0], params[1]]
+        elif query.strip().startswith('SELECT'):
+            return tuple(stored['row'])
+
+    monkeypatch.setattr(idempotency, '_execute', fake_execute)
+    monkeypatch.setattr(idempotency, 'PURGE_PROBABILITY', 0)
+    event = Event(b'{"username": "alice"}', {'idempotency-key': 'abc'})
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"statusCode": 200, "body": json.dumps({"secret": "S3CR3T"})}
+
+    first = idempotency.run('generate-2fa', event, compute)
+    second = idempotency.run('generate-2fa', event, compute)
+
+    assert calls == [1]
+    assert 'S3CR3T' not in stored['row'][3]
+    assert second["body"] == first["body"]
+    assert second["headers"][idempotency.REPLAYED_HEADER] == "true"
+
+
+def test_key_reused_with_other_body_is_rejected(monkeypatch):
+    monkeypatch.setattr(idempotency, '_execute', lambda query, params, fetch=False, shard_key=None:
+                        None if query is idempotency.CLAIM_QUERY else ('other', 'done', 200, ''))
+    event = Event(b'{"username": "bob"}', {'Idempotency-Key': 'abc'})
+    response = idempotency.run('generate-password', event, lambda: {"statusCode": 200})
+    assert response["statusCode"] == 422
@@ -0,0 +1,415 @@
+"""
+Limite adaptative du nombre de requêtes en cours par réplique.
+
+Chaque réplique accepte au plus `limit` requêtes à la fois ; les requêtes en
+trop sont refusées immédiatement avec une réponse 503 et un `Retry-After`,
+au lieu d'attendre dans la file d'écoute jusqu'au timeout du watchdog.
+
+La limite suit un algorithme à gradient : une moyenne mobile rapide et une
+moyenne mobile lente de la latence sont comparées après chaque requête,
+
+    gradient = clamp(LIMITER_TOLERANCE * lente / rapide, 0.5, 1)
+    limite = limite * gradient + 1    (lissée, bornée par MIN et MAX)
+
+de sorte que la limite croît d'une unité tant que la latence reste proche de
+sa valeur habituelle et diminue dès qu'elle s'en écarte. Deux latences sont
+observées : celle des transactions sur la base (`common.repository`) et
+celle du handler, par fonction ; le plus petit des deux gradients est
+retenu. Une réponse 503 du handler (base indisponible) ou une exception
+réduit en plus la limite d'un facteur `LIMITER_BACKOFF`. La limite n'est
+pas augmentée tant que moins de la moitié est utilisée. Une réponse 504
+(échéance dépassée, souvent après une longue attente) compte comme un 503.
+
+Chaque fonction a une part (`SHARES`) : 1 pour `authenticate-user`, 0.75
+pour `check-user-status` et `generate-2fa`, 0.5 pour `generate-password`. Au
+maximum, toutes les fonctions sont admises jusqu'à la limite ; à mesure
+qu'elle baisse, le seuil d'une fonction baisse d'autant plus vite que sa part
+est petite,
+
+    seuil = limite - (1 - part) * (MAX - limite)
+
+de sorte que `generate-password` est refusé avant `authenticate-user`. Une
+réplique inoccupée admet toujours la requête, ce qui permet à la limite de
+remonter.
+
+L'état est partagé entre les workers du serveur pré-forké (`common.prefork`) :
+il est créé en mémoire partagée à l'import, dans le maître, avant le fork.
+Il est publié au format Prometheus sur `GET LIMITER_METRICS_PATH`, avec les
+signaux d'autoscaling de la réplique : requêtes en cours, connexions en
+attente d'un worker dans la file d'écoute (`replica_queue_depth`, sous Linux
+avec le serveur pré-forké) et histogramme des durées du handler, dont
+Prometheus déduit le p95 (voir `chart/templates/prometheusrule.yaml`),
+les requêtes dont l'échéance est dépassée, par étape (voir `common.deadline`),
+et la durée des instructions SQL par requête (voir `common.slowlog`).
+
+Variables d'environnement :
+    LIMITER_ENABLED: active la limite (par défaut `true`).
+    LIMITER_MIN_LIMIT, LIMITER_MAX_LIMIT: bornes de la limite (par défaut 1 et
+        `WORKERS`, ou 8) ; la limite démarre au maximum.
+    LIMITER_TOLERANCE: hausse de latence tolérée avant de réduire la limite.
+    LIMITER_BACKOFF: facteur appliqué à la limite sur un 503 ou une exception.
+    LIMITER_METRICS_PATH: chemin des métriques (par défaut `/metrics`).
+"""
+import functools
+import os
+import socket
+import struct
+import threading
+import time
+
+from . import responses
+
+LIMITER_ENABLED = os.getenv('LIMITER_ENABLED', 'true').strip().lower() not in ('0', 'false', 'no', 'off')
+LIMITER_MIN_LIMIT = float(os.getenv('LIMITER_MIN_LIMIT', '1'))
+LIMITER_MAX_LIMIT = float(os.getenv('LIMITER_MAX_LIMIT') or os.getenv('WORKERS') or '8')
+LIMITER_TOLERANCE = float(os.getenv('LIMITER_TOLERANCE', '1.5'))
+LIMITER_BACKOFF = float(os.getenv('LIMITER_BACKOFF', '0.9'))
+LIMITER_METRICS_PATH = os.getenv('LIMITER_METRICS_PATH', '/metrics')
+
+SHORT_WINDOW = 10
+LONG_WINDOW = 500
+SMOOTHING = 0.2
+RETRY_AFTER = 1  # secondes
+
+FUNCTIONS = ('authenticate-user', 'check-user-status', 'generate-2fa', 'generate-password')
+SHARES = {
+    'authenticate-user': 1.0,
+    'check-user-status': 0.75,
+    'generate-2fa': 0.75,
+    'generate-password': 0.5,
+}
+
+# Handler duration histogram buckets, in seconds (bcrypt dominates)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Where a request can run out of time (see common.deadline)
+DEADLINE_STEPS = ('received', 'database', 'bcrypt', 'qr')
+
+# Tags of the timed SQL statements (see common.slowlog)
+QUERIES = ('get_user_auth', 'exists', 'get_status', 'get_version', 'create_user', 'set_mfa',
+           'mark_expired', 'idempotency')
+
+# Shared state layout (float64 cells)
+_LIMIT, _DB_SHORT, _DB_LONG, _DB_SAMPLES, _DROPS = range(5)
+_FN_BASE = 5
+_ADMITTED, _SHED, _FN_SHORT, _FN_LONG, _FN_SAMPLES, _DURATION_SUM = range(6)
+# Per-bucket counts, the last one being +Inf (the request count), then expirations per step,
+# then count, total time and slow count per query
+_HIST = 6
+_EXPIRED = _HIST + len(BUCKETS) + 1
+_QUERY = _EXPIRED + len(DEADLINE_STEPS)
+_QUERY_COUNT, _QUERY_SUM, _QUERY_SLOW = range(3)
+_FN_CELLS = _QUERY + 3 * len(QUERIES)
+# In-flight slots: owner PID and function index, 0 when free
+_SLOTS = max(1, int(LIMITER_MAX_LIMIT))
+_SLOT_BASE = _FN_BASE + _FN_CELLS * len(FUNCTIONS)
+_CELLS = _SLOT_BASE + 2 * _SLOTS
+
+
+def _shared_state():
+    """Cellules et verrou partagés par les processus forkés après l'import.
+
+    Sans sémaphore POSIX (certains bacs à sable), l'état reste propre au processus.
+    """
+    try:
+        import multiprocessing
+        from multiprocessing.sharedctypes import RawArray
+        return RawArray('d', _CELLS), multiprocessing.Lock()
+    except (ImportError, OSError):
+        return [0.0] * _CELLS, threading.Lock()
+
+
+_state, _lock = _shared_state()
+_listen_socket = None
+
+
+def reset(max_limit=LIMITER_MAX_LIMIT):
+    """Remet la limite au maximum et efface compteurs, moyennes et requêtes en cours."""
+    with _lock:
+        for i in range(_CELLS):
+            _state[i] = 0.0
+        _state[_LIMIT] = max(LIMITER_MIN_LIMIT, min(max_limit, _SLOTS))
+
+
+def _fn(name):
+    index = FUNCTIONS.index(name) if name in FUNCTIONS else len(FUNCTIONS) - 1
+    return index, _FN_BASE + _FN_CELLS * index
+
+
+def _inflight():
+    return sum(1 for slot in range(_SLOTS) if _state[_SLOT_BASE + 2 * slot])
+
+
+def _observe(short, long, samples, value):
+    """Met à jour une paire de moyennes mobiles (rapide, lente)."""
+    n = _state[samples] = _state[samples] + 1
+    if n == 1:
+        _state[short] = _state[long] = value
+        return
+    _state[short] += (value - _state[short]) / min(n, SHORT_WINDOW)
+    _state[long] += (value - _state[long]) / min(n, LONG_WINDOW)
+    # Latency dropped for good: let the baseline catch up faster
+    if _state[long] > 2 * _state[short]:
+        _state[long] *= 0.95
+
+
+def _gradient(short, long):
+    if _state[short] <= 0:
+        return 1.0
+    return max(0.5, min(1.0, LIMITER_TOLERANCE * _state[long] / _state[short]))
+
+
+def try_acquire(name):
+    """Admet une requête de la fonction `name`.
+
+    Returns:
+        int or None: L'emplacement réservé, à rendre avec `release()`, ou None
+        si la requête doit être refusée.
+    """
+    index, base = _fn(name)
+    share = SHARES.get(name, min(SHARES.values()))
+    with _lock:
+        inflight = _inflight()
+        limit = _state[_LIMIT]
+        if inflight and inflight >= limit - (1 - share) * (LIMITER_MAX_LIMIT - limit):
+            _state[base + _SHED] += 1
+            return None
+        for slot in range(_SLOTS):
+            cell = _SLOT_BASE + 2 * slot
+            if not _state[cell]:
+                _state[cell] = os.getpid()
+                _state[cell + 1] = index
+                _state[base + _ADMITTED] += 1
+                return slot
+        _state[base + _SHED] += 1
+        return None
+
+
+def release(slot, name, seconds, dropped=False):
+    """Rend l'emplacement `slot` et ajuste la limite d'après la latence observée.
+
+    Args:
+        slot (int): Emplacement retourné par `try_acquire()`.
+        name (str): Fonction qui a servi la requête.
+        seconds (float): Durée du handler.
+        dropped (bool): La requête a échoué faute de capacité (503 ou exception).
+    """
+    _, base = _fn(name)
+    with _lock:
+        inflight = _inflight()
+        _state[_SLOT_BASE + 2 * slot] = 0.0
+        _observe(base + _FN_SHORT, base + _FN_LONG, base + _FN_SAMPLES, seconds)
+        _state[base + _DURATION_SUM] += seconds
+        bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        _state[base + _HIST + bucket] += 1
+        limit = _state[_LIMIT]
+        if dropped:
+            _state[_DROPS] += 1
+            limit *= LIMITER_BACKOFF
+        elif inflight >= limit / 2:
+            gradient = min(_gradient(_DB_SHORT, _DB_LONG),
+                           _gradient(base + _FN_SHORT, base + _FN_LONG))
+            limit = limit * (1 - SMOOTHING) + (limit * gradient + 1) * SMOOTHING
+        _state[_LIMIT] = max(LIMITER_MIN_LIMIT, min(limit, LIMITER_MAX_LIMIT, _SLOTS))
+
+
+def observe_db(seconds):
+    """Enregistre la durée d'une transaction sur la base de données."""
+    with _lock:
+        _observe(_DB_SHORT, _DB_LONG, _DB_SAMPLES, seconds)
+
+
+def deadline_expired(name, step):
+    """Compte une requête de `name` arrêtée à l'étape `step` faute de temps."""
+    _, base = _fn(name)
+    index = DEADLINE_STEPS.index(step) if step in DEADLINE_STEPS else 0
+    with _lock:
+        _state[base + _EXPIRED + index] += 1
+
+
+def observe_query(name, query, seconds, slow):
+    """Enregistre la durée d'une instruction SQL `query` exécutée pour `name`."""
+    _, base = _fn(name)
+    cell = base + _QUERY + 3 * (QUERIES.index(query) if query in QUERIES else 0)
+    with _lock:
+        _state[cell + _QUERY_COUNT] += 1
+        _state[cell + _QUERY_SUM] += seconds
+        if slow:
+            _state[cell + _QUERY_SLOW] += 1
+
+
+def release_process(pid):
+    """Libère les emplacements d'un worker terminé en cours de requête."""
+    with _lock:
+        for slot in range(_SLOTS):
+            if _state[_SLOT_BASE + 2 * slot] == pid:
+                _state[_SLOT_BASE + 2 * slot] = 0.0
+
+
+def watch_listen_socket(sock):
+    """Publie la longueur de la file d'écoute de `sock`, la socket commune aux workers."""
+    global _listen_socket
+    _listen_socket = sock
+
+
+def queue_depth():
+    """Connexions acceptées par le noyau mais pas encore par un worker, ou None.
+
+    Sous Linux, `tcpi_unacked` d'une socket en écoute est la longueur de sa file d'attente.
+    """
+    if _listen_socket is None or not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        info = _listen_socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from('I', info, 24)[0]
+    except (OSError, struct.error):
+        return None
+
+
+def _histogram(state, name, base):
+    lines = []
+    count = 0
+    for i, bound in enumerate(BUCKETS):
+        count += int(state[base + _HIST + i])
+        lines.append(f'function_request_duration_seconds_bucket{{function="{name}",le="{bound}"}} {count}')
+    count += int(state[base + _HIST + len(BUCKETS)])
+    lines.append(f'function_request_duration_seconds_bucket{{function="{name}",le="+Inf"}} {count}')
+    lines.append(f'function_request_duration_seconds_sum{{function="{name}"}} {state[base + _DURATION_SUM]:.6f}')
+    lines.append(f'function_request_duration_seconds_count{{function="{name}"}} {count}')
+    return lines
+
+
+def metrics():
+    """État du limiteur et signaux d'autoscaling au format texte de Prometheus."""
+    with _lock:
+        state = list(_state)
+    depth = queue_depth()
+    inflight = {}
+    for slot in range(_SLOTS):
+        if state[_SLOT_BASE + 2 * slot]:
+            name = FUNCTIONS[int(state[_SLOT_BASE + 2 * slot + 1])]
+            inflight[name] = inflight.get(name, 0) + 1
+
+    lines = [
+        "# HELP limiter_limit Current adaptive concurrency limit of the replica.",
+        "# TYPE limiter_limit gauge",
+        f"limiter_limit {state[_LIMIT]:.3f}",
+        "# HELP limiter_inflight Requests currently being served.",
+        "# TYPE limiter_inflight gauge",
+    ]
+    lines += [f'limiter_inflight{{function="{name}"}} {inflight.get(name, 0)}' for name in FUNCTIONS]
+    lines += [
+        "# HELP limiter_requests_total Requests admitted or shed by the limiter.",
+        "# TYPE limiter_requests_total counter",
+    ]
+    for name in FUNCTIONS:
+        _, base = _fn(name)
+        lines.append(f'limiter_requests_total{{function="{name}",outcome="admitted"}} {int(state[base + _ADMITTED])}')
+        lines.append(f'limiter_requests_total{{function="{name}",outcome="shed"}} {int(state[base + _SHED])}')
+    lines += [
+        "# HELP limiter_drops_total Requests that failed with a 503 or an exception.",
+        "# TYPE limiter_drops_total counter",
+        f"limiter_drops_total {int(state[_DROPS])}",
+        "# HELP limiter_db_latency_seconds Moving averages of the database transaction time.",
+        "# TYPE limiter_db_latency_seconds gauge",
+        f'limiter_db_latency_seconds{{window="short"}} {state[_DB_SHORT]:.6f}',
+        f'limiter_db_latency_seconds{{window="long"}} {state[_DB_LONG]:.6f}',
+        "# HELP limiter_handler_latency_seconds Moving averages of the handler time.",
+        "# TYPE limiter_handler_latency_seconds gauge",
+    ]
+    for name in FUNCTIONS:
+        _, base = _fn(name)
+        lines.append(f'limiter_handler_latency_seconds{{function="{name}",window="short"}} {state[base + _FN_SHORT]:.6f}')
+        lines.append(f'limiter_handler_latency_seconds{{function="{name}",window="long"}} {state[base + _FN_LONG]:.6f}')
+    lines += [
+        "# HELP function_request_duration_seconds Handler time of the requests admitted by the replica.",
+        "# TYPE function_request_duration_seconds histogram",
+    ]
+    for name in FUNCTIONS:
+        lines += _histogram(state, name, _fn(name)[1])
+    lines += [
+        "# HELP deadline_expired_total Requests answered 504 because their deadline passed, by step.",
+        "# TYPE deadline_expired_total counter",
+    ]
+    for name in FUNCTIONS:
+        _, base = _fn(name)
+        lines += [f'deadline_expired_total{{function="{name}",step="{step}"}} {int(state[base + _EXPIRED + i])}'
+                  for i, step in enumerate(DEADLINE_STEPS)]
+    lines += [
+        "# HELP db_query_duration_seconds Time spent in SQL statements, by function and query.",
+        "# TYPE db_query_duration_seconds summary",
+    ]
+    for name in FUNCTIONS:
+        _, base = _fn(name)
+        for i, query in enumerate(QUERIES):
+            cell = base + _QUERY + 3 * i
+            labels = f'function="{name}",query="{query}"'
+            lines.append(f'db_query_duration_seconds_sum{{{labels}}} {state[cell + _QUERY_SUM]:.6f}')
+            lines.append(f'db_query_duration_seconds_count{{{labels}}} {int(state[cell + _QUERY_COUNT])}')
+    lines += [
+        "# HELP db_slow_queries_total SQL statements slower than SLOW_QUERY_MS, by function and query.",
+        "# TYPE db_slow_queries_total counter",
+    ]
+    for name in FUNCTIONS:
+        _, base = _fn(name)
+        lines += [f'db_slow_queries_total{{function="{name}",query="{query}"}} '
+                  f'{int(state[base + _QUERY + 3 * i + _QUERY_SLOW])}'
+                  for i, query in enumerate(QUERIES)]
+    lines += [
+        "# HELP replica_workers Requests the replica can serve at once (pre-fork workers).",
+        "# TYPE replica_workers gauge",
+        f"replica_workers {int(os.getenv('WORKERS') or 1)}",
+    ]
+    if depth is not None:
+        lines += [
+            "# HELP replica_queue_depth Connections waiting for a free worker.",
+            "# TYPE replica_queue_depth gauge",
+            f"replica_queue_depth {depth}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_response():
+    """Réponse HTTP des métriques du limiteur."""
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "text/plain; version=0.0.4"},
+        "body": metrics()
+    }
+
+
+def is_metrics_request(event):
+    """La requête demande les métriques du limiteur."""
+    return (getattr(event, 'method', None) == 'GET'
+            and (getattr(event, 'path', None) or '').rstrip('/') == LIMITER_METRICS_PATH.rstrip('/'))
+
+
+def limited(function_name):
+    """Décorateur qui soumet un handler `handle(event, context)` à la limite.
+
+    Sans `LIMITER_ENABLED`, le handler est retourné tel quel.
+    """
+    def decorator(handle):
+        if not LIMITER_ENABLED:
+            return handle
+
+        @functools.wraps(handle)
+        def wrapper(event, context):
+            if is_metrics_request(event):
+                return metrics_response()
+            slot = try_acquire(function_name)
+            if slot is None:
+                return responses.overloaded(RETRY_AFTER)
+            start = time.perf_counter()
+            response = None
+            try:
+                response = handle(event, context)
+            finally:
+                dropped = response is None or response.get('statusCode') in (503, 504)
+                release(slot, function_name, time.perf_counter() - start, dropped)
+            return response
+        return wrapper
+    return decorator
+
+
+reset()
@@ -0,0 +1,103 @@
+import os
+import socket
+
+import pytest
+
+from . import limiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiter(monkeypatch):
+    monkeypatch.setattr(limiter, "LIMITER_MAX_LIMIT", 8)
+    limiter.reset(8)
+    yield
+    limiter.reset()
+
+
+def _serve(name, seconds, db_seconds=None, concurrent=8):
+    """Admits `concurrent` requests then completes them with the given latencies."""
+    slots = [limiter.try_acquire(name) for _ in range(concurrent)]
+    for slot in slots:
+        if slot is not None:
+            if db_seconds is not None:
+                limiter.observe_db(db_seconds)
+            limiter.release(slot, name, seconds)
+    return slots
+
+
+def test_limit_follows_database_latency_and_sheds_by_priority():
+    for _ in range(50):
+        _serve("authenticate-user", 0.01, db_seconds=0.002)
+    assert limiter._state[limiter._LIMIT] == 8
+
+    for _ in range(30):
+        _serve("authenticate-user", 0.01, db_seconds=0.050)
+    limit = limiter._state[limiter._LIMIT]
+    assert limit < 4
+
+    held = [limiter.try_acquire("authenticate-user") for _ in range(int(limit))]
+    assert None not in held
+    assert limiter.try_acquire("generate-password") is None
+    for slot in held:
+        limiter.release(slot, "authenticate-user", 0.01)
+
+    text = limiter.metrics()
+    assert 'limiter_requests_total{function="generate-password",outcome="shed"} 1' in text
+    assert f"limiter_limit {limiter._state[limiter._LIMIT]:.3f}" in text
+
+
+def test_idle_replica_always_admits_and_dead_worker_slots_are_freed():
+    limiter._state[limiter._LIMIT] = 1
+    slot = limiter.try_acquire("generate-password")
+    assert slot is not None
+    assert limiter.try_acquire("generate-password") is None
+
+    limiter.release_process(os.getpid())
+    assert limiter.try_acquire("generate-password") is not None
+
+
+def test_unavailable_database_backs_off_and_metrics_are_served():
+    calls = []
+
+    @limiter.limited("generate-2fa")
+    def handle(event, context):
+        calls.append(event)
+        return {"statusCode": 503, "headers": {"Retry-After": "2"}, "body": "{}"}
+
+    class Event:
+        method = "GET"
+        path = "/metrics"
+
+    response = handle(Event(), None)
+    assert response["statusCode"] == 200
+    assert "limiter_limit 8.000" in response["body"]
+    assert not calls
+
+    Event.method = "POST"
+    handle(Event(), None)
+    assert limiter._state[limiter._LIMIT] == pytest.approx(8 * limiter.LIMITER_BACKOFF)
+    assert "limiter_drops_total 1" in limiter.metrics()
+
+
+def test_autoscaling_signals_are_exported(monkeypatch):
+    listen = socket.socket()
+    listen.bind(("127.0.0.1", 0))
+    listen.listen(16)
+    waiting = [socket.create_connection(listen.getsockname()) for _ in range(3)]
+    monkeypatch.setattr(limiter, "_listen_socket", listen)
+    try:
+        for seconds in (0.004, 0.3, 0.3, 20):
+            limiter.release(limiter.try_acquire("authenticate-user"), "authenticate-user", seconds)
+
+        text = limiter.metrics()
+    finally:
+        for conn in waiting:
+            conn.close()
+        listen.close()
+
+    assert 'function_request_duration_seconds_bucket{function="authenticate-user",le="0.005"} 1' in text
+    assert 'function_request_duration_seconds_bucket{function="authenticate-user",le="0.5"} 3' in text
+    assert 'function_request_duration_seconds_bucket{function="authenticate-user",le="+Inf"} 4' in text
+    assert 'function_request_duration_seconds_count{function="authenticate-user"} 4' in text
+    if hasattr(socket, "TCP_INFO"):
+        assert "replica_queue_depth 3" in text
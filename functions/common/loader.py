@@ -0,0 +1,69 @@
+"""
+Chargement d'un ou plusieurs handlers dans le processus courant.
+
+Dans l'image du template, un handler est le module `function.handler` et
+importe le code partagé par `from .common import ...`. Pour exécuter plusieurs
+handlers dans un même processus (outils de test, service regroupé), chacun est
+chargé comme `<paquet>.handler` sous un paquet synthétique dont le sous-paquet
+`common` est un alias de ce paquet-ci : tous les handlers partagent alors
+les mêmes modules, donc le même pool de connexions et le même état.
+"""
+import importlib
+import importlib.util
+import os
+import pkgutil
+import sys
+import types
+
+_COMMON_PACKAGE = __name__.rpartition('.')[0]
+
+
+def _alias_common(package_name):
+    """Fait pointer `<package_name>.common[.X]` vers les modules de ce paquet."""
+    common = sys.modules[_COMMON_PACKAGE]
+    for info in pkgutil.iter_modules(common.__path__):
+        if info.name.endswith('_test'):
+            continue
+        try:
+            importlib.import_module(f"{_COMMON_PACKAGE}.{info.name}")
+        except ImportError:
+            # Optional dependency of a module this process does not use
+            continue
+
+    prefix = _COMMON_PACKAGE + '.'
+    for name, module in list(sys.modules.items()):
+        if name == _COMMON_PACKAGE or name.startswith(prefix):
+            sys.modules[f"{package_name}.common{name[len(_COMMON_PACKAGE):]}"] = module
+    return common
+
+
+def load_handler(function_dir, package_name=None):
+    """Charge `<function_dir>/handler.py` et retourne le module.
+
+    Args:
+        function_dir (str): Répertoire du handler (par exemple `functions/check-user-status`).
+        package_name (str, optional): Nom du paquet synthétique ; dérivé du nom
+            du répertoire par défaut (`check_user_status`).
+
+    Returns:
+        module: Le module handler, qui expose `handle(event, context)`.
+    """
+    function_dir = os.path.abspath(function_dir)
+    if package_name is None:
+        package_name = os.path.basename(function_dir).replace('-', '_')
+
+    module_name = f"{package_name}.handler"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    package = types.ModuleType(package_name)
+    package.__path__ = [function_dir]
+    sys.modules[package_name] = package
+    package.common = _alias_common(package_name)
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    package.handler = module
+    return module
@@ -0,0 +1,313 @@
+"""
+Serveur HTTP pré-forké pour les fonctions OpenFaaS.
+
+Le template `python3-http` sert chaque réplique avec un seul processus, qui
+n'utilise donc qu'un seul cœur. Ce module remplace ce serveur lorsqu'il est
+lancé comme `fprocess` par le of-watchdog :
+
+    fprocess: python -m function.common.prefork
+
+Le processus maître importe le handler une seule fois (ainsi que les modules
+listés dans `PRELOAD`), gèle le ramasse-miettes puis forke `WORKERS` workers
+qui partagent en copie sur écriture le bytecode, bcrypt, cryptography et PIL.
+Chaque worker accepte les requêtes sur la socket d'écoute commune, possède son
+propre pool de connexions (voir `common.db`) et se termine proprement après
+`MAX_REQUESTS` requêtes ; le maître le remplace alors par un nouveau worker.
+`SIGHUP` reçu par le maître est relayé aux workers, qui rechargent alors leur
+configuration (voir `common.config`).
+
+Variables d'environnement :
+    WORKERS: nombre de workers (par défaut : nombre de cœurs).
+    MAX_REQUESTS: requêtes servies avant recyclage d'un worker (0 = jamais).
+    MAX_REQUESTS_JITTER: écart aléatoire ajouté à MAX_REQUESTS pour éviter
+        que tous les workers se recyclent en même temps.
+    PRELOAD: modules supplémentaires à importer dans le maître, séparés par des virgules.
+    HANDLER_MODULE: module exposant `handle(event, context)` (par défaut `function.handler`).
+    PREFORK_PORT: port d'écoute, celui attendu par le watchdog (par défaut 5000).
+"""
+import gc
+import importlib
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from http.server import BaseHTTPRequestHandler
+from socketserver import TCPServer
+from urllib.parse import parse_qsl, urlsplit
+
+WORKERS = int(os.getenv('WORKERS', '0')) or os.cpu_count() or 1
+MAX_REQUESTS = int(os.getenv('MAX_REQUESTS', '0'))
+MAX_REQUESTS_JITTER = int(os.getenv('MAX_REQUESTS_JITTER', '0'))
+PRELOAD = [m.strip() for m in os.getenv('PRELOAD', '').split(',') if m.strip()]
+HANDLER_MODULE = os.getenv('HANDLER_MODULE', 'function.handler')
+PREFORK_PORT = int(os.getenv('PREFORK_PORT', '5000'))
+
+
+class Event:
+    """Requête transmise au handler, avec les mêmes attributs que dans le template."""
+
+    def __init__(self, body, headers, method, query, path):
+        self.body = body
+        self.headers = headers
+        self.method = method
+        self.query = query
+        self.path = path
+
+
+class Context:
+    """Contexte d'exécution transmis au handler."""
+
+    def __init__(self):
+        self.hostname = os.getenv('HOSTNAME', 'localhost')
+
+
+def format_response(res):
+    """Convertit la réponse d'un handler en (statut, en-têtes, corps en octets).
+
+    Reprend les règles du template `python3-http` : `statusCode` vaut 200 par
+    défaut, un corps `dict` est sérialisé en JSON et les en-têtes peuvent être
+    fournis sous forme de dictionnaire ou de liste de couples. Un corps
+    itérateur (générateur d'octets) est renvoyé tel quel pour être diffusé.
+    """
+    if res is None:
+        return 200, [], b''
+
+    status = res.get('statusCode', 200)
+    headers = res.get('headers', [])
+    if isinstance(headers, dict):
+        headers = list(headers.items())
+
+    body = res.get('body', '')
+    if isinstance(body, dict):
+        body = json.dumps(body)
+        if not any(k.lower() == 'content-type' for k, _ in headers):
+            headers.append(('Content-Type', 'application/json'))
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    elif hasattr(body, '__next__'):
+        return status, headers, body
+    elif not isinstance(body, (bytes, bytearray)):
+        body = str(body).encode('utf-8')
+    return status, headers, body
+
+
+def make_request_handler(handle):
+    """Construit la classe de gestion des requêtes HTTP pour le handler donné."""
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        # HTTP/1.0: the connection is closed after each response, so a
+        # keep-alive client cannot pin a single-threaded worker.
+        protocol_version = 'HTTP/1.0'
+
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            event = Event(
+                body=body,
+                headers=self.headers,
+                method=self.command,
+                query=dict(parse_qsl(url.query)),
+                path=url.path
+            )
+            try:
+                status, headers, payload = format_response(handle(event, Context()))
+            except Exception as e:
+                status, headers = 500, [('Content-Type', 'application/json')]
+                payload = json.dumps({"error": f"An error occurred: {str(e)}"}).encode('utf-8')
+
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            if isinstance(payload, (bytes, bytearray)):
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            else:
+                # Streamed body: HTTP/1.0 delimits it by closing the connection
+                self.end_headers()
+                self._stream(payload)
+
+        def _stream(self, chunks):
+            try:
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+            except Exception as e:
+                # Headers are already sent: the truncated body is the only signal left
+                print(f"Streamed response aborted: {e}", file=sys.stderr)
+            finally:
+                close = getattr(chunks, 'close', None)
+                if close:
+                    close()
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return RequestHandler
+
+
+class _WorkerServer(TCPServer):
+    """Serveur mono-thread qui accepte sur une socket héritée du maître."""
+
+    def __init__(self, listen_socket, handler_class):
+        super().__init__(listen_socket.getsockname(), handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listen_socket
+        self.served = 0
+
+    def process_request(self, request, client_address):
+        self.served += 1
+        super().process_request(request, client_address)
+
+
+def create_listen_socket(port=PREFORK_PORT, backlog=1024):
+    """Ouvre la socket d'écoute partagée par tous les workers."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(listen_socket, handle, max_requests):
+    """Boucle d'un worker : sert les requêtes jusqu'au recyclage ou à SIGTERM."""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Replace the master's forwarding handler inherited through fork
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        from . import config
+        config.install_reload_signal()
+    except ImportError:
+        pass
+
+    server = _WorkerServer(listen_socket, make_request_handler(handle))
+    # Wake up regularly when idle to notice SIGTERM
+    server.timeout = 1.0
+    while not stopping and (max_requests <= 0 or server.served < max_requests):
+        server.handle_request()
+
+    try:
+        from . import db
+        db.close_all()
+    except ImportError:
+        pass
+
+
+class Master:
+    """Processus maître : importe le handler, forke et supervise les workers."""
+
+    def __init__(self, handle, listen_socket, workers=WORKERS,
+                 max_requests=MAX_REQUESTS, max_requests_jitter=MAX_REQUESTS_JITTER):
+        self.handle = handle
+        self.listen_socket = listen_socket
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.children = set()
+        self.stopping = False
+
+    def spawn(self):
+        """Forke un worker et enregistre son PID."""
+        max_requests = self.max_requests
+        if max_requests > 0 and self.max_requests_jitter > 0:
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.listen_socket, self.handle, max_requests)
+            except Exception as e:
+                print(f"Worker {os.getpid()} crashed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children.add(pid)
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        """Demande l'arrêt de tous les workers."""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.discard(pid)
+
+    def reload(self, signum=None, frame=None):
+        """Relaie `SIGHUP` aux workers pour qu'ils rechargent leur configuration."""
+        config = sys.modules.get(f"{__package__}.config")
+        if config is not None:
+            # Workers forked from now on start with the new configuration too
+            config.request_reload()
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                self.children.discard(pid)
+
+    def run(self):
+        """Démarre les workers et les remplace lorsqu'ils se terminent."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.children.discard(pid)
+            limiter = sys.modules.get(f"{__package__}.limiter")
+            if limiter is not None:
+                # A worker killed mid-request must not hold its in-flight slot
+                limiter.release_process(pid)
+            if not self.stopping:
+                if os.waitstatus_to_exitcode(status) != 0:
+                    # Avoid a hot fork loop when the handler crashes at start
+                    time.sleep(1)
+                self.spawn()
+
+        self.listen_socket.close()
+
+
+def preload(handler_module=HANDLER_MODULE, modules=PRELOAD):
+    """Importe le handler et les modules à partager avant le fork."""
+    handler = importlib.import_module(handler_module)
+    for name in modules:
+        importlib.import_module(name)
+    # Move everything imported so far to the permanent generation so the
+    # collector in the workers does not touch (and copy) the shared pages.
+    gc.collect()
+    gc.freeze()
+    return handler
+
+
+def main():
+    handler = preload()
+    listen_socket = create_listen_socket()
+    limiter = sys.modules.get(f"{__package__}.limiter")
+    if limiter is not None:
+        # Inherited by the workers, which serve the queue depth with the metrics
+        limiter.watch_listen_socket(listen_socket)
+    print(f"Prefork server listening on :{PREFORK_PORT} with {WORKERS} workers "
+          f"(max_requests={MAX_REQUESTS or 'unlimited'})", flush=True)
+    Master(handler.handle, listen_socket).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Génération des QR codes renvoyés par `generate-password` et `generate-2fa`.
+"""
+import base64
+import io
+import qrcode
+
+
+def create_qr_code(data):
+    """Crée un QR code et le retourne sous forme de chaîne encodée en base64."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    
+    # Convert to base64
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
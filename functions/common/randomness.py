@@ -0,0 +1,104 @@
+"""
+Génération en masse de mots de passe et de secrets TOTP (base32).
+
+Tirer un caractère à la fois (`secrets.choice`) coûte un appel au générateur
+et plusieurs opérations Python par caractère. Ici, un seul tampon
+`os.urandom` est tiré par lot, puis converti en caractères en un passage
+`bytes.translate` (exécuté en C) :
+- chaque octet `b < m`, où `m` est le plus grand multiple de la taille de
+  l'alphabet inférieur ou égal à 256, devient le caractère `b % n` ; chaque
+  caractère a donc exactement `m / n` octets sur `m` : aucun biais ;
+- les octets `>= m` sont supprimés par le même `translate` (échantillonnage
+  par rejet) et remplacés au tirage suivant.
+
+Les mots de passe doivent contenir au moins une minuscule, une majuscule, un
+chiffre et un caractère spécial. Les candidats tirés en bloc qui n'en
+contiennent pas sont écartés, comme le faisait la boucle de
+`generate_secure_password` : la distribution reste uniforme sur les mots de
+passe valides et leur entropie est inchangée (environ 147 bits pour 24
+caractères). Insérer d'office un caractère de chaque classe à une position
+tirée la réduirait et rendrait certains mots de passe plus probables. Le
+test de présence d'une classe est lui aussi un `translate` par candidat.
+
+Les secrets base32 (32 caractères, 160 bits, comme `pyotp.random_base32()`)
+ne rejettent aucun octet : 256 est un multiple de 32.
+"""
+import os
+import string
+
+LOWERCASE = string.ascii_lowercase
+UPPERCASE = string.ascii_uppercase
+DIGITS = string.digits
+SPECIAL = "!@#$%^&*"
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + SPECIAL
+PASSWORD_CLASSES = (LOWERCASE, UPPERCASE, DIGITS, SPECIAL)
+PASSWORD_LENGTH = 24
+
+BASE32_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+BASE32_LENGTH = 32
+
+_tables = {}
+
+
+def _table(alphabet):
+    """Table de `translate` et octets rejetés pour un alphabet d'au plus 256 caractères."""
+    entry = _tables.get(alphabet)
+    if entry is None:
+        symbols = alphabet.encode('ascii')
+        if not 0 < len(symbols) <= 256 or len(set(symbols)) != len(symbols):
+            raise ValueError("alphabet must hold 1 to 256 distinct ASCII characters")
+        accepted = 256 - 256 % len(symbols)
+        table = bytes(symbols[b % len(symbols)] for b in range(accepted)) + bytes(256 - accepted)
+        entry = _tables[alphabet] = (table, bytes(range(accepted, 256)), accepted)
+    return entry
+
+
+def draw(alphabet, count):
+    """Tire `count` caractères indépendants et uniformes dans `alphabet` (octets ASCII)."""
+    table, rejected, accepted = _table(alphabet)
+    chunks, total = [], 0
+    while total < count:
+        needed = count - total
+        # Expected bytes for the missing characters, plus a margin so one draw usually suffices
+        size = needed * 256 // accepted + 64 if rejected else needed
+        chunk = os.urandom(size).translate(table, rejected)
+        chunks.append(chunk)
+        total += len(chunk)
+    return b''.join(chunks)[:count]
+
+
+def passwords(count, length=PASSWORD_LENGTH, alphabet=PASSWORD_ALPHABET, classes=PASSWORD_CLASSES):
+    """Tire `count` mots de passe de `length` caractères contenant chacun au moins
+    un caractère de chaque classe de `classes`, uniformément parmi ceux-ci."""
+    if length < len(classes):
+        raise ValueError(f"length must be at least {len(classes)} to hold every character class")
+    if not all(chars and set(chars) <= set(alphabet) for chars in classes):
+        raise ValueError("every character class must be a non-empty subset of the alphabet")
+    class_bytes = [chars.encode('ascii') for chars in classes]
+    result = []
+    while len(result) < count:
+        missing = count - len(result)
+        block = draw(alphabet, (missing + missing // 8 + 1) * length)
+        for start in range(0, len(block), length):
+            candidate = block[start:start + length]
+            if all(len(candidate.translate(None, chars)) < length for chars in class_bytes):
+                result.append(candidate.decode('ascii'))
+                if len(result) == count:
+                    break
+    return result
+
+
+def base32_secrets(count, length=BASE32_LENGTH):
+    """Tire `count` secrets TOTP base32 de `length` caractères (5 bits chacun)."""
+    block = draw(BASE32_ALPHABET, count * length).decode('ascii')
+    return [block[start:start + length] for start in range(0, len(block), length)]
+
+
+def password(length=PASSWORD_LENGTH):
+    """Un mot de passe (voir `passwords`)."""
+    return passwords(1, length)[0]
+
+
+def base32_secret(length=BASE32_LENGTH):
+    """Un secret TOTP base32 (voir `base32_secrets`)."""
+    return base32_secrets(1, length)[0]
@@ -0,0 +1,44 @@
+import base64
+from collections import Counter
+
+from . import randomness
+
+
+def chi_square_bound(categories, z=4.75):
+    """Chi-square critical value for a false alarm rate of about 1e-6 (Wilson-Hilferty)."""
+    df = categories - 1
+    return df * (1 - 2 / (9 * df) + z * (2 / (9 * df)) ** 0.5) ** 3
+
+
+def chi_square(counts, alphabet):
+    expected = sum(counts[c] for c in alphabet) / len(alphabet)
+    return sum((counts[c] - expected) ** 2 / expected for c in alphabet)
+
+
+def test_draw_is_uniform_despite_rejection():
+    # 70 symbols: 46 of the 256 byte values are rejected
+    sample = randomness.draw(randomness.PASSWORD_ALPHABET, 350_000).decode('ascii')
+    assert len(sample) == 350_000
+    counts = Counter(sample)
+    assert set(counts) == set(randomness.PASSWORD_ALPHABET)
+    assert chi_square(counts, randomness.PASSWORD_ALPHABET) < chi_square_bound(70)
+
+
+def test_passwords_hold_every_class_and_are_uniform_within_classes():
+    passwords = randomness.passwords(5000)
+    assert len(passwords) == len(set(passwords)) == 5000
+    for password in passwords:
+        assert len(password) == randomness.PASSWORD_LENGTH
+        assert all(set(password) & set(chars) for chars in randomness.PASSWORD_CLASSES)
+
+    counts = Counter(''.join(passwords))
+    for chars in randomness.PASSWORD_CLASSES:
+        assert chi_square(counts, chars) < chi_square_bound(len(chars))
+
+
+def test_base32_secrets_are_uniform_and_decodable():
+    secrets = randomness.base32_secrets(4000)
+    assert len(secrets) == 4000 and all(len(secret) == 32 for secret in secrets)
+    assert len(base64.b32decode(secrets[0])) == 20
+    counts = Counter(''.join(secrets))
+    assert chi_square(counts, randomness.BASE32_ALPHABET) < chi_square_bound(32)
@@ -0,0 +1,346 @@
+"""
+Accès aux comptes utilisateurs, indépendamment du stockage.
+
+Les handlers ne manipulent plus de curseur : ils appellent les opérations du
+dépôt retourné par `get_repository()` (lecture des informations
+d'authentification et du statut, existence d'un compte, création, activation de la 2FA,
+marquage d'un compte expiré). Deux implémentations sont fournies :
+
+- `PostgresRepository` (par défaut) : une transaction par opération sur le
+  pool de `common.db` (donc sur le shard de l'utilisateur), avec mise à jour
+  de `account_stats` (`common.stats`) dans la même transaction ;
+- `MemoryRepository` : un dictionnaire protégé par un verrou, sans base de
+  données, pour les tests, les benchmarks et les tests de charge locaux
+  (`STORAGE_BACKEND=memory`). Il n'alimente pas `account_stats`.
+
+Avec `STATUS_SNAPSHOT`, le dépôt PostgreSQL est enveloppé par
+`SnapshotRepository`, qui lit le statut et la version des comptes dans
+l'instantané en mémoire partagée (`common.snapshot`) tant qu'il est à jour.
+
+Les deux implémentations renvoient les mêmes tuples nommés et incrémentent la
+version d'un compte à chaque écriture (voir l'`ETag` de `check-user-status`).
+
+Chaque instruction est chronométrée et étiquetée par le nom de l'opération
+(`common.slowlog`). Dans une requête bornée (`common.deadline`), les
+transactions PostgreSQL reçoivent un `statement_timeout` et un `lock_timeout` tirés du temps restant ;
+une requête annulée par l'un d'eux lève `DeadlineExceeded`.
+"""
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import psycopg2.errors
+
+from . import config, db, deadline, limiter, slowlog, snapshot, stats
+
+UserAuth = namedtuple('UserAuth', 'id password mfa gendate expired')
+UserStatus = namedtuple('UserStatus', 'id version has_2fa expired expired_by_time')
+UserVersion = namedtuple('UserVersion', 'id version stale')
+
+# Expired by time: created more than `expiry_days` days ago
+_EXPIRED_BY_TIME = "to_timestamp(gendate/1000.0) + make_interval(days => %s) < NOW()"
+
+# Never selects password or mfa itself
+STATUS_QUERY = f"""
+    SELECT id, version, mfa IS NOT NULL, expired IS TRUE, {_EXPIRED_BY_TIME}
+    FROM users WHERE username = %s
+"""
+
+# `stale`: expired by time but not flagged yet, the version is about to change
+VERSION_QUERY = f"""
+    SELECT id, version, expired IS NOT TRUE AND {_EXPIRED_BY_TIME}
+    FROM users WHERE username = %s
+"""
+
+EXPORT_QUERY = f"""
+    SELECT username, id, version, mfa IS NOT NULL, expired IS TRUE, {_EXPIRED_BY_TIME}
+    FROM users ORDER BY username
+"""
+
+
+class PostgresRepository:
+    """Comptes stockés dans PostgreSQL (table `users`)."""
+
+    @contextmanager
+    def _transaction(self, username, query):
+        """Curseur sur le shard de `username` ; valide à la sortie, annule sur erreur.
+
+        Les instructions sont chronométrées sous le nom `query` (`common.slowlog`) ;
+        la durée de la transaction, attente du pool comprise, est transmise à `common.limiter`.
+        """
+        start = time.perf_counter()
+        deadline.check('database')
+        conn = db.get_user_connection(username)
+        cursor = None
+        timeouts = None
+        try:
+            cursor = conn.cursor()
+            timeouts = deadline.db_timeouts(db.DB_STATEMENT_TIMEOUT_MS)
+            if timeouts:
+                cursor.execute(
+                    "SELECT set_config('statement_timeout', %s, true), set_config('lock_timeout', %s, true)",
+                    (f"{timeouts[0]}ms", f"{timeouts[1]}ms")
+                )
+            yield slowlog.Cursor(cursor, query)
+            conn.commit()
+        except (psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable):
+            if not conn.closed:
+                conn.rollback()
+            if timeouts:
+                raise deadline.expired('database')
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            db.release_db_connection(conn)
+            limiter.observe_db(time.perf_counter() - start)
+
+    def get_user_auth(self, username):
+        """Informations d'authentification d'un compte, ou None s'il n'existe pas."""
+        with self._transaction(username, 'get_user_auth') as cursor:
+            cursor.execute(
+                "SELECT id, password, mfa, gendate, expired FROM users WHERE username = %s",
+                (username,)
+            )
+            row = cursor.fetchone()
+        return UserAuth(*row) if row else None
+
+    def exists(self, username):
+        """Le compte existe (lecture de l'index seul, avant tout calcul coûteux)."""
+        with self._transaction(username, 'exists') as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+            return cursor.fetchone() is not None
+
+    def get_status(self, username, expiry_days):
+        """Statut d'un compte (`UserStatus`), ou None s'il n'existe pas."""
+        with self._transaction(username, 'get_status') as cursor:
+            cursor.execute(STATUS_QUERY, (expiry_days, username))
+            row = cursor.fetchone()
+        return UserStatus(*row) if row else None
+
+    def get_version(self, username, expiry_days):
+        """Identifiant et version d'un compte (`UserVersion`), ou None s'il n'existe pas."""
+        with self._transaction(username, 'get_version') as cursor:
+            cursor.execute(VERSION_QUERY, (expiry_days, username))
+            row = cursor.fetchone()
+        return UserVersion(*row) if row else None
+
+    def create_user(self, username, password_hash, gendate):
+        """Crée un compte et retourne son identifiant, ou None si le nom est déjà pris."""
+        with self._transaction(username, 'create_user') as cursor:
+            cursor.execute(
+                """
+                INSERT INTO users (username, password, gendate, expired)
+                VALUES (%s, %s, %s, FALSE)
+                ON CONFLICT (username) DO NOTHING
+                RETURNING id
+                """,
+                (username, password_hash, gendate)
+            )
+            row = cursor.fetchone()
+            if row:
+                stats.account_created(cursor, gendate)
+        return row[0] if row else None
+
+    def set_mfa(self, username, encrypted_secret):
+        """Enregistre le secret TOTP chiffré d'un compte ; False s'il n'existe pas."""
+        with self._transaction(username, 'set_mfa') as cursor:
+            cursor.execute(
+                "SELECT mfa IS NOT NULL, gendate FROM users WHERE username = %s FOR UPDATE",
+                (username,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return False
+            had_2fa, gendate = row
+            cursor.execute("UPDATE users SET mfa = %s WHERE username = %s", (encrypted_secret, username))
+            if not had_2fa:
+                stats.mfa_enabled(cursor, gendate)
+        return True
+
+    def mark_expired(self, username):
+        """Marque un compte comme expiré et retourne sa nouvelle version.
+
+        Retourne None si le compte n'existe pas ou était déjà marqué.
+        """
+        with self._transaction(username, 'mark_expired') as cursor:
+            cursor.execute(
+                "UPDATE users SET expired = TRUE WHERE username = %s AND expired IS NOT TRUE "
+                "RETURNING gendate, version",
+                (username,)
+            )
+            row = cursor.fetchone()
+            if row:
+                stats.account_expired(cursor, row[0])
+        return row[1] if row else None
+
+    def iter_status(self, chunk_size, expiry_days):
+        """Parcourt le statut de tous les comptes par paquets de `(username, UserStatus)`.
+
+        Chaque base est lue par un curseur nommé (côté serveur) dans une
+        transaction en lecture seule : seul un paquet est en mémoire à la fois.
+        """
+        for target in db.database_targets():
+            conn = db.get_target_connection(target)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                with conn.cursor(name="user_status_export") as cursor:
+                    cursor.execute(EXPORT_QUERY, (expiry_days,))
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield [(row[0], UserStatus(*row[1:])) for row in rows]
+                conn.rollback()
+            finally:
+                db.release_db_connection(conn)
+
+
+class _Account:
+    __slots__ = ('id', 'password', 'mfa', 'gendate', 'expired', 'version')
+
+    def __init__(self, user_id, password, gendate):
+        self.id = user_id
+        self.password = password
+        self.mfa = None
+        self.gendate = gendate
+        self.expired = False
+        self.version = 1
+
+
+class MemoryRepository:
+    """Comptes conservés en mémoire, partagés par les threads du processus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._next_id = 1
+
+    @staticmethod
+    def _expired_by_time(account, expiry_days):
+        return account.gendate / 1000 + expiry_days * 86400 < time.time()
+
+    def _status(self, account, expiry_days):
+        return UserStatus(account.id, account.version, account.mfa is not None, account.expired,
+                          self._expired_by_time(account, expiry_days))
+
+    def get_user_auth(self, username):
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None:
+                return None
+            return UserAuth(account.id, account.password, account.mfa, account.gendate, account.expired)
+
+    def exists(self, username):
+        with self._lock:
+            return username in self._accounts
+
+    def get_status(self, username, expiry_days):
+        with self._lock:
+            account = self._accounts.get(username)
+            return self._status(account, expiry_days) if account else None
+
+    def get_version(self, username, expiry_days):
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None:
+                return None
+            stale = not account.expired and self._expired_by_time(account, expiry_days)
+            return UserVersion(account.id, account.version, stale)
+
+    def create_user(self, username, password_hash, gendate):
+        with self._lock:
+            if username in self._accounts:
+                return None
+            account = _Account(self._next_id, password_hash, gendate)
+            self._next_id += 1
+            self._accounts[username] = account
+            return account.id
+
+    def set_mfa(self, username, encrypted_secret):
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None:
+                return False
+            account.mfa = encrypted_secret
+            account.version += 1
+            return True
+
+    def mark_expired(self, username):
+        with self._lock:
+            account = self._accounts.get(username)
+            if account is None or account.expired:
+                return None
+            account.expired = True
+            account.version += 1
+            return account.version
+
+    def iter_status(self, chunk_size, expiry_days):
+        with self._lock:
+            usernames = sorted(self._accounts)
+        for start in range(0, len(usernames), chunk_size):
+            batch = []
+            with self._lock:
+                for username in usernames[start:start + chunk_size]:
+                    account = self._accounts.get(username)
+                    if account is not None:
+                        batch.append((username, self._status(account, expiry_days)))
+            if batch:
+                yield batch
+
+
+class SnapshotRepository:
+    """Statut et version lus dans `common.snapshot` ; le reste, et les lectures
+    que l'instantané ne peut pas servir, délégués au dépôt `backing`."""
+
+    def __init__(self, backing):
+        self.backing = backing
+
+    def __getattr__(self, name):
+        return getattr(self.backing, name)
+
+    def get_status(self, username, expiry_days):
+        entry = snapshot.lookup(username)
+        if entry is snapshot.MISS:
+            return self.backing.get_status(username, expiry_days)
+        if entry is None:
+            return None
+        return UserStatus(entry.id, entry.version, entry.has_2fa, entry.expired,
+                          snapshot.expired_by_time(entry.gendate, expiry_days))
+
+    def get_version(self, username, expiry_days):
+        entry = snapshot.lookup(username)
+        if entry is snapshot.MISS:
+            return self.backing.get_version(username, expiry_days)
+        if entry is None:
+            return None
+        stale = not entry.expired and snapshot.expired_by_time(entry.gendate, expiry_days)
+        return UserVersion(entry.id, entry.version, stale)
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository():
+    """Dépôt du backend configuré (`STORAGE_BACKEND`), unique par processus."""
+    backend = config.get().storage_backend
+    repository = _repositories.get(backend)
+    if repository is None:
+        with _repositories_lock:
+            repository = _repositories.get(backend)
+            if repository is None:
+                if backend == 'memory':
+                    repository = MemoryRepository()
+                elif snapshot.STATUS_SNAPSHOT:
+                    repository = SnapshotRepository(PostgresRepository())
+                else:
+                    repository = PostgresRepository()
+                _repositories[backend] = repository
+    return repository
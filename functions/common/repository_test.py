@@ -0,0 +1,44 @@
+import threading
+import time
+
+from . import repository
+
+
+def test_memory_repository_bumps_version_on_every_write():
+    users = repository.MemoryRepository()
+    now = int(time.time() * 1000)
+
+    user_id = users.create_user("alice", "hash", now)
+    assert users.create_user("alice", "other", now) is None
+    assert users.get_version("alice", 180) == (user_id, 1, False)
+
+    assert users.set_mfa("alice", "secret") is True
+    assert users.set_mfa("bob", "secret") is False
+    assert users.mark_expired("alice") == 3
+    assert users.mark_expired("alice") is None
+
+    assert users.get_user_auth("alice") == (user_id, "hash", "secret", now, True)
+    assert users.get_status("alice", 180) == (user_id, 3, True, True, False)
+    assert users.get_status("bob", 180) is None
+
+
+def test_memory_repository_is_thread_safe():
+    users = repository.MemoryRepository()
+    created = []
+
+    def create(start):
+        for i in range(200):
+            # Every name is attempted by two threads: exactly one wins
+            created.append(users.create_user(f"user{(start + i) % 400}", "hash", 0))
+
+    threads = [threading.Thread(target=create, args=(n * 200,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [user_id for user_id in created if user_id is not None]
+    assert sorted(ids) == list(range(1, 401))
+    batches = list(users.iter_status(150, 180))
+    assert [len(batch) for batch in batches] == [150, 150, 100]
+    assert all(status.expired_by_time for batch in batches for _, status in batch)
@@ -0,0 +1,66 @@
+"""
+Réponses HTTP communes aux handlers.
+
+Les handlers construisent leurs réponses au format du template `python3-http` :
+un dictionnaire avec `statusCode`, `body` (chaîne JSON) et éventuellement `headers`.
+"""
+import json
+
+
+def invalid_request(error):
+    """Réponse renvoyée pour une requête refusée par `common.validation`.
+
+    Args:
+        error (ValidationError): L'exception levée par la validation.
+
+    Returns:
+        dict: Réponse HTTP 400, ou 413 pour un corps trop gros.
+    """
+    return {
+        "statusCode": error.status_code,
+        "body": json.dumps({"error": str(error)})
+    }
+
+
+def service_unavailable(error):
+    """Réponse 503 renvoyée lorsque la base de données est indisponible.
+
+    Args:
+        error (DatabaseUnavailable): L'exception levée par `common.db`.
+
+    Returns:
+        dict: Réponse HTTP avec un en-tête `Retry-After`.
+    """
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": str(error.retry_after)},
+        "body": json.dumps({"error": "Service temporarily unavailable, please retry later"})
+    }
+
+
+def overloaded(retry_after):
+    """Réponse 503 renvoyée lorsque la réplique refuse une requête (voir `common.limiter`).
+
+    Args:
+        retry_after (int): Délai conseillé, en secondes, avant de réessayer.
+
+    Returns:
+        dict: Réponse HTTP avec un en-tête `Retry-After`.
+    """
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": str(retry_after)},
+        "body": json.dumps({"error": "Server overloaded, please retry later"})
+    }
+
+
+def deadline_exceeded():
+    """Réponse 504 renvoyée lorsque l'échéance de la requête est dépassée (voir `common.deadline`).
+
+    Returns:
+        dict: Réponse HTTP.
+    """
+    return {
+        "statusCode": 504,
+        "body": json.dumps({"error": "Request deadline exceeded"})
+    }
@@ -0,0 +1,60 @@
+"""
+Répartition des utilisateurs sur plusieurs instances PostgreSQL.
+
+Un nom d'utilisateur est associé à l'une des N bases d'une carte de shards
+(`ShardMap`) par un hachage stable : SHA-256 du nom, puis « jump consistent
+hash » (Lamping et Veach). Passer de N à N+1 shards ne déplace ainsi qu'environ
+1/(N+1) des utilisateurs, tous vers le nouveau shard.
+
+Les cartes sont lues par `common.config` :
+    DB_SHARDS: DSN des shards, séparés par des virgules, dans un ordre fixe.
+    DB_SHARDS_PREVIOUS: ancienne carte, définie uniquement pendant un
+        re-sharding (voir `scripts/reshard.py`) ; les lectures cherchent alors
+        l'utilisateur dans la nouvelle carte puis dans l'ancienne.
+
+Sans `DB_SHARDS`, une seule base est utilisée, configurée par les variables DB_*.
+"""
+import hashlib
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash : associe une clé 64 bits à un bucket dans [0, buckets)."""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_key(value):
+    """Clé 64 bits stable (indépendante de PYTHONHASHSEED) pour une chaîne."""
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardMap:
+    """Carte ordonnée de DSN PostgreSQL."""
+
+    def __init__(self, dsns):
+        self.dsns = [dsn.strip() for dsn in dsns if dsn.strip()]
+        if not self.dsns:
+            raise ValueError("A shard map needs at least one DSN")
+
+    def __len__(self):
+        return len(self.dsns)
+
+    def __eq__(self, other):
+        return isinstance(other, ShardMap) and self.dsns == other.dsns
+
+    def index_for(self, value):
+        """Index du shard qui détient `value` (par exemple un nom d'utilisateur)."""
+        return jump_hash(shard_key(value), len(self.dsns))
+
+    def dsn_for(self, value):
+        """DSN du shard qui détient `value`."""
+        return self.dsns[self.index_for(value)]
+
+    @classmethod
+    def parse(cls, text):
+        """Construit une carte à partir d'une liste de DSN séparés par des virgules."""
+        return cls(text.split(','))
@@ -0,0 +1,26 @@
+from collections import Counter
+
+from .sharding import ShardMap, jump_hash, shard_key
+
+USERNAMES = [f"user_{i}" for i in range(20000)]
+
+
+def test_routing_is_stable():
+    shards = ShardMap.parse("postgresql://pg0/cofrap, postgresql://pg1/cofrap,postgresql://pg2/cofrap")
+    assert shards.dsns[1] == "postgresql://pg1/cofrap"
+    assert shard_key("alice") == shard_key("alice")
+    assert shards.dsn_for("alice") == shards.dsn_for("alice")
+    assert jump_hash(shard_key("alice"), 1) == 0
+
+
+def test_users_are_spread_evenly():
+    counts = Counter(jump_hash(shard_key(name), 4) for name in USERNAMES)
+    assert set(counts) == {0, 1, 2, 3}
+    assert all(abs(count - 5000) < 400 for count in counts.values())
+
+
+def test_adding_a_shard_only_moves_users_to_it():
+    moved = [name for name in USERNAMES
+             if jump_hash(shard_key(name), 3) != jump_hash(shard_key(name), 4)]
+    assert all(jump_hash(shard_key(name), 4) == 3 for name in moved)
+    assert abs(len(moved) / len(USERNAMES) - 0.25) < 0.02
@@ -0,0 +1,184 @@
+"""
+Chronométrage des requêtes SQL et capture des requêtes lentes.
+
+Chaque instruction exécutée par `common.repository` et `common.idempotency`
+passe par un `Cursor` qui la chronomètre et l'étiquette avec la fonction en
+cours (voir `common.deadline`) et le nom de la requête (l'opération du dépôt,
+par exemple `get_status`). Les durées sont publiées par `common.limiter`
+(`db_query_duration_seconds`, `db_slow_queries_total`).
+
+Lorsque `SLOW_QUERY_FILE` est défini, une instruction plus lente que
+`SLOW_QUERY_MS` y ajoute une ligne JSON : instant, fonction, requête, durée,
+nombre de lignes et texte normalisé (espaces réduits ; les paramètres ne sont
+jamais écrits, le texte n'a que des `%s`). Une fraction
+`SLOW_QUERY_EXPLAIN_SAMPLE` de ces lignes reçoit en plus le plan
+d'`EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`, obtenu en rejouant l'instruction
+sur la même connexion, dans un point de sauvegarde aussitôt annulé : une
+écriture rejouée ne laisse aucune trace, hormis les valeurs de séquence
+consommées. Les littéraux du plan (le nom d'utilisateur d'une condition
+d'index, par exemple) sont remplacés par `'?'`.
+
+Pour rester sûre en production, la capture est limitée par processus :
+`SLOW_QUERY_PER_MINUTE` lignes et `SLOW_QUERY_EXPLAIN_PER_MINUTE` plans par
+minute au plus, aucun plan lorsque le temps restant de la requête (voir
+`common.deadline`) ne couvre pas deux fois la durée de l'instruction, et un
+fichier plafonné à `SLOW_QUERY_MAX_MB`. Une erreur de capture n'échoue jamais
+la requête.
+
+Variables d'environnement :
+    SLOW_QUERY_MS: seuil d'une instruction lente, en millisecondes (par défaut 100).
+    SLOW_QUERY_FILE: fichier NDJSON des instructions lentes ; la capture est désactivée sans lui.
+    SLOW_QUERY_EXPLAIN_SAMPLE: fraction des instructions lentes expliquées (par défaut 0.1).
+    SLOW_QUERY_PER_MINUTE: lignes écrites par minute et par processus (par défaut 60).
+    SLOW_QUERY_EXPLAIN_PER_MINUTE: plans par minute et par processus (par défaut 6).
+    SLOW_QUERY_MAX_MB: taille au-delà de laquelle la capture s'arrête (par défaut 100).
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from . import deadline, limiter
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_FILE = os.getenv('SLOW_QUERY_FILE')
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', '0.1'))
+SLOW_QUERY_PER_MINUTE = float(os.getenv('SLOW_QUERY_PER_MINUTE', '60'))
+SLOW_QUERY_EXPLAIN_PER_MINUTE = float(os.getenv('SLOW_QUERY_EXPLAIN_PER_MINUTE', '6'))
+SLOW_QUERY_MAX_BYTES = int(float(os.getenv('SLOW_QUERY_MAX_MB', '100')) * 1024 * 1024)
+
+# SQL string literal, quotes doubled inside
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+_fd = None
+_fd_pid = None
+
+
+class Budget:
+    """Seau à jetons : au plus `per_minute` passages par minute, par processus."""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, per_minute)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Consomme un jeton ; False si le seau est vide."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_records = Budget(SLOW_QUERY_PER_MINUTE)
+_explains = Budget(SLOW_QUERY_EXPLAIN_PER_MINUTE)
+
+
+class Cursor:
+    """Curseur psycopg2 dont chaque `execute()` est chronométré et étiqueté.
+
+    Args:
+        cursor: Le curseur enveloppé ; les autres attributs lui sont délégués.
+        query (str): Nom de la requête (voir `limiter.QUERIES`).
+    """
+
+    __slots__ = ('_cursor', '_query')
+
+    def __init__(self, cursor, query):
+        self._cursor = cursor
+        self._query = query
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        self._cursor.execute(sql, params)
+        observe(self._cursor, self._query, sql, params, time.perf_counter() - start)
+
+
+def normalize(sql):
+    """Texte d'une instruction sur une ligne, espaces réduits."""
+    return " ".join(sql.split())
+
+
+def _scrub(node):
+    """Remplace les littéraux des chaînes d'un plan JSON par `'?'`."""
+    if isinstance(node, str):
+        return _LITERAL.sub("'?'", node)
+    if isinstance(node, list):
+        return [_scrub(item) for item in node]
+    if isinstance(node, dict):
+        return {key: _scrub(value) for key, value in node.items()}
+    return node
+
+
+def explain(conn, sql, params):
+    """Plan exécuté de l'instruction, rejouée dans un point de sauvegarde annulé."""
+    with conn.cursor() as cursor:
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _scrub(plan)
+
+
+def _write(record):
+    """Ajoute une ligne au fichier (une seule écriture `O_APPEND` par ligne)."""
+    global _fd, _fd_pid
+    pid = os.getpid()
+    if _fd_pid != pid:
+        # One descriptor per worker: lines from different workers never interleave
+        _fd = os.open(SLOW_QUERY_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        _fd_pid = pid
+    if os.fstat(_fd).st_size >= SLOW_QUERY_MAX_BYTES:
+        return
+    os.write(_fd, (json.dumps(record, separators=(',', ':')) + "\n").encode('utf-8'))
+
+
+def _capture(cursor, function, query, sql, params, seconds):
+    if not _records.take():
+        return
+    record = {
+        "ts": round(time.time(), 6),
+        "function": function,
+        "query": query,
+        "duration_ms": round(seconds * 1000, 3),
+        "rows": cursor.rowcount,
+        "statement": normalize(sql),
+    }
+    left = deadline.remaining()
+    if ((left is None or left > 2 * seconds)
+            and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE and _explains.take()):
+        try:
+            record["plan"] = explain(cursor.connection, sql, params)
+        except Exception as e:
+            record["explain_error"] = type(e).__name__
+    _write(record)
+
+
+def observe(cursor, query, sql, params, seconds):
+    """Enregistre la durée d'une instruction exécutée par `cursor` et capture les lentes."""
+    function = deadline.current_function()
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    limiter.observe_query(function, query, seconds, slow)
+    if slow and SLOW_QUERY_FILE:
+        try:
+            _capture(cursor, function, query, sql, params, seconds)
+        except Exception as e:
+            # Capture must never fail a request
+            print(f"Failed to capture slow query: {e}")
@@ -0,0 +1,61 @@
+import json
+
+from . import deadline, limiter, slowlog
+
+
+class FakeCursor:
+    rowcount = 1
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.connection = self
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        slowlog.time.sleep(self.delay)
+
+    def cursor(self):
+        raise RuntimeError("explain unavailable")
+
+
+def test_slow_statements_are_tagged_and_rate_limited(monkeypatch, tmp_path):
+    path = tmp_path / "slow.ndjson"
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_FILE", str(path))
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_MS", 5)
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_EXPLAIN_SAMPLE", 1.0)
+    monkeypatch.setattr(slowlog, "_records", slowlog.Budget(2))
+    limiter.reset()
+    deadline._local.function = "check-user-status"
+    try:
+        slowlog.Cursor(FakeCursor(), "get_status").execute("SELECT 1 FROM users WHERE username = %s", ("alice",))
+        cursor = slowlog.Cursor(FakeCursor(0.01), "get_status")
+        for _ in range(3):
+            cursor.execute("SELECT id\n    FROM users WHERE username = %s", ("alice",))
+    finally:
+        deadline.clear()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 2
+    assert "alice" not in path.read_text()
+    assert records[0]["function"] == "check-user-status" and records[0]["query"] == "get_status"
+    assert records[0]["statement"] == "SELECT id FROM users WHERE username = %s"
+    assert records[0]["explain_error"] == "RuntimeError"
+
+    metrics = limiter.metrics()
+    assert 'db_query_duration_seconds_count{function="check-user-status",query="get_status"} 4' in metrics
+    assert 'db_slow_queries_total{function="check-user-status",query="get_status"} 3' in metrics
+    limiter.reset()
+
+
+def test_budget_refills_over_time():
+    now = [0.0]
+    budget = slowlog.Budget(6, clock=lambda: now[0])
+    assert sum(budget.take() for _ in range(10)) == 6
+    now[0] = 10.0
+    assert budget.take() and not budget.take()
+
+
+def test_plan_literals_are_scrubbed():
+    plan = [{"Plan": {"Index Cond": "(username = 'o''brien'::text)", "Actual Rows": 1}}]
+    assert slowlog._scrub(plan) == [{"Plan": {"Index Cond": "(username = '?'::text)", "Actual Rows": 1}}]
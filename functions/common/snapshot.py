@@ -0,0 +1,319 @@
+"""
+Instantané en mémoire partagée du statut des comptes, pour `check-user-status`.
+
+Un job en arrière-plan (`scripts/status-snapshot.py build`) écrit le statut
+de tous les comptes dans un fichier ; chaque processus de fonction le
+projette en mémoire (`mmap`) et y répond aux lectures de statut sans base de
+données. Les pages du fichier sont partagées par tous les workers d'un
+réplica (cache de pages du noyau) : aucune copie par processus.
+
+Format du fichier (ordre des octets natif, vérifié à l'ouverture) :
+- `MAGIC`, longueur (u32) et métadonnées JSON : date de construction, nombre
+  de comptes, position des sections et, par base (`database_targets()`), le
+  tampon du flux de changements (`xmin` de l'instantané MVCC de lecture) ;
+- des tableaux parallèles triés par hachage du nom (64 bits) : hachages,
+  identifiants, versions, dates de génération, bits de statut (2FA, expiré) ;
+- les noms eux-mêmes, concaténés, avec leurs positions : une recherche
+  dichotomique sur les hachages est confirmée par le nom complet, une
+  collision de hachage ne peut donc pas renvoyer le mauvais compte.
+
+Les écritures postérieures à l'instantané sont lues par un thread du
+processus dans le flux de changements : la colonne `users.changed_xid`
+(migration 005) reçoit la transaction de chaque écriture ; toutes les
+`STATUS_SNAPSHOT_POLL` secondes, les lignes dont `changed_xid` est au moins
+le `xmin` du relevé précédent sont appliquées à une table de surcharge.
+Une transaction encore en cours au relevé précédent a un identifiant au moins
+égal à ce `xmin` : elle est relue après sa validation, rien n'est manqué.
+
+Le statut n'est servi depuis l'instantané que si toutes les bases ont été
+relevées depuis moins de `STATUS_SNAPSHOT_MAX_LAG` secondes ; sinon (fichier
+absent ou illisible, base injoignable, carte des shards modifiée depuis la
+construction), la lecture est faite en base comme sans instantané. Un
+nouveau fichier, remplacé atomiquement par le job, est pris en compte au
+relevé suivant. Le flux ne voit pas les suppressions de lignes (nettoyage,
+re-sharding) : elles ne sont prises en compte qu'à la reconstruction suivante.
+
+Variables d'environnement :
+    STATUS_SNAPSHOT: chemin du fichier ; sans lui, toutes les lectures vont en base.
+    STATUS_SNAPSHOT_POLL: intervalle des relevés du flux, en secondes (par défaut 1).
+    STATUS_SNAPSHOT_MAX_LAG: âge maximal du dernier relevé complet, en secondes (par défaut 5).
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from . import db
+
+STATUS_SNAPSHOT = os.getenv('STATUS_SNAPSHOT')
+STATUS_SNAPSHOT_POLL = float(os.getenv('STATUS_SNAPSHOT_POLL', '1'))
+STATUS_SNAPSHOT_MAX_LAG = float(os.getenv('STATUS_SNAPSHOT_MAX_LAG', '5'))
+
+MAGIC = b'CFSNAP01'
+FORMAT = 1
+
+HAS_2FA = 1
+EXPIRED = 2
+
+# (name, array typecode): the parallel sections, in file order
+SECTIONS = (('hashes', 'Q'), ('ids', 'q'), ('versions', 'q'), ('gendates', 'q'),
+            ('bits', 'B'), ('offsets', 'Q'), ('names', 'B'))
+
+Entry = namedtuple('Entry', 'id version has_2fa expired gendate')
+
+# Answer of lookup() when the snapshot cannot be trusted: read from the database
+MISS = object()
+
+# Columns read by the builder and the feed, in the order of write() rows
+ROW_COLUMNS = "username, id, version, mfa IS NOT NULL, expired IS TRUE, gendate"
+
+FEED_QUERY = f"""
+    WITH s AS (SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin)
+    SELECT s.xmin, {', '.join('u.' + column for column in ROW_COLUMNS.split(', '))}
+    FROM s LEFT JOIN users u ON u.changed_xid >= %s::xid8
+"""
+
+
+def name_hash(name):
+    """Hachage 64 bits stable d'un nom (octets UTF-8)."""
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little')
+
+
+def target_key(target):
+    """Clé d'une base dans les métadonnées : un DSN contient un mot de passe."""
+    return hashlib.sha256(target.encode('utf-8')).hexdigest()[:16]
+
+
+def expired_by_time(gendate, expiry_days):
+    """Le compte a été créé il y a plus de `expiry_days` jours."""
+    return gendate / 1000 + expiry_days * 86400 < time.time()
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write(path, rows, stamps, built_at=None):
+    """Écrit un instantané et remplace atomiquement `path`.
+
+    Args:
+        path (str): Fichier de destination.
+        rows: Itérable de `(username, id, version, has_2fa, expired, gendate)` ;
+            pour un nom présent plusieurs fois (re-sharding), la plus grande
+            version est conservée.
+        stamps (dict): `xmin` de lecture par clé de base (`target_key`).
+        built_at (float, optional): Date de construction, par défaut maintenant.
+
+    Returns:
+        int: Le nombre de comptes écrits.
+    """
+    keys, records = [], []
+    for username, user_id, version, has_2fa, expired, gendate in rows:
+        name = username.encode('utf-8')
+        keys.append((name_hash(name), name, -version, len(records)))
+        records.append((user_id, version, gendate, (HAS_2FA if has_2fa else 0) | (EXPIRED if expired else 0)))
+    keys.sort()
+
+    columns = {name: array(typecode) for name, typecode in SECTIONS}
+    heap = bytearray()
+    previous = None
+    for hashed, name, _, index in keys:
+        if (hashed, name) == previous:
+            continue
+        previous = (hashed, name)
+        user_id, version, gendate, bits = records[index]
+        columns['hashes'].append(hashed)
+        columns['ids'].append(user_id)
+        columns['versions'].append(version)
+        columns['gendates'].append(gendate)
+        columns['bits'].append(bits)
+        columns['offsets'].append(len(heap))
+        heap += name
+    columns['offsets'].append(len(heap))
+    columns['names'] = array('B', heap)
+    del keys, records, heap
+
+    sections, position = {}, 0
+    for name, _ in SECTIONS:
+        size = len(columns[name]) * columns[name].itemsize
+        sections[name] = [position, size]
+        position = _align(position + size)
+    meta = json.dumps({
+        "format": FORMAT,
+        "byteorder": sys.byteorder,
+        "built_at": built_at if built_at is not None else time.time(),
+        "count": len(columns['hashes']),
+        "stamps": stamps,
+        "sections": sections,
+    }).encode('utf-8')
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(meta)) + meta)
+            start = _align(f.tell())
+            for name, _ in SECTIONS:
+                f.write(b'\0' * (start + sections[name][0] - f.tell()))
+                columns[name].tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return len(columns['hashes'])
+
+
+class Snapshot:
+    """Instantané projeté en mémoire, en lecture seule ; les vues ne copient rien."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a status snapshot")
+        (length,) = struct.unpack_from('<I', self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.meta = json.loads(self._map[start:start + length])
+        if self.meta.get('format') != FORMAT or self.meta.get('byteorder') != sys.byteorder:
+            raise ValueError(f"{path}: unsupported snapshot format")
+        data = _align(start + length)
+        view = memoryview(self._map)
+        for name, typecode in SECTIONS:
+            offset, size = self.meta['sections'][name]
+            setattr(self, name, view[data + offset:data + offset + size].cast(typecode))
+        self.count = self.meta['count']
+        self.stamps = self.meta['stamps']
+
+    def __len__(self):
+        return self.count
+
+    def get(self, username):
+        """Statut d'un compte (`Entry`), ou None s'il n'est pas dans l'instantané."""
+        name = username.encode('utf-8')
+        hashed = name_hash(name)
+        i = bisect.bisect_left(self.hashes, hashed)
+        while i < self.count and self.hashes[i] == hashed:
+            if self.names[self.offsets[i]:self.offsets[i + 1]] == name:
+                bits = self.bits[i]
+                return Entry(self.ids[i], self.versions[i], bool(bits & HAS_2FA), bool(bits & EXPIRED),
+                             self.gendates[i])
+            i += 1
+        return None
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class _Feed:
+    """Instantané et surcharge du processus, tenus à jour par un thread de relevé."""
+
+    def __init__(self, path):
+        self.pid = os.getpid()
+        self.path = path
+        self.snapshot = None
+        self.overlay = {}
+        self.stamps = {}
+        self.fresh_until = 0.0
+        self.error = None
+        threading.Thread(target=self._run, name='status-snapshot', daemon=True).start()
+
+    def lookup(self, username):
+        if time.monotonic() > self.fresh_until:
+            return MISS
+        snapshot, overlay = self.snapshot, self.overlay
+        entry = overlay.get(username, MISS)
+        return snapshot.get(username) if entry is MISS else entry
+
+    def _open(self):
+        """(Re)projette le fichier s'il a été remplacé depuis le dernier relevé."""
+        identity = _file_identity(self.path)
+        if identity is None:
+            raise OSError(f"{self.path}: snapshot file missing")
+        if self.snapshot is not None and self.snapshot.identity == identity:
+            return
+        snapshot = Snapshot(self.path)
+        # Readers switch to the new file and an empty overlay at once
+        self.fresh_until = 0.0
+        self.snapshot, self.overlay = snapshot, {}
+        self.stamps = dict(snapshot.stamps)
+        print(f"Status snapshot loaded: {snapshot.count} accounts, built at "
+              f"{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(snapshot.meta['built_at']))}")
+
+    def poll(self):
+        """Relève le flux de changements de toutes les bases."""
+        started = time.monotonic()
+        self._open()
+        for target in db.database_targets():
+            key = target_key(target)
+            if key not in self.stamps:
+                raise ValueError("shard map changed since the snapshot was built")
+            conn = db.get_target_connection(target)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(FEED_QUERY, (str(self.stamps[key]),))
+                    rows = cursor.fetchall()
+                conn.rollback()
+            finally:
+                db.release_db_connection(conn)
+            for xmin, username, user_id, version, has_2fa, expired, gendate in rows:
+                if username is None:
+                    continue
+                current = self.overlay.get(username)
+                if current is None or current.version <= version:
+                    self.overlay[username] = Entry(user_id, version, has_2fa, expired, gendate)
+            self.stamps[key] = int(rows[0][0])
+        self.fresh_until = started + STATUS_SNAPSHOT_MAX_LAG
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+                if self.error is not None:
+                    print("Status snapshot feed recovered")
+                    self.error = None
+            except Exception as e:
+                # Logged once per distinct failure: reads fall back to the database meanwhile
+                message = f"{type(e).__name__}: {e}"
+                if message != self.error:
+                    print(f"Status snapshot unavailable, reading from the database: {message}")
+                    self.error = message
+            time.sleep(STATUS_SNAPSHOT_POLL)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def lookup(username):
+    """Statut d'un compte selon l'instantané et le flux de changements.
+
+    Returns:
+        `Entry` si le compte existe, None s'il n'existe pas, ou `MISS` si
+        l'instantané n'est pas utilisable (à lire en base).
+    """
+    global _feed
+    if not STATUS_SNAPSHOT:
+        return MISS
+    feed = _feed
+    if feed is None or feed.pid != os.getpid():
+        with _feed_lock:
+            if _feed is None or _feed.pid != os.getpid():
+                _feed = _Feed(STATUS_SNAPSHOT)
+            feed = _feed
+    return feed.lookup(username)
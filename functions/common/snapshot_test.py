@@ -0,0 +1,52 @@
+import os
+import time
+
+from . import repository, snapshot
+
+NOW_MS = int(time.time() * 1000)
+OLD_MS = NOW_MS - 200 * 86400 * 1000
+
+
+def test_lookup_by_hash_is_confirmed_by_name(tmp_path, monkeypatch):
+    path = str(tmp_path / "status.snap")
+    rows = [(f"user{i}", i, 1, i % 2 == 0, False, NOW_MS) for i in range(1000)]
+    rows += [("élodie", 1000, 3, True, True, OLD_MS), ("élodie", 2000, 1, False, False, NOW_MS)]
+    assert snapshot.write(path, rows, {"abc": 42}) == 1001
+
+    snap = snapshot.Snapshot(path)
+    assert snap.stamps == {"abc": 42}
+    assert snap.get("user7") == snapshot.Entry(7, 1, False, False, NOW_MS)
+    # Duplicates (resharding): the highest version wins
+    assert snap.get("élodie") == snapshot.Entry(1000, 3, True, True, OLD_MS)
+    assert snap.get("nobody") is None
+
+    # A hash collision must not return another account
+    monkeypatch.setattr(snapshot, "name_hash", lambda name: 7)
+    snapshot.write(path, [("a", 1, 1, False, False, NOW_MS), ("b", 2, 1, True, False, NOW_MS)], {})
+    snap = snapshot.Snapshot(path)
+    assert snap.get("b").id == 2 and snap.get("a").id == 1 and snap.get("c") is None
+
+
+class FakeFeed:
+    def __init__(self, entries):
+        self.pid = os.getpid()
+        self.entries = entries
+
+    def lookup(self, username):
+        return self.entries.get(username)
+
+
+def test_repository_reads_snapshot_and_falls_back(monkeypatch):
+    backing = repository.MemoryRepository()
+    backing.create_user("stale", "hash", OLD_MS)
+    monkeypatch.setattr(snapshot, "STATUS_SNAPSHOT", "/unused")
+    monkeypatch.setattr(snapshot, "_feed", FakeFeed({"old": snapshot.Entry(5, 2, True, False, OLD_MS),
+                                                     "stale": snapshot.MISS}))
+    repo = repository.SnapshotRepository(backing)
+
+    assert repo.get_status("old", 180) == repository.UserStatus(5, 2, True, False, True)
+    assert repo.get_version("old", 180) == repository.UserVersion(5, 2, True)
+    assert repo.get_status("missing", 180) is None
+    # MISS: read from the backing repository
+    assert repo.get_status("stale", 180) == backing.get_status("stale", 180)
+    assert repo.mark_expired("stale") == 2
@@ -0,0 +1,78 @@
+"""
+Statistiques agrégées des comptes, tenues à jour par les chemins d'écriture.
+
+La table `account_stats` compte les comptes par jour d'expiration (date de
+création + `account_expiry_days` de `common.config`, en UTC) : nombre de comptes, comptes
+marqués expirés et comptes avec 2FA. Les handlers la mettent à jour dans la
+même transaction que leur écriture dans `users` :
+
+- création d'un compte (`generate-password`) : `account_created()` ;
+- activation de la 2FA (`generate-2fa`) : `mfa_enabled()` ;
+- marquage d'un compte expiré : `account_expired()`.
+
+Les totaux, le nombre de comptes expirés (marqués, ou dont le jour
+d'expiration est passé) et le nombre de comptes qui expirent dans les N
+prochains jours se calculent donc sur quelques centaines de lignes, sans
+parcourir `users` ; l'exporteur PostgreSQL les publie comme jauges
+Prometheus (voir `chart/values.yaml`).
+
+Chaque jour est réparti sur `STATS_SLOTS` lignes choisies au hasard pour que
+les créations concurrentes ne se sérialisent pas sur un même verrou de ligne.
+"""
+import random
+
+from . import config
+
+STATS_SLOTS = 8
+
+# Same day bucket in every query: UTC date at which the account expires by time
+EXPIRY_DAY = "((to_timestamp({gendate} / 1000.0) AT TIME ZONE 'UTC') + make_interval(days => %s))::date"
+
+_UPSERT = f"""
+    INSERT INTO account_stats (expiry_day, slot, {{column}})
+    VALUES ({EXPIRY_DAY.format(gendate='%s')}, %s, 1)
+    ON CONFLICT (expiry_day, slot) DO UPDATE
+        SET {{column}} = account_stats.{{column}} + 1
+"""
+
+REBUILD_QUERY = f"""
+    INSERT INTO account_stats (expiry_day, slot, accounts, flagged_expired, with_2fa)
+    SELECT {EXPIRY_DAY.format(gendate='gendate')}, 0,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE expired),
+           COUNT(*) FILTER (WHERE mfa IS NOT NULL)
+    FROM users
+    GROUP BY 1
+"""
+
+
+def _increment(cursor, column, gendate):
+    cursor.execute(_UPSERT.format(column=column),
+                   (gendate, config.get().account_expiry_days, random.randrange(STATS_SLOTS)))
+
+
+def account_created(cursor, gendate):
+    """Compte un nouvel utilisateur créé à `gendate` (millisecondes)."""
+    _increment(cursor, 'accounts', gendate)
+
+
+def mfa_enabled(cursor, gendate):
+    """Compte un utilisateur qui n'avait pas de 2FA et vient de l'activer."""
+    _increment(cursor, 'with_2fa', gendate)
+
+
+def account_expired(cursor, gendate):
+    """Compte un utilisateur qui vient d'être marqué expiré."""
+    _increment(cursor, 'flagged_expired', gendate)
+
+
+def rebuild(cursor):
+    """Recalcule `account_stats` à partir de `users`.
+
+    Les écritures dans `users` sont bloquées le temps du recalcul ; la
+    transaction est à valider par l'appelant. À utiliser après des écritures
+    qui ne passent pas par les handlers (re-sharding, import, suppression).
+    """
+    cursor.execute("LOCK TABLE users IN SHARE MODE")
+    cursor.execute("DELETE FROM account_stats")
+    cursor.execute(REBUILD_QUERY, (config.get().account_expiry_days,))
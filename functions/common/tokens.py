@@ -0,0 +1,262 @@
+"""
+Jetons de session signés, vérifiables sans accès à la base de données.
+
+`authenticate-user` délivre un jeton à chaque connexion réussie ; une action
+protégée le vérifie avec `verify()` au lieu de refaire bcrypt, TOTP et la
+lecture du compte. Le jeton est un JWT compact signé en HMAC-SHA256 (`HS256`) :
+
+    en-tête {"alg": "HS256", "typ": "JWT", "kid": ...}
+    charge  {"sub": user_id, "name": username, "mfa": bool, "iat", "exp", "jti"}
+
+Les clés viennent de `SESSION_KEYS` (`kid:clé,kid:clé`, voir `common.config`) :
+la première signe les nouveaux jetons, toutes sont acceptées à la
+vérification, choisies par le `kid` de l'en-tête. Pour une rotation, la
+nouvelle clé est ajoutée en tête, puis l'ancienne est retirée après
+`SESSION_TOKEN_TTL` secondes, lorsque plus aucun jeton valide n'en dépend.
+
+Un jeton reste valide jusqu'à son expiration, sauf s'il figure dans la liste
+de révocation : le fichier `SESSION_REVOCATION_FILE` (une ligne
+`<jti> <exp>` par jeton, relu lorsqu'il change) et les jetons passés à
+`revoke()` dans le processus. La liste ne garde qu'une empreinte de 8 octets
+et l'expiration de chaque jeton, triées dans deux tableaux, et oublie les
+jetons expirés.
+"""
+import array
+import base64
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+
+from . import config
+from .events import get_header
+
+LEEWAY = 30  # secondes de décalage d'horloge tolérées
+REVOCATION_CHECK_INTERVAL = 5  # secondes
+# A token is three base64url segments: anything else is rejected before decoding or signing
+_SEGMENT = re.compile(r'[A-Za-z0-9_-]+')
+
+
+class TokenError(ValueError):
+    """Le jeton est mal formé, mal signé, expiré ou révoqué."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    try:
+        return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+    except (ValueError, TypeError):
+        raise TokenError("Malformed token")
+
+
+# Keys and encoded headers of the current configuration, rebuilt when it changes
+_keyrings = {}
+
+
+def _keyring():
+    keys = config.get().session_keys
+    if not keys:
+        raise TokenError("Session tokens are not configured")
+    ring = _keyrings.get(keys)
+    if ring is None:
+        headers = {
+            kid: _b64encode(json.dumps({"alg": "HS256", "typ": "JWT", "kid": kid},
+                                       separators=(',', ':')).encode('utf-8'))
+            for kid, _ in keys
+        }
+        _keyrings.clear()
+        ring = _keyrings[keys] = (keys[0][0], dict(keys), headers)
+    return ring
+
+
+def _sign(key, signing_input):
+    return hmac.new(key, signing_input.encode('ascii'), hashlib.sha256).digest()
+
+
+def enabled():
+    """Des clés de session sont configurées."""
+    return bool(config.get().session_keys)
+
+
+def issue(user_id, username, has_2fa, now=None):
+    """Signe un jeton de session pour un utilisateur authentifié.
+
+    Returns:
+        tuple: Le jeton et son expiration (secondes depuis l'epoch).
+
+    Raises:
+        TokenError: Si `SESSION_KEYS` n'est pas défini.
+    """
+    kid, keys, headers = _keyring()
+    now = int(time.time() if now is None else now)
+    claims = {
+        "sub": str(user_id),
+        "name": username,
+        "mfa": bool(has_2fa),
+        "iat": now,
+        "exp": now + config.get().session_token_ttl,
+        "jti": _b64encode(os.urandom(12)),
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    signing_input = f"{headers[kid]}.{payload}"
+    return f"{signing_input}.{_b64encode(_sign(keys[kid], signing_input))}", claims["exp"]
+
+
+def verify(token, now=None):
+    """Vérifie un jeton localement, sans accès à la base de données.
+
+    Returns:
+        dict: Les revendications du jeton.
+
+    Raises:
+        TokenError: Si le jeton est invalide, expiré ou révoqué.
+    """
+    _, keys, _ = _keyring()
+    parts = token.split('.') if isinstance(token, str) else []
+    if len(parts) != 3 or not all(_SEGMENT.fullmatch(part) for part in parts):
+        raise TokenError("Malformed token")
+    try:
+        header = json.loads(_b64decode(parts[0]))
+    except ValueError:
+        raise TokenError("Malformed token")
+    if not isinstance(header, dict) or not isinstance(header.get('kid'), str):
+        raise TokenError("Malformed token")
+    key = keys.get(header['kid'])
+    if key is None or header.get('alg') != 'HS256':
+        raise TokenError("Unknown signing key")
+    if not hmac.compare_digest(_b64decode(parts[2]), _sign(key, f"{parts[0]}.{parts[1]}")):
+        raise TokenError("Invalid signature")
+
+    try:
+        claims = json.loads(_b64decode(parts[1]))
+    except ValueError:
+        raise TokenError("Malformed token")
+    if not isinstance(claims, dict):
+        raise TokenError("Malformed token")
+    now = time.time() if now is None else now
+    if not isinstance(claims.get('exp'), int) or claims['exp'] + LEEWAY < now:
+        raise TokenError("Token expired")
+    if claims.get('iat', 0) - LEEWAY > now:
+        raise TokenError("Token issued in the future")
+    if _revocations.contains(claims.get('jti', ''), now):
+        raise TokenError("Token revoked")
+    return claims
+
+
+def bearer_token(event):
+    """Jeton de l'en-tête `Authorization: Bearer ...`, ou None."""
+    scheme, _, token = (get_header(event, 'Authorization') or '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+def _fingerprint(jti):
+    return int.from_bytes(hashlib.blake2b(jti.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class RevocationList:
+    """Jetons révoqués jusqu'à leur expiration, en 12 octets par jeton.
+
+    Les empreintes (8 octets) et les expirations (4 octets) sont gardées
+    triées dans deux tableaux ; une recherche est une dichotomie. Les
+    écritures remplacent les deux tableaux d'un coup, les lectures se font
+    donc sans verrou.
+    """
+
+    def __init__(self):
+        self._entries = (array.array('Q'), array.array('I'))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries[0])
+
+    def _store(self, pairs):
+        self._entries = (array.array('Q', (f for f, _ in pairs)), array.array('I', (e for _, e in pairs)))
+
+    def add(self, jti, exp):
+        """Révoque le jeton `jti` jusqu'à `exp` (secondes depuis l'epoch)."""
+        fingerprint = _fingerprint(jti)
+        with self._lock:
+            pairs = dict(zip(*self._entries))
+            pairs[fingerprint] = max(pairs.get(fingerprint, 0), int(exp))
+            self._store(sorted(pairs.items()))
+
+    def contains(self, jti, now=None):
+        """Le jeton `jti` est révoqué et pas encore expiré."""
+        fingerprints, expires = self._entries
+        fingerprint = _fingerprint(jti)
+        i = bisect.bisect_left(fingerprints, fingerprint)
+        if i >= len(fingerprints) or fingerprints[i] != fingerprint:
+            return False
+        return expires[i] + LEEWAY >= (time.time() if now is None else now)
+
+    def prune(self, now=None):
+        """Oublie les jetons expirés, que leur signature suffit désormais à refuser."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._store([(f, e) for f, e in zip(*self._entries) if e + LEEWAY >= now])
+
+    def replace(self, entries):
+        """Remplace le contenu par `entries`, des couples `(jti, exp)`."""
+        pairs = {}
+        for jti, exp in entries:
+            fingerprint = _fingerprint(jti)
+            pairs[fingerprint] = max(pairs.get(fingerprint, 0), int(exp))
+        with self._lock:
+            self._store(sorted(pairs.items()))
+
+
+class _RevocationFile:
+    """Liste de révocation du processus, alimentée par `SESSION_REVOCATION_FILE`."""
+
+    def __init__(self):
+        self.list = RevocationList()
+        self.revoked = RevocationList()
+        self._path = None
+        self._stamp = None
+        self._next_check = 0.0
+
+    def _refresh(self):
+        path = config.get().session_revocation_file
+        now = time.monotonic()
+        if path == self._path and now < self._next_check:
+            return
+        self._next_check = now + REVOCATION_CHECK_INTERVAL
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        stamp = stat and (stat.st_mtime_ns, stat.st_size)
+        if path == self._path and stamp == self._stamp:
+            return
+        entries = []
+        if stamp:
+            with open(path) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1].isdigit():
+                        entries.append((fields[0], int(fields[1])))
+        self.list.replace(entries)
+        self.list.prune()
+        self._path, self._stamp = path, stamp
+
+    def contains(self, jti, now):
+        self._refresh()
+        return self.list.contains(jti, now) or self.revoked.contains(jti, now)
+
+
+_revocations = _RevocationFile()
+
+
+def revoke(claims):
+    """Révoque dans ce processus un jeton déjà vérifié (ses revendications)."""
+    _revocations.revoked.prune()
+    _revocations.revoked.add(claims['jti'], claims['exp'])
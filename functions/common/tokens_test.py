@@ -0,0 +1,84 @@
+import base64
+import json
+
+import pytest
+
+from . import config, tokens
+
+OLD_KEY = base64.urlsafe_b64encode(b"o" * 32).decode()
+NEW_KEY = base64.urlsafe_b64encode(b"n" * 32).decode()
+
+
+@pytest.fixture
+def use_keys(monkeypatch):
+    def use(keys, **values):
+        cfg = config.Config({"SESSION_KEYS": keys, **values})
+        monkeypatch.setattr(config, "get", lambda: cfg)
+        return cfg
+    return use
+
+
+def test_token_round_trip_and_tampering(use_keys):
+    use_keys(f"k1:{NEW_KEY}", SESSION_TOKEN_TTL="60")
+    token, expires_at = tokens.issue(42, "alice", True, now=1000)
+
+    claims = tokens.verify(token, now=1030)
+    assert (claims["sub"], claims["name"], claims["mfa"], claims["exp"]) == ("42", "alice", True, 1060)
+    assert expires_at == 1060
+
+    header, payload, signature = token.split(".")
+    forged = base64.urlsafe_b64encode(json.dumps({**claims, "sub": "1"}).encode()).decode().rstrip("=")
+    for bad in (f"{header}.{forged}.{signature}", token[:-2], "not-a-token", f"{header}.{payload}"):
+        with pytest.raises(tokens.TokenError):
+            tokens.verify(bad, now=1030)
+    with pytest.raises(tokens.TokenError, match="expired"):
+        tokens.verify(token, now=1060 + tokens.LEEWAY + 1)
+
+    # A header that is not an object, or whose kid is not a string, is a 401, not a 500
+    for bad_header in ({"alg": "HS256", "kid": ["x"]}, {"alg": "HS256", "kid": {"k": 1}}, ["k1"]):
+        encoded = base64.urlsafe_b64encode(json.dumps(bad_header).encode()).decode().rstrip("=")
+        with pytest.raises(tokens.TokenError, match="Malformed"):
+            tokens.verify(f"{encoded}.{payload}.{signature}", now=1030)
+    # Segments that are not ASCII base64url never reach the signature check
+    for bad in (f"{header}.é.{signature}", f"{header}.{payload}é.{signature}", f"{header}.{payload}.{signature}=",
+                f"{header}..{signature}"):
+        with pytest.raises(tokens.TokenError, match="Malformed"):
+            tokens.verify(bad, now=1030)
+
+
+def test_key_rotation(use_keys):
+    use_keys(f"old:{OLD_KEY}")
+    old_token, _ = tokens.issue(1, "alice", False)
+
+    use_keys(f"new:{NEW_KEY},old:{OLD_KEY}")
+    new_token, _ = tokens.issue(1, "alice", False)
+    assert json.loads(base64.urlsafe_b64decode(new_token.split(".")[0] + "=="))["kid"] == "new"
+    assert tokens.verify(old_token)["sub"] == "1"
+
+    use_keys(f"new:{NEW_KEY}")
+    assert tokens.verify(new_token)["sub"] == "1"
+    with pytest.raises(tokens.TokenError, match="Unknown signing key"):
+        tokens.verify(old_token)
+
+    with pytest.raises(config.ConfigError, match="SESSION_KEYS"):
+        config.Config({"SESSION_KEYS": "k1:dG9vLXNob3J0"})
+
+
+def test_revocation_file_and_in_process_revocation(use_keys, tmp_path, monkeypatch):
+    revoked_file = tmp_path / "revoked"
+    use_keys(f"k1:{NEW_KEY}", SESSION_REVOCATION_FILE=str(revoked_file))
+    monkeypatch.setattr(tokens, "_revocations", tokens._RevocationFile())
+    first, _ = tokens.issue(1, "alice", False)
+    second, _ = tokens.issue(2, "bob", False)
+    first_claims = tokens.verify(first)
+
+    revoked_file.write_text(f"{first_claims['jti']} {first_claims['exp']}\nexpired-jti 1\n")
+    tokens._revocations._next_check = 0
+    with pytest.raises(tokens.TokenError, match="revoked"):
+        tokens.verify(first)
+    assert len(tokens._revocations.list) == 1
+
+    second_claims = tokens.verify(second)
+    tokens.revoke(second_claims)
+    with pytest.raises(tokens.TokenError, match="revoked"):
+        tokens.verify(second)
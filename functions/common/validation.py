@@ -0,0 +1,128 @@
+"""
+Validation des requêtes, avant toute entrée-sortie.
+
+Chaque handler déclare les champs qu'il attend dans un `Schema`, construit à
+l'import. `Schema.parse(event)` vérifie en une passe, sans accès à la base ni
+calcul cryptographique :
+
+- la taille du corps (`MAX_BODY_BYTES`, 413 au-delà) ;
+- que le corps est un objet JSON ;
+- la présence des champs obligatoires, puis le type et le format de chaque
+  champ présent, avec des expressions compilées une fois à l'import.
+
+Formats :
+    username: 3 à 255 caractères parmi `[A-Za-z0-9_-]` (règle de
+        `OpenFaaSClient.validateUsername` dans le frontend, longueur de la colonne) ;
+    password: 1 à `MAX_PASSWORD_LENGTH` caractères (bcrypt n'utilise que les 72 premiers octets) ;
+    totp_code: 6 chiffres ;
+    context: chaîne d'au plus 64 caractères.
+
+Les champs inconnus sont ignorés. Une requête invalide lève `ValidationError`,
+que les handlers renvoient avec `responses.invalid_request()`.
+"""
+import json
+import os
+import re
+
+from .events import get_body
+
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_BYTES', '4096'))
+MAX_PASSWORD_LENGTH = 128
+
+USERNAME = re.compile(r'[A-Za-z0-9_-]{3,255}')
+TOTP_CODE = re.compile(r'[0-9]{6}')
+
+
+class ValidationError(ValueError):
+    """La requête est invalide.
+
+    Attributes:
+        status_code (int): Statut HTTP de la réponse (400, ou 413 pour un corps trop gros).
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _string(pattern=None, min_length=1, max_length=None, message=None):
+    """Construit la vérification d'un champ texte."""
+    def check(name, value):
+        if not isinstance(value, str):
+            raise ValidationError(f"{name} must be a string")
+        if pattern is not None:
+            if not pattern.fullmatch(value):
+                raise ValidationError(message)
+        elif not min_length <= len(value) <= max_length:
+            raise ValidationError(message)
+    return check
+
+
+FIELDS = {
+    'username': _string(USERNAME, message="Username must be 3-255 characters: letters, numbers, "
+                                          "hyphens and underscores"),
+    'password': _string(max_length=MAX_PASSWORD_LENGTH,
+                        message=f"Password must be 1-{MAX_PASSWORD_LENGTH} characters"),
+    'totp_code': _string(TOTP_CODE, message="TOTP code must be 6 digits"),
+    'context': _string(max_length=64, message="Context must be at most 64 characters"),
+}
+
+
+def parse_body(event, max_bytes=None):
+    """Lit le corps JSON de la requête, borné à `max_bytes` (par défaut `MAX_BODY_BYTES`).
+
+    Returns:
+        dict: L'objet JSON, vide si le corps est vide.
+
+    Raises:
+        ValidationError: Si le corps est trop gros ou n'est pas un objet JSON.
+    """
+    body = get_body(event)
+    max_bytes = max_bytes or MAX_BODY_BYTES
+    if len(body) > max_bytes:
+        raise ValidationError(f"Request body larger than {max_bytes} bytes", 413)
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError("Invalid JSON in request body")
+    if not isinstance(data, dict):
+        raise ValidationError("Request body must be a JSON object")
+    return data
+
+
+class Schema:
+    """Champs attendus par un handler.
+
+    Args:
+        required (tuple): Champs obligatoires, dans l'ordre du message.
+        optional (tuple): Champs facultatifs, vérifiés lorsqu'ils sont présents.
+        missing (str): Message renvoyé lorsqu'un champ obligatoire manque ou est vide.
+    """
+
+    def __init__(self, required=(), optional=(), missing=None):
+        self.required = tuple(required)
+        self.checks = tuple((name, FIELDS[name]) for name in self.required + tuple(optional))
+        self.missing = missing or f"{', '.join(self.required)} required"
+
+    def validate(self, data):
+        """Vérifie un corps déjà lu ; retourne les champs attendus (None si absents)."""
+        for name in self.required:
+            if data.get(name) in (None, ''):
+                raise ValidationError(self.missing)
+        fields = {}
+        for name, check in self.checks:
+            value = data.get(name)
+            if value not in (None, ''):
+                check(name, value)
+            fields[name] = value
+        return fields
+
+    def parse(self, event):
+        """Lit et vérifie le corps de la requête.
+
+        Raises:
+            ValidationError: Si la requête est invalide.
+        """
+        return self.validate(parse_body(event))
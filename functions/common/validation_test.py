@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from . import validation
+
+LOGIN = validation.Schema(required=('username', 'password'), optional=('totp_code', 'context'),
+                          missing="Username and password are required")
+
+
+class Event:
+    def __init__(self, body):
+        self.body = body
+        self.headers = {}
+
+
+def error(event, schema=LOGIN):
+    with pytest.raises(validation.ValidationError) as excinfo:
+        schema.parse(event)
+    return excinfo.value.status_code, str(excinfo.value)
+
+
+def test_body_is_bounded_and_must_be_an_object():
+    oversized = json.dumps({"username": "alice", "password": "x" * validation.MAX_BODY_BYTES})
+    assert error(Event(oversized))[0] == 413
+    assert error(Event(b'{"username":'))[1] == "Invalid JSON in request body"
+    assert error(Event('["alice"]'))[1] == "Request body must be a JSON object"
+    assert error(Event(None)) == (400, "Username and password are required")
+
+
+def test_fields_are_checked_for_type_and_format():
+    assert error(Event('{"username": "alice", "password": ""}'))[1] == "Username and password are required"
+    assert error(Event('{"username": ["alice"], "password": "x"}'))[1] == "username must be a string"
+    assert "3-255 characters" in error(Event('{"username": "al", "password": "x"}'))[1]
+    assert "3-255 characters" in error(Event('{"username": "bob; DROP", "password": "x"}'))[1]
+    assert error(Event('{"username": "alice", "password": "x", "totp_code": "12345a"}'))[1] == \
+        "TOTP code must be 6 digits"
+    assert error(Event('{"username": "alice", "password": "x", "totp_code": 123456}'))[1] == \
+        "totp_code must be a string"
+
+
+def test_valid_request_returns_declared_fields_only():
+    body = '{"username": "alice", "password": "secret", "totp_code": "", "extra": 1}'
+    assert LOGIN.parse(Event(body)) == {
+        "username": "alice", "password": "secret", "totp_code": "", "context": None,
+    }
@@ -3,89 +3,26 @@ Ce module fournit une fonction OpenFaaS pour générer et configurer
 l'authentification à deux facteurs (2FA) pour un utilisateur via TOTP (Time-based One-Time Password).
 
 Il effectue les opérations suivantes :
-- Génère un nouveau secret TOTP.
+- Génère un nouveau secret TOTP (base32, `common.randomness`).
 - Chiffre le secret avant de le stocker.
 - Crée un URI de provisioning TOTP.
 - Génère un QR code à partir de l'URI.
 - Met à jour l'enregistrement de l'utilisateur dans la base de données avec le secret chiffré.
 - Renvoie le secret (à des fins de démonstration, à supprimer en production) et le QR code en base64.
 """
-import os
 import json
 import pyotp
-import qrcode
-import base64
-import io
-import psycopg2
-from psycopg2 import sql
-from cryptography.fernet import Fernet, InvalidToken
-from dotenv import load_dotenv
+from .common import capture, db, deadline, idempotency, limiter, randomness, repository, responses, validation
+from .common.crypto import encrypt_secret
+from .common.qr import create_qr_code
 
-# Load environment variables at module level
-load_dotenv()
+REQUEST = validation.Schema(required=('username',), missing="Username is required")
 
-def get_db_connection():
-    """Crée et retourne une connexion à la base de données."""
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', '5432')
-        )
-        return conn
-    except Exception as e:
-        raise Exception(f"Failed to connect to database: {str(e)}")
-
-def get_encryption_key():
-    """Récupère la clé de chiffrement depuis les variables d'environnement."""
-    key = os.getenv('ENCRYPTION_KEY')
-    if not key:
-        raise ValueError("ENCRYPTION_KEY environment variable not set")
-    
-    # Ensure the key is the correct length (32 bytes, base64-encoded)
-    key = key.encode('utf-8')
-    if len(key) != 44:  # 32 bytes = 44 base64 characters
-        raise ValueError("ENCRYPTION_KEY must be 32 bytes, base64-encoded")
-    
-    return key
-
-def encrypt_secret(secret):
-    """Chiffre le secret TOTP avant de le stocker.
-
-    Args:
-        secret (str): Le secret TOTP à chiffrer.
-
-    Returns:
-        str: Le secret chiffré, encodé en base64.
-
-    Raises:
-        ValueError: Si la clé de chiffrement n'est pas définie.
-    """
-    key = get_encryption_key()
-    f = Fernet(key)
-    encrypted = f.encrypt(secret.encode('utf-8'))
-    return encrypted.decode('utf-8')
-
-def create_qr_code(data):
-    """Crée un QR code et le retourne sous forme de chaîne encodée en base64."""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
+@capture.captured('generate-2fa')
+@limiter.limited('generate-2fa')
+@deadline.bounded('generate-2fa')
+@idempotency.idempotent('generate-2fa')
 def handle(event, context):
     """Point d'entrée principal pour la fonction de génération de 2FA.
 
@@ -93,17 +30,24 @@ def handle(event, context):
     Il attend un corps JSON contenant 'username'.
 
     Le processus comprend :
-    1. Analyse de la requête entrante pour obtenir le nom d'utilisateur.
+    1. Analyse et validation de la requête entrante (`common.validation`), puis 404
+       si l'utilisateur n'existe pas, avant tout calcul ou rendu.
     2. Génération d'un nouveau secret TOTP aléatoire.
     3. Chiffrement du secret.
     4. Création d'un URI de provisioning TOTP pour le QR code (incluant le nom d'utilisateur et l'émetteur).
     5. Génération d'une image QR code à partir de l'URI et encodage en base64.
-    6. Connexion à la base de données.
-    7. Vérification de l'existence de l'utilisateur.
-    8. Mise à jour de l'enregistrement de l'utilisateur avec le nouveau secret MFA chiffré.
-    9. Renvoi d'une réponse HTTP avec le statut, un message, le secret brut (pour démo)
+    6. Enregistrement du secret MFA chiffré dans le dépôt (`common.repository`),
+       ou 404 si l'utilisateur a disparu entre-temps.
+    7. Renvoi d'une réponse HTTP avec le statut, un message, le secret brut (pour démo)
        et le QR code encodé en base64.
 
+    Si la requête porte un en-tête `Idempotency-Key` déjà utilisé (voir `common.idempotency`),
+    le secret et le QR code déjà renvoyés sont rejoués sans
+    réécrire `users.mfa`.
+
+    Le QR code et l'écriture sont bornés par l'échéance de la requête
+    (`common.deadline`) : une fois dépassée, la réponse est un 504.
+
     Args:
         event: L'objet événement contenant les détails de la requête (par exemple, corps, en-têtes).
                Le corps de la requête doit être un JSON avec le champ 'username'.
@@ -114,27 +58,23 @@ def handle(event, context):
               Le corps est une chaîne JSON avec les informations de configuration 2FA.
     """
     
-    conn = None
-    cursor = None
     try:
-        # Parse incoming request
+        # Parse and validate the request before any I/O
         try:
-            body = json.loads(event.body) if hasattr(event, 'body') and event.body else {}
-            username = body.get('username')
-        except json.JSONDecodeError:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Invalid JSON in request body"})
-            }
+            username = REQUEST.parse(event)['username']
+        except validation.ValidationError as e:
+            return responses.invalid_request(e)
         
-        if not username:
+        # Check that the user exists before any crypto or rendering
+        users = repository.get_repository()
+        if not users.exists(username):
             return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Username is required"})
+                "statusCode": 404,
+                "body": json.dumps({"error": "User not found"})
             }
         
         # Generate a new TOTP secret
-        secret = pyotp.random_base32()
+        secret = randomness.base32_secret()
         
         # Encrypt the secret before storing
         encrypted_secret = encrypt_secret(secret)
@@ -146,32 +86,16 @@ def handle(event, context):
         )
         
         # Generate QR code
-        qr_code_base64 = create_qr_code(totp_uri)
-        
-        # Connect to database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with deadline.step('qr'):
+            qr_code_base64 = create_qr_code(totp_uri)
         
-        # Check if user exists
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-        
-        if not user:
+        # Update user with 2FA secret
+        if not users.set_mfa(username, encrypted_secret):
             return {
                 "statusCode": 404,
                 "body": json.dumps({"error": "User not found"})
             }
         
-        # Update user with 2FA secret
-        update_query = """
-            UPDATE users 
-            SET mfa = %s 
-            WHERE username = %s
-            RETURNING id
-        """
-        cursor.execute(update_query, (encrypted_secret, username))
-        conn.commit()
-        
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -182,17 +106,15 @@ def handle(event, context):
             })
         }
         
+    except db.DatabaseUnavailable as e:
+        return responses.service_unavailable(e)
+        
+    except deadline.DeadlineExceeded:
+        return responses.deadline_exceeded()
+        
     except Exception as e:
-        if conn:
-            conn.rollback()
         error_msg = str(e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"An error occurred: {error_msg}"})
         }
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
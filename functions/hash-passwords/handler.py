@@ -0,0 +1,112 @@
+"""
+Ce module fournit une fonction OpenFaaS interne qui hache et vérifie des
+mots de passe bcrypt par lots, pour `generate-password` et `authenticate-user`
+lorsque `HASH_SERVICE_URL` est défini (voir `common.hashing`).
+
+Le calcul, seul travail de la fonction, peut ainsi être mis à l'échelle et
+placé sur des nœuds optimisés pour le CPU indépendamment des fonctions qui
+attendent la base de données. La fonction n'accède à aucune base et ne
+conserve rien : ni les mots de passe ni les hash ne sont journalisés.
+
+Chaque requête doit porter le jeton partagé `HASH_SERVICE_TOKEN` (secret
+OpenFaaS `hash-service-token`) ; sans jeton configuré, tout est refusé. Le
+coût demandé ne peut dépasser `BCRYPT_ROUNDS`.
+
+Requête :
+    {"items": [{"op": "hash", "password": "...", "rounds": 12},
+               {"op": "verify", "password": "...", "hash": "$2b$12$..."}]}
+
+Réponse :
+    {"results": ["$2b$12$...", true]}
+
+Le résultat d'une vérification est None si le hash n'est pas un hash bcrypt.
+"""
+import hmac
+import json
+import os
+from .common import config, hashing, responses, validation
+from .common.events import get_header
+
+# Items accepted in one request: a client batch never exceeds twice HASH_BATCH_MAX
+MAX_ITEMS = int(os.getenv('HASH_MAX_ITEMS') or 2 * hashing.HASH_BATCH_MAX)
+MAX_HASH_LENGTH = 128
+# Largest item: a verify with the longest password and hash, JSON-escaped
+MAX_BODY_BYTES = MAX_ITEMS * 1024
+
+
+def _error(status_code, message):
+    return {
+        "statusCode": status_code,
+        "body": json.dumps({"error": message})
+    }
+
+
+def parse_items(body, max_rounds):
+    """Vérifie les éléments d'un lot ; `max_rounds` : coût le plus élevé accepté.
+
+    Raises:
+        validation.ValidationError: Si un élément est invalide.
+    """
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise validation.ValidationError("items must be a non-empty list")
+    if len(items) > MAX_ITEMS:
+        raise validation.ValidationError(f"At most {MAX_ITEMS} items per batch", 413)
+    for item in items:
+        if not isinstance(item, dict) or item.get('op') not in ('hash', 'verify'):
+            raise validation.ValidationError("Each item needs an op: hash or verify")
+        password = item.get('password')
+        if not isinstance(password, str) or len(password) > validation.MAX_PASSWORD_LENGTH:
+            raise validation.ValidationError(
+                f"password must be a string of at most {validation.MAX_PASSWORD_LENGTH} characters")
+        if item['op'] == 'hash':
+            rounds = item.get('rounds')
+            if rounds is not None and (type(rounds) is not int
+                                       or not hashing.MIN_ROUNDS <= rounds <= max_rounds):
+                raise validation.ValidationError(
+                    f"rounds must be an integer from {hashing.MIN_ROUNDS} to {max_rounds}")
+        elif not isinstance(item.get('hash'), str) or len(item['hash']) > MAX_HASH_LENGTH:
+            raise validation.ValidationError(f"hash must be a string of at most {MAX_HASH_LENGTH} characters")
+    return items
+
+
+def handle(event, context):
+    """Point d'entrée de la fonction de hachage.
+
+    Le processus comprend :
+    1. Vérification du jeton partagé (`HASH_SERVICE_TOKEN`) : 401 s'il manque ou n'est pas configuré.
+    2. Analyse et validation du lot, avant tout calcul.
+    3. Calcul des éléments en parallèle (`common.hashing.execute`).
+
+    Args:
+        event: L'objet événement ; le corps est un JSON `{"items": [...]}`.
+        context: L'objet contexte d'exécution (non utilisé dans cette fonction).
+
+    Returns:
+        dict: La réponse HTTP, dont le corps JSON contient `results` dans l'ordre des éléments.
+    """
+    cfg = config.get()
+    if not cfg.hash_service_token:
+        print("HASH_SERVICE_TOKEN is not configured, refusing the batch")
+        return _error(401, "Invalid hash service token")
+    authorization = get_header(event, 'Authorization', '')
+    if not hmac.compare_digest(authorization.encode('utf-8'),
+                               f"Bearer {cfg.hash_service_token}".encode('utf-8')):
+        return _error(401, "Invalid hash service token")
+
+    try:
+        items = parse_items(validation.parse_body(event, MAX_BODY_BYTES), cfg.bcrypt_rounds)
+    except validation.ValidationError as e:
+        return responses.invalid_request(e)
+
+    try:
+        results = hashing.execute(items)
+    except Exception as e:
+        # Never echo the exception: it could quote a password
+        print(f"Hash batch failed: {type(e).__name__}")
+        return _error(500, "Hash batch failed")
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"results": results})
+    }
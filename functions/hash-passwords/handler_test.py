@@ -0,0 +1,68 @@
+import json
+
+import bcrypt
+import pytest
+
+from . import handler
+from .handler import handle
+
+TOKEN = "test-hash-token"
+
+
+class Event:
+    def __init__(self, payload, token=TOKEN):
+        self.body = json.dumps(payload).encode()
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.method = "POST"
+        self.query = {}
+        self.path = "/"
+
+
+@pytest.fixture
+def cfg(monkeypatch):
+    cfg = handler.config.Config({"HASH_SERVICE_TOKEN": TOKEN, "BCRYPT_ROUNDS": "5"})
+    monkeypatch.setattr(handler.config, "get", lambda: cfg)
+    return cfg
+
+
+def test_missing_or_wrong_token_is_refused(cfg, monkeypatch):
+    items = {"items": [{"op": "hash", "password": "secret", "rounds": 4}]}
+    assert handle(Event(items, token=None), None)["statusCode"] == 401
+    assert handle(Event(items, token="wrong"), None)["statusCode"] == 401
+
+    # No token configured: the service refuses everything
+    unconfigured = handler.config.Config({})
+    monkeypatch.setattr(handler.config, "get", lambda: unconfigured)
+    assert handle(Event(items), None)["statusCode"] == 401
+    assert handle(Event(items, token="None"), None)["statusCode"] == 401
+
+
+def test_batch_size_and_rounds_are_validated(cfg):
+    too_many = [{"op": "verify", "password": "p", "hash": "h"}] * (handler.MAX_ITEMS + 1)
+    assert handle(Event({"items": too_many}), None)["statusCode"] in (400, 413)
+    assert handle(Event({"items": []}), None)["statusCode"] == 400
+
+    for rounds in (3, cfg.bcrypt_rounds + 1, 16, "5", 4.0, True):
+        response = handle(Event({"items": [{"op": "hash", "password": "p", "rounds": rounds}]}), None)
+        assert response["statusCode"] == 400
+        assert "rounds" in json.loads(response["body"])["error"]
+
+
+def test_results_are_returned_in_request_order(cfg):
+    stored = bcrypt.hashpw(b"first", bcrypt.gensalt(4)).decode()
+    items = [
+        {"op": "verify", "password": "first", "hash": stored},
+        {"op": "hash", "password": "second", "rounds": 4},
+        {"op": "verify", "password": "wrong", "hash": stored},
+        {"op": "hash", "password": "third"},
+        {"op": "verify", "password": "first", "hash": "not a hash"},
+    ]
+
+    response = handle(Event({"items": items}), None)
+
+    assert response["statusCode"] == 200
+    results = json.loads(response["body"])["results"]
+    assert results[0] is True and results[2] is False and results[4] is None
+    assert bcrypt.checkpw(b"second", results[1].encode()) and results[1].startswith("$2b$04$")
+    # Without rounds: the configured cost
+    assert bcrypt.checkpw(b"third", results[3].encode()) and results[3].startswith("$2b$05$")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Simulate the function scaling policies against a load profile.
+
+Reads the policies shipped with the repository and plays a load profile
+against them, one simulated second at a time, then prints the replica
+count, per-replica signals and waiting time of each function:
+- --policy hpa: the HorizontalPodAutoscalers of chart/values.yaml
+  (autoscaling.functions), which scale on in-flight requests, queue depth
+  and p95 handler time per replica, keep the highest proposal, apply the
+  default scale-up rate (double or +4 pods per period) and the scale-down
+  stabilization window;
+- --policy openfaas: the com.openfaas.scale.* labels of functions/stack.yaml
+  (capacity mode: in-flight requests per replica, queued ones included).
+
+Each replica serves WORKERS requests at once (functions/stack.yaml), each
+taking the function's service time; the rest waits in the listen queue.
+The load is either a piecewise-linear profile applied to every function
+(--profile "0:5,120:80,300:80,360:5", seconds:requests per second), or the
+arrivals and handler times of capture files (see replay-traffic.py).
+
+This is a fluid model: it shows how the policies react to a load shape
+(scale-out delay, overshoot, scale-down lag), not exact latencies.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from collections import defaultdict, deque
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTION_NAMES = ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]
+
+# Handler time in seconds with BCRYPT_ROUNDS=12, measured on one core
+DEFAULT_SERVICE_TIMES = {
+    "generate-password": 0.30,
+    "generate-2fa": 0.05,
+    "authenticate-user": 0.25,
+    "check-user-status": 0.01,
+}
+
+HPA_TOLERANCE = 0.1
+HPA_SCALE_UP_PODS = 4
+
+
+def parse_profile(text):
+    """'0:5,120:80' -> sorted [(0, 5.0), (120, 80.0)]."""
+    points = []
+    for item in text.split(","):
+        t, rate = item.split(":")
+        points.append((float(t), float(rate)))
+    points.sort()
+    if not points:
+        raise argparse.ArgumentTypeError("empty profile")
+    return points
+
+
+def parse_service_time(value):
+    name, _, seconds = value.partition("=")
+    if name not in FUNCTION_NAMES or not seconds:
+        raise argparse.ArgumentTypeError("expected <function>=<seconds>")
+    return name, float(seconds)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate the function scaling policies.")
+    parser.add_argument("--policy", choices=["hpa", "openfaas"], default="hpa")
+    parser.add_argument("--profile", type=parse_profile, default=parse_profile("0:5,120:80,300:80,360:5,900:5"),
+                        help="seconds:rps points, linearly interpolated, for every function")
+    parser.add_argument("--capture", nargs="+", help="use the arrivals and handler times of capture files instead")
+    parser.add_argument("--functions", nargs="+", choices=FUNCTION_NAMES, default=FUNCTION_NAMES)
+    parser.add_argument("--service-time", type=parse_service_time, action="append", default=[],
+                        help="<function>=<seconds>, overrides the default or captured handler time")
+    parser.add_argument("--values", default=os.path.join(ROOT, "chart", "values.yaml"))
+    parser.add_argument("--stack", default=os.path.join(ROOT, "functions", "stack.yaml"))
+    parser.add_argument("--sync-period", type=int, default=15, help="seconds between two scaling decisions")
+    parser.add_argument("--startup", type=int, default=10, help="seconds before a new replica serves requests")
+    parser.add_argument("--report-every", type=int, default=30, help="seconds between two printed rows")
+    parser.add_argument("--json", help="write the per-second series of every function to this file")
+    return parser.parse_args()
+
+
+def interpolate(points, t):
+    if t <= points[0][0]:
+        return points[0][1]
+    for (t0, r0), (t1, r1) in zip(points, points[1:]):
+        if t <= t1:
+            return r0 + (r1 - r0) * (t - t0) / (t1 - t0) if t1 > t0 else r1
+    return points[-1][1]
+
+
+def profile_load(points, functions):
+    duration = int(points[-1][0])
+    rates = [interpolate(points, t) for t in range(duration)]
+    return {name: rates for name in functions}
+
+
+def capture_load(paths, functions):
+    """Per-second arrival counts and p95 handler time of each function."""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("function") in functions:
+                    records.append(record)
+    if not records:
+        return {}, {}
+    start = min(r["ts"] for r in records)
+    duration = int(max(r["ts"] for r in records) - start) + 1
+    load = {name: [0.0] * duration for name in functions}
+    durations = defaultdict(list)
+    for record in records:
+        load[record["function"]][int(record["ts"] - start)] += 1
+        durations[record["function"]].append(record["duration_ms"] / 1000)
+    service = {}
+    for name, values in durations.items():
+        values.sort()
+        service[name] = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return load, service
+
+
+def load_policies(args):
+    """Replica bounds and targets per function, plus the WORKERS of each."""
+    with open(args.stack) as f:
+        stack = yaml.safe_load(f)["functions"]
+    policies = {}
+    if args.policy == "hpa":
+        with open(args.values) as f:
+            autoscaling = yaml.safe_load(f)["autoscaling"]["functions"]
+        for name, policy in autoscaling["policies"].items():
+            policies[name] = {
+                "min": int(policy["minReplicas"]),
+                "max": int(policy["maxReplicas"]),
+                "targets": {
+                    "inflight": float(policy["inflightPerReplica"]),
+                    "queue": float(policy["queueDepthPerReplica"]),
+                },
+                "down_window": int(autoscaling["scaleDownStabilizationSeconds"]),
+            }
+            if policy.get("p95LatencySeconds"):
+                policies[name]["targets"]["p95"] = float(policy["p95LatencySeconds"])
+    else:
+        for name, function in stack.items():
+            labels = function.get("labels") or {}
+            if labels.get("com.openfaas.scale.type") != "capacity":
+                continue
+            target = float(labels["com.openfaas.scale.target"])
+            proportion = float(labels.get("com.openfaas.scale.target-proportion", 0.9))
+            policies[name] = {
+                "min": int(labels.get("com.openfaas.scale.min", 1)),
+                "max": int(labels.get("com.openfaas.scale.max", 20)),
+                "targets": {"capacity": target * proportion},
+                "down_window": int(float(labels.get("com.openfaas.scale.down.window", "300s").rstrip("s"))),
+            }
+    for name, policy in policies.items():
+        policy["workers"] = int((stack.get(name) or {}).get("environment", {}).get("WORKERS", 1))
+    return policies
+
+
+class Deployment:
+    """Replicas of one function and the backlog waiting for their workers."""
+
+    def __init__(self, policy, service_time, args):
+        self.policy = policy
+        self.service_time = service_time
+        self.sync_period = args.sync_period
+        self.startup = args.startup
+        self.desired = policy["min"]
+        self.starting = deque()  # ready time of the replicas being started
+        self.ready = policy["min"]
+        self.backlog = 0.0
+        self.recommendations = deque()  # (time, replicas) for the stabilization window
+        self.samples = []
+
+    def step(self, t, arrivals):
+        while self.starting and self.starting[0] <= t:
+            self.starting.popleft()
+            self.ready += 1
+
+        capacity = self.ready * self.policy["workers"] / self.service_time
+        served = min(self.backlog + arrivals, capacity)
+        self.backlog += arrivals - served
+        busy = served * self.service_time
+        sample = {
+            "t": t,
+            "rps": arrivals,
+            "replicas": self.ready,
+            "desired": self.desired,
+            "inflight": busy / self.ready,
+            "queue": self.backlog / self.ready,
+            "p95": self.service_time,
+            "wait": self.backlog / capacity if capacity else 0.0,
+        }
+        self.samples.append(sample)
+        if t % self.sync_period == self.sync_period - 1:
+            self.scale(t)
+        return sample
+
+    def _signals(self):
+        """Signals averaged over the last sync period, per ready replica."""
+        window = self.samples[-self.sync_period:]
+        inflight = sum(s["inflight"] for s in window) / len(window)
+        queue = sum(s["queue"] for s in window) / len(window)
+        return {"inflight": inflight, "queue": queue, "p95": window[-1]["p95"],
+                "capacity": inflight + queue}
+
+    def scale(self, t):
+        signals = self._signals()
+        current = self.desired
+        proposal = self.policy["min"]
+        for name, target in self.policy["targets"].items():
+            ratio = signals[name] / target
+            if "capacity" in self.policy["targets"]:
+                # OpenFaaS: total in-flight requests over the per-replica target
+                proposal = max(proposal, math.ceil(signals[name] * self.ready / target))
+            elif abs(ratio - 1) <= HPA_TOLERANCE:
+                proposal = max(proposal, current)
+            else:
+                proposal = max(proposal, math.ceil(self.ready * ratio))
+
+        # Scale down to the highest recommendation of the window, scale up at a bounded rate
+        self.recommendations.append((t, proposal))
+        while self.recommendations[0][0] <= t - self.policy["down_window"]:
+            self.recommendations.popleft()
+        if proposal < current:
+            proposal = min(current, max(r for _, r in self.recommendations))
+        elif "capacity" not in self.policy["targets"]:
+            proposal = min(proposal, max(2 * current, current + HPA_SCALE_UP_PODS))
+        proposal = max(self.policy["min"], min(self.policy["max"], proposal))
+
+        for _ in range(proposal - current):
+            self.starting.append(t + self.startup)
+        for _ in range(current - proposal):
+            if self.starting:
+                self.starting.pop()
+            else:
+                self.ready -= 1
+        self.desired = proposal
+
+
+def fmt(value, digits=1):
+    return f"{value:.{digits}f}"
+
+
+def simulate(name, deployment, rates, report_every):
+    print(f"\n{name}  (workers={deployment.policy['workers']}, service time {deployment.service_time * 1000:.0f} ms, "
+          f"replicas {deployment.policy['min']}-{deployment.policy['max']}, targets {deployment.policy['targets']})")
+    print(f"{'t (s)':>6} {'rps':>7} {'ready':>6} {'desired':>8} {'inflight/r':>11} {'queue/r':>8} {'wait (s)':>9}")
+    for t, arrivals in enumerate(rates):
+        sample = deployment.step(t, arrivals)
+        if t % report_every == 0:
+            print(f"{t:>6} {fmt(arrivals):>7} {sample['replicas']:>6} {sample['desired']:>8} "
+                  f"{fmt(sample['inflight'], 2):>11} {fmt(sample['queue'], 1):>8} {fmt(sample['wait'], 2):>9}")
+
+    samples = deployment.samples
+    replica_seconds = sum(s["replicas"] for s in samples)
+    waiting = sum(1 for s in samples if s["wait"] > 1)
+    print(f"  max replicas {max(s['replicas'] for s in samples)}, "
+          f"{replica_seconds / 3600:.2f} replica-hours, "
+          f"max wait {fmt(max(s['wait'] for s in samples), 2)} s, "
+          f"{waiting} s with requests waiting over 1 s")
+    return waiting
+
+
+def main():
+    args = parse_args()
+    policies = load_policies(args)
+    service_times = dict(DEFAULT_SERVICE_TIMES)
+    if args.capture:
+        load, captured = capture_load(args.capture, set(args.functions))
+        service_times.update(captured)
+        if not load:
+            print("❌ No captured requests for these functions")
+            return 1
+    else:
+        load = profile_load(args.profile, args.functions)
+    service_times.update(dict(args.service_time))
+
+    print(f"Simulating the {args.policy} policy: decision every {args.sync_period}s, "
+          f"replicas ready {args.startup}s after scale-out")
+    series = {}
+    overloaded = []
+    for name in args.functions:
+        if name not in policies:
+            print(f"\n⚠️  {name}: no {args.policy} policy, skipped")
+            continue
+        deployment = Deployment(policies[name], service_times[name], args)
+        if simulate(name, deployment, load[name], args.report_every):
+            overloaded.append(name)
+        series[name] = deployment.samples
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(series, f, indent=2)
+
+    print("\n" + (f"⚠️  Requests waited over 1 s for: {', '.join(overloaded)}" if overloaded
+                  else "✅ No request waited over 1 s"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
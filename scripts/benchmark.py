@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the handler hot-path primitives, without a database.
+
+`run` times each primitive in-process with realistic inputs and writes the
+samples to a versioned JSON baseline (benchmarks/<git commit>.json by
+default):
+- check_password (bcrypt, production cost by default), verify_totp,
+  encrypt_secret / decrypt_secret, generate_secure_password, bulk
+  password and base32 secret generation (1000 per call),
+  create_qr_code, is_account_expired;
+- JSON parsing of request bodies and serialization of responses;
+- whole handle() calls on the in-memory account repository
+  (STORAGE_BACKEND=memory), to see the decorators' overhead.
+
+Each benchmark is calibrated so one sample runs the primitive for about
+--sample-time seconds, then samples are taken until --time seconds (and at
+least --min-samples) with the garbage collector paused, as timeit does.
+
+`compare` reads two baselines and flags, per benchmark, a change that is
+both statistically significant (two-sided Mann-Whitney U test on the
+samples, --alpha) and larger than --threshold on the median. It exits with
+status 1 when a benchmark got slower, so it can gate a change in CI.
+Baselines from different machines, Python versions, dependency versions or
+bcrypt costs are compared with a warning: only compare runs of the same
+environment.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from importlib import metadata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(ROOT, "functions")
+BASELINE_DIR = os.path.join(ROOT, "benchmarks")
+SCHEMA_VERSION = 1
+PACKAGES = ["bcrypt", "cryptography", "pyotp", "qrcode", "Pillow", "psycopg2-binary", "python-dotenv"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the handler hot-path primitives.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="time the primitives and write a baseline")
+    run.add_argument("--filter", nargs="+", default=["*"], help="benchmark name patterns (fnmatch)")
+    run.add_argument("--time", type=float, default=2.0, help="seconds of sampling per benchmark")
+    run.add_argument("--sample-time", type=float, default=0.05, help="target duration of one sample, in seconds")
+    run.add_argument("--min-samples", type=int, default=7)
+    run.add_argument("--max-samples", type=int, default=200)
+    run.add_argument("--bcrypt-rounds", type=int, default=12, help="cost of the hashes checked (production: 12)")
+    run.add_argument("--output", help="baseline file (default: benchmarks/<git commit>.json)")
+    run.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+
+    compare = commands.add_parser("compare", help="compare two baselines")
+    compare.add_argument("baseline", help="reference baseline")
+    compare.add_argument("current", help="baseline to check against the reference")
+    compare.add_argument("--alpha", type=float, default=0.01, help="significance level of the test")
+    compare.add_argument("--threshold", type=float, default=0.05,
+                         help="smallest relative change of the median worth reporting")
+    return parser.parse_args()
+
+
+class Event:
+    """Request object passed to handle(), shaped like the template's."""
+
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.method = "POST"
+        self.query = {}
+        self.path = "/"
+
+
+def load_handlers():
+    sys.path.insert(0, FUNCTIONS_DIR)
+    from common.loader import load_handler
+    names = ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]
+    return {name: load_handler(os.path.join(FUNCTIONS_DIR, name)) for name in names}
+
+
+def build_benchmarks(args):
+    """Name -> zero-argument callable, with inputs prepared once."""
+    import bcrypt
+    import pyotp
+
+    handlers = load_handlers()
+    from common import crypto, qr, randomness, repository
+
+    auth = handlers["authenticate-user"]
+    password = handlers["generate-password"].generate_secure_password()
+    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode("utf-8")
+    secret = pyotp.random_base32()
+    encrypted = crypto.encrypt_secret(secret)
+    totp = pyotp.TOTP(secret)
+    totp_uri = totp.provisioning_uri(name="jean.dupont", issuer_name="COFRAP")
+    now = datetime.now(timezone.utc)
+    gendate = int((now - timedelta(days=30)).timestamp() * 1000)
+    qr_code = qr.create_qr_code(totp_uri)
+
+    login_body = json.dumps({"username": "jean.dupont", "password": password,
+                             "totp_code": totp.now()}).encode("utf-8")
+    setup_response = {"status": "success", "message": "2FA secret generated successfully",
+                      "secret": secret, "qr_code": qr_code}
+
+    users = repository.get_repository()
+    users.create_user("bench_user", password_hash, gendate)
+    users.set_mfa("bench_user", encrypted)
+    status_event = Event(json.dumps({"username": "bench_user"}).encode("utf-8"))
+    missing_event = Event(json.dumps({"username": "bench_missing", "password": password}).encode("utf-8"))
+    check_status = handlers["check-user-status"].handle
+
+    return {
+        "check_password": lambda: auth.check_password(password_hash, password),
+        "check_password:wrong": lambda: auth.check_password(password_hash, "Wrong-Passw0rd!"),
+        "verify_totp": lambda: auth.verify_totp(secret, totp.now()),
+        "encrypt_secret": lambda: crypto.encrypt_secret(secret),
+        "decrypt_secret": lambda: crypto.decrypt_secret(encrypted),
+        "generate_secure_password": handlers["generate-password"].generate_secure_password,
+        "randomness:passwords:1000": lambda: randomness.passwords(1000),
+        "randomness:base32_secrets:1000": lambda: randomness.base32_secrets(1000),
+        "create_qr_code:password": lambda: qr.create_qr_code(f"Username: jean.dupont\nPassword: {password}"),
+        "create_qr_code:totp_uri": lambda: qr.create_qr_code(totp_uri),
+        "is_account_expired": lambda: auth.is_account_expired(gendate),
+        "json:login_request": lambda: json.loads(login_body),
+        "json:2fa_response": lambda: json.dumps(setup_response),
+        "handle:check-user-status": lambda: check_status(status_event, None),
+        "handle:authenticate-user:unknown-user": lambda: auth.handle(missing_event, None),
+    }
+
+
+def measure(fn, loops):
+    """Seconds per call over `loops` calls, garbage collector paused."""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return (time.perf_counter() - start) / loops
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def run_benchmark(fn, args):
+    # Warm-up and calibration: one sample lasts about --sample-time seconds
+    per_call = measure(fn, 1)
+    loops = 1
+    while per_call * loops < args.sample_time and loops < 1_000_000:
+        loops *= 2
+        per_call = measure(fn, loops)
+    samples = []
+    deadline = time.perf_counter() + args.time
+    while len(samples) < args.max_samples and (len(samples) < args.min_samples or time.perf_counter() < deadline):
+        samples.append(measure(fn, loops))
+    return loops, samples
+
+
+def summarize(loops, samples):
+    ordered = sorted(samples)
+    quartiles = statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    return {
+        "loops": loops,
+        "samples": samples,
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "iqr": quartiles[2] - quartiles[0],
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def environment(args):
+    packages = {}
+    for name in PACKAGES:
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            packages[name] = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "cpus": os.cpu_count(),
+        "packages": packages,
+        "bcrypt_rounds": args.bcrypt_rounds,
+    }
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def command_run(args):
+    # Primitives only: no database, no capture, in-memory accounts
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ.setdefault("ENCRYPTION_KEY", "bA8tcGhp8hZsSSqIEv1hGUvrfUuiyB8XMCICfSmrV3k=")
+    os.environ.pop("CAPTURE_FILE", None)
+
+    benchmarks = build_benchmarks(args)
+    selected = [name for name in benchmarks if any(fnmatch.fnmatch(name, p) for p in args.filter)]
+    if args.list:
+        print("\n".join(selected))
+        return 0
+    if not selected:
+        print("❌ No benchmark matches --filter")
+        return 2
+
+    commit = git_commit()
+    results = {}
+    print(f"{'benchmark':<40} {'median':>10} {'iqr':>10} {'samples':>8} {'loops':>8}")
+    for name in selected:
+        loops, samples = run_benchmark(benchmarks[name], args)
+        results[name] = summarize(loops, samples)
+        print(f"{name:<40} {format_time(results[name]['median']):>10} {format_time(results[name]['iqr']):>10} "
+              f"{len(samples):>8} {loops:>8}", flush=True)
+
+    output = args.output or os.path.join(BASELINE_DIR, f"{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "schema_version": SCHEMA_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit,
+            "settings": {"time": args.time, "sample_time": args.sample_time, "min_samples": args.min_samples},
+            "environment": environment(args),
+            "benchmarks": results,
+        }, f, indent=2)
+    print(f"\n✅ Baseline written to {output}")
+    return 0
+
+
+def mann_whitney_p(a, b):
+    """Two-sided p-value of the Mann-Whitney U test (normal approximation, ties corrected)."""
+    n1, n2 = len(a), len(b)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    values = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    n = n1 + n2
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and values[j + 1][0] == values[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(1 for k in range(i, j + 1) if values[k][1] == 0)
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0.0) / math.sqrt(2))
+
+
+def load_baseline(path):
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError(f"{path}: baseline schema {baseline.get('schema_version')}, expected {SCHEMA_VERSION}")
+    return baseline
+
+
+def command_compare(args):
+    try:
+        old, new = load_baseline(args.baseline), load_baseline(args.current)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 2
+
+    for key in sorted(set(old["environment"]) | set(new["environment"])):
+        if old["environment"].get(key) != new["environment"].get(key):
+            print(f"⚠️  {key} differs: {old['environment'].get(key)} -> {new['environment'].get(key)}")
+
+    print(f"\n{old.get('commit')} -> {new.get('commit')}  (alpha {args.alpha}, threshold {args.threshold:.0%})")
+    print(f"{'benchmark':<40} {'before':>10} {'after':>10} {'change':>8} {'p-value':>9}  verdict")
+    regressions = []
+    for name in old["benchmarks"]:
+        if name not in new["benchmarks"]:
+            print(f"{name:<40} {'':>10} {'':>10} {'':>8} {'':>9}  missing")
+            continue
+        before, after = old["benchmarks"][name], new["benchmarks"][name]
+        change = after["median"] / before["median"] - 1
+        p = mann_whitney_p(before["samples"], after["samples"])
+        verdict = "same"
+        if p < args.alpha and abs(change) >= args.threshold:
+            verdict = "SLOWER" if change > 0 else "faster"
+        if verdict == "SLOWER":
+            regressions.append(name)
+        print(f"{name:<40} {format_time(before['median']):>10} {format_time(after['median']):>10} "
+              f"{change:>+8.1%} {p:>9.2g}  {verdict}")
+    for name in new["benchmarks"]:
+        if name not in old["benchmarks"]:
+            print(f"{name:<40} {'':>10} {format_time(new['benchmarks'][name]['median']):>10} "
+                  f"{'':>8} {'':>9}  new")
+
+    print("\n" + (f"❌ Significant regressions: {', '.join(regressions)}" if regressions
+                  else "✅ No significant regression"))
+    return 1 if regressions else 0
+
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        return command_run(args)
+    return command_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
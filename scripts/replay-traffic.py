@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Time-scaled replay of traffic captured by the function handlers.
+
+With CAPTURE_FILE set, the handlers record the sanitized shape of every
+request (see functions/common/capture.py): function, fields present, auth
+context, whether a TOTP code was sent, pseudonymous user, status and handler
+duration. This script re-issues that traffic against a deployment, keeping
+the original arrival times scaled by --speed (1x, 10x, ... or max), and
+compares latency and errors with the original run.
+
+Captures never contain credentials, so the replay uses its own synthetic
+users, one per pseudonymous user of the capture:
+- users that already existed when the capture started are created (and
+  given 2FA when the capture shows they use it) before the timed replay;
+- requests that succeeded originally are sent with valid credentials and
+  TOTP codes, requests that failed with 401 with a wrong password or code;
+- conditional status checks send the ETag of the user's previous check;
+- each user's requests run in their original order, different users run
+  concurrently, as in production.
+
+Latencies are not strictly comparable: the capture holds the handler time
+measured inside the function, the replay the client round trip. Status codes
+are compared request by request; an account that was expired in production
+is not expired in the replay, so its 403 shows up as a mismatch.
+"""
+
+import argparse
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pyotp
+import requests
+
+FUNCTION_NAMES = ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]
+
+
+def parse_speed(value):
+    """'1x', '10', '2.5x' -> factor; 'max' -> None (no pacing)."""
+    if value.lower() in ("max", "asap"):
+        return None
+    factor = float(value.lower().rstrip("x"))
+    if factor <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive")
+    return factor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay captured function traffic.")
+    parser.add_argument("captures", nargs="+", help="capture files written by the handlers (CAPTURE_FILE)")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080/function",
+                        help="functions are called at <base-url>/<function>")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="1x, 10x, ... or max")
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum requests in flight")
+    parser.add_argument("--functions", nargs="+", choices=FUNCTION_NAMES, default=FUNCTION_NAMES)
+    parser.add_argument("--export-token", help="EXPORT_TOKEN, to replay check-user-status exports")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--report", help="write the per-request results as JSON to this file")
+    return parser.parse_args()
+
+
+def load_capture(paths, functions):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of a capture still being written
+                    continue
+                if record.get("function") in functions:
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def existed_before_capture(events):
+    """Whether a user's events only make sense if the account already existed."""
+    first = events[0]
+    if first["function"] == "generate-password" and first["status"] == 200:
+        return False
+    for event in events:
+        if event.get("exists") is True:
+            return True
+        if event["function"] in ("generate-2fa", "authenticate-user") and event["status"] in (200, 401, 403):
+            return True
+        if event["function"] == "generate-password" and event["status"] == 400 and "username" in event.get("fields", []):
+            return True
+    return False
+
+
+def had_2fa_before_capture(events):
+    """Whether the user sent TOTP codes before any 2FA setup in the capture."""
+    for event in events:
+        if event["function"] == "generate-2fa" and event["status"] == 200:
+            return False
+        if event["function"] == "authenticate-user" and event.get("has_totp") \
+                and event.get("context") != "2fa_setup_verification":
+            return True
+    return False
+
+
+class User:
+    """Synthetic account standing in for one pseudonymous user of the capture."""
+
+    def __init__(self, username):
+        self.username = username
+        self.password = None
+        self.secret = None
+        self.etag = None  # last ETag returned by check-user-status
+        self.done = None  # completion event of this user's previous request
+
+
+class Replayer:
+    def __init__(self, args, run_id):
+        self.args = args
+        self.run_id = run_id
+        self.users = {}
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def user(self, pseudonym):
+        if pseudonym not in self.users:
+            self.users[pseudonym] = User(f"replay_{self.run_id}_{pseudonym[:10]}")
+        return self.users[pseudonym]
+
+    def call(self, function, method="POST", payload=None, data=None, headers=None, params=None):
+        url = f"{self.args.base_url.rstrip('/')}/{function}"
+        if payload is not None:
+            data = json.dumps(payload)
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/json")
+        start = time.perf_counter()
+        response = self.session().request(method, url, data=data, headers=headers, params=params,
+                                          timeout=self.args.timeout)
+        body = response.content
+        return response.status_code, body, (time.perf_counter() - start) * 1000, response.headers
+
+    def provision(self, user, with_2fa):
+        status, body, _, _ = self.call("generate-password", payload={"username": user.username})
+        if status != 200:
+            raise RuntimeError(f"could not create {user.username}: HTTP {status}")
+        user.password = json.loads(body)["password"]
+        if with_2fa:
+            status, body, _, _ = self.call("generate-2fa", payload={"username": user.username})
+            if status != 200:
+                raise RuntimeError(f"could not enable 2FA for {user.username}: HTTP {status}")
+            user.secret = json.loads(body)["secret"]
+
+    def build(self, record, user):
+        """Request (method, payload or raw data, headers, params) reproducing a captured shape."""
+        function = record["function"]
+        headers = {}
+        if record.get("idempotency_key"):
+            headers["Idempotency-Key"] = f"replay-{self.run_id}-{record['idempotency_key']}"
+        if record.get("method") == "GET" and "format" in record.get("query", []):
+            if self.args.export_token:
+                headers["Authorization"] = f"Bearer {self.args.export_token}"
+            return "GET", None, None, headers, {"format": "ndjson"}
+        if record.get("invalid_json"):
+            return "POST", None, "invalid json", headers, None
+
+        if record.get("conditional") and user and user.etag:
+            headers["If-None-Match"] = user.etag
+
+        fields = record.get("fields", [])
+        payload = {}
+        if "username" in fields:
+            payload["username"] = user.username if user else f"replay_{self.run_id}_anonymous"
+        if function != "authenticate-user":
+            return "POST", payload, None, headers, None
+
+        status = record["status"]
+        wrong_code = status == 401 and record.get("has_totp") and user and user.secret
+        if "password" in fields:
+            valid = status != 401 or wrong_code or record.get("context") == "2fa_setup_verification"
+            payload["password"] = user.password if valid and user and user.password else "Wrong-passw0rd!"
+        if record.get("context"):
+            payload["context"] = record["context"]
+        if record.get("has_totp"):
+            if user and user.secret and status != 401:
+                payload["totp_code"] = pyotp.TOTP(user.secret).now()
+            else:
+                payload["totp_code"] = "000000"
+        return "POST", payload, None, headers, None
+
+    def run_one(self, record, user, due, previous, done):
+        try:
+            if previous is not None:
+                previous.wait()
+            return self._send(record, user, due)
+        finally:
+            done.set()
+
+    def _send(self, record, user, due):
+        started = time.perf_counter()
+        result = {
+            "function": record["function"],
+            "original_status": record["status"],
+            "original_ms": record.get("duration_ms"),
+            "lag_ms": (started - due) * 1000 if due is not None else 0.0,
+        }
+        try:
+            method, payload, data, headers, params = self.build(record, user)
+            status, body, latency, response_headers = self.call(record["function"], method, payload, data,
+                                                                headers, params)
+            result.update(status=status, latency_ms=latency)
+            if record["function"] == "check-user-status" and user is not None and response_headers.get("ETag"):
+                user.etag = response_headers["ETag"]
+            if status == 200 and user is not None:
+                parsed = json.loads(body) if body.startswith(b"{") else {}
+                user.password = parsed.get("password", user.password)
+                user.secret = parsed.get("secret", user.secret)
+        except Exception as e:
+            result.update(status=None, latency_ms=(time.perf_counter() - started) * 1000, error=str(e))
+        return result
+
+    def replay(self, records):
+        speed = self.args.speed
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            futures = []
+            t0 = records[0]["ts"]
+            start = time.perf_counter()
+            for record in records:
+                due = None
+                if speed is not None:
+                    due = start + (record["ts"] - t0) / speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                user = self.user(record["user"]) if record.get("user") else None
+                previous, done = None, threading.Event()
+                if user is not None:
+                    previous, user.done = user.done, done
+                futures.append(pool.submit(self.run_one, record, user, due, previous, done))
+            results = [future.result() for future in futures]
+        return results, time.perf_counter() - start
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def summarize(results):
+    groups = defaultdict(list)
+    for result in results:
+        groups[result["function"]].append(result)
+        groups["all"].append(result)
+
+    print(f"{'function':<20}{'requests':>9}  {'original p50/p95/p99 ms':>26}  {'replay p50/p95/p99 ms':>26}"
+          f"{'orig 5xx':>10}{'replay err':>11}{'mismatch':>10}")
+    failed = False
+    for name in [*FUNCTION_NAMES, "all"]:
+        rows = groups.get(name)
+        if not rows:
+            continue
+        original = [r["original_ms"] for r in rows if r["original_ms"] is not None]
+        replay = [r["latency_ms"] for r in rows]
+        original_errors = sum(1 for r in rows if r["original_status"] >= 500)
+        replay_errors = sum(1 for r in rows if r["status"] is None or r["status"] >= 500)
+        mismatches = sum(1 for r in rows if r["status"] != r["original_status"])
+        print(f"{name:<20}{len(rows):>9}  "
+              f"{'/'.join(fmt(percentile(original, p)) for p in (50, 95, 99)):>26}  "
+              f"{'/'.join(fmt(percentile(replay, p)) for p in (50, 95, 99)):>26}"
+              f"{original_errors / len(rows):>10.1%}{replay_errors / len(rows):>11.1%}{mismatches:>10}")
+        if name == "all":
+            failed = replay_errors > original_errors
+
+    pairs = Counter((r["function"], r["original_status"], r["status"])
+                    for r in results if r["status"] != r["original_status"])
+    if pairs:
+        print("\nStatus mismatches (function: original -> replay):")
+        for (function, original, replayed), count in pairs.most_common(10):
+            print(f"  {function}: {original} -> {replayed}  x{count}")
+    errors = Counter(r["error"] for r in results if r.get("error"))
+    for error, count in errors.most_common(5):
+        print(f"  request error x{count}: {error}")
+    return failed
+
+
+def main():
+    args = parse_args()
+    records = load_capture(args.captures, set(args.functions))
+    if not records:
+        print("❌ No captured requests to replay")
+        return 1
+
+    run_id = secrets.token_hex(3)
+    replayer = Replayer(args, run_id)
+
+    by_user = defaultdict(list)
+    for record in records:
+        if record.get("user"):
+            by_user[record["user"]].append(record)
+    existing = {u: had_2fa_before_capture(events) for u, events in by_user.items() if existed_before_capture(events)}
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    speed = "max" if args.speed is None else f"{args.speed:g}x"
+    print(f"Replaying {len(records)} requests from {len(by_user)} users "
+          f"({span:.1f}s captured) at {speed} against {args.base_url}")
+
+    print(f"Creating {len(existing)} users that existed before the capture...")
+    with ThreadPoolExecutor(max_workers=min(args.concurrency, 16)) as pool:
+        list(pool.map(lambda item: replayer.provision(replayer.user(item[0]), item[1]), existing.items()))
+
+    results, elapsed = replayer.replay(records)
+    lags = [r["lag_ms"] for r in results]
+    print(f"\nReplayed in {elapsed:.1f}s ({len(results) / elapsed:.1f} req/s); "
+          f"scheduling lag p95 {fmt(percentile(lags, 95))} ms, max {fmt(max(lags))} ms\n")
+    failed = summarize(results)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"run_id": run_id, "speed": speed, "elapsed_s": elapsed, "results": results}, f, indent=2)
+
+    print("\n" + ("❌ More server errors than in the original run" if failed
+                  else "✅ Replay finished without additional server errors"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Soak test for the OpenFaaS function handlers.
+
+Each handler's handle() is loaded in-process (see functions/common/loader.py)
+and invoked hundreds of thousands of times, warm, across its success path and
+every error branch. Along the way the script samples:
+
+- resident set size (RSS) of the process,
+- Python heap growth measured with tracemalloc snapshots,
+- open file descriptors,
+- server-side PostgreSQL connections (pg_stat_activity).
+
+The run fails when any of them grows past its threshold between the end of
+the warm-up and the end of the run, which points at leaked objects, cursors,
+sockets or pooled connections.
+
+The database is configured with the usual DB_* variables (set them
+explicitly: the handlers only read them from the environment or from
+CONFIG_FILE when run from the source tree). With --no-db the database host is pointed at a closed port so
+the database-down branches (connection error, open circuit breaker) are
+soaked instead of the success paths. With --storage memory the handlers use
+the in-memory account repository (functions/common/repository.py) and no
+database at all: comparing its calls/s with a PostgreSQL run separates the
+handlers' own cost from the database's.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone, timedelta
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+FUNCTION_NAMES = ["generate-password", "generate-2fa", "authenticate-user", "check-user-status"]
+USER_PREFIX = "soak_"
+DB_DOWN_STATUSES = {500, 503}
+
+
+class Event:
+    """Request object passed to handle(), shaped like the template's."""
+
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.method = "POST"
+        self.query = {}
+        self.path = "/"
+
+
+class Context:
+    hostname = "soak-test"
+
+
+class Scenario:
+    """One branch of a handler: a request builder and the expected status codes."""
+
+    def __init__(self, function, name, build, expected, weight=10, needs_db=False, postgres_only=False):
+        self.function = function
+        self.name = name
+        self.build = build
+        self.expected = set(expected)
+        self.weight = weight
+        self.needs_db = needs_db
+        self.postgres_only = postgres_only
+        self.calls = 0
+        self.unexpected = 0
+        self.last_unexpected = None
+
+
+def json_body(payload):
+    return lambda i: Event(json.dumps(payload).encode('utf-8'))
+
+
+def read_rss():
+    """Current resident set size in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # macOS: ru_maxrss is the peak in bytes, good enough to spot a trend
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_fds():
+    """Number of open file descriptors of the process."""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return -1
+
+
+class Fixtures:
+    """Users inserted directly in the database so every branch is reachable."""
+
+    def __init__(self, rounds):
+        import bcrypt
+        import pyotp
+        from cryptography.fernet import Fernet
+
+        self.password = "Soak-Passw0rd!"
+        self.mfa_secret = pyotp.random_base32()
+        self.totp = pyotp.TOTP(self.mfa_secret)
+        self.hash = bcrypt.hashpw(self.password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+        self.encrypted_secret = Fernet(os.environ['ENCRYPTION_KEY'].encode('utf-8')).encrypt(
+            self.mfa_secret.encode('utf-8')).decode('utf-8')
+
+    def rows(self):
+        now = int(datetime.now(timezone.utc).timestamp() * 1000)
+        old = int((datetime.now(timezone.utc) - timedelta(days=400)).timestamp() * 1000)
+        return [
+            (f"{USER_PREFIX}plain", self.hash, None, now),
+            (f"{USER_PREFIX}mfa", self.hash, self.encrypted_secret, now),
+            (f"{USER_PREFIX}expired", self.hash, None, old),
+            (f"{USER_PREFIX}2fa_target", self.hash, None, now),
+        ]
+
+    def install(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (USER_PREFIX + '%',))
+            cursor.executemany(
+                "INSERT INTO users (username, password, mfa, gendate, expired) VALUES (%s, %s, %s, %s, FALSE)",
+                self.rows()
+            )
+        conn.commit()
+
+    def install_in_repository(self, users):
+        for username, password_hash, mfa, gendate in self.rows():
+            users.create_user(username, password_hash, gendate)
+            if mfa:
+                users.set_mfa(username, mfa)
+
+
+def build_scenarios(fx):
+    """Every branch of the four handlers. `fx` is None when running without a database."""
+    scenarios = []
+
+    def add(function, name, build, expected, weight=10, needs_db=False, postgres_only=False):
+        scenarios.append(Scenario(function, name, build, expected, weight, needs_db, postgres_only))
+
+    for function in FUNCTION_NAMES:
+        add(function, "invalid-json", lambda i: Event(b"{not json"), {400})
+        add(function, "missing-username", json_body({}), {400})
+
+    # generate-password (bcrypt on every call, hence the low weights)
+    add("generate-password", "created", lambda i: Event(json.dumps(
+        {"username": f"{USER_PREFIX}new_{os.getpid()}_{i}"}).encode('utf-8')), {200}, weight=1, needs_db=True)
+    add("generate-password", "already-exists", json_body({"username": f"{USER_PREFIX}plain"}), {400},
+        weight=1, needs_db=True)
+
+    # generate-2fa
+    add("generate-2fa", "user-not-found", json_body({"username": f"{USER_PREFIX}missing"}), {404},
+        weight=3, needs_db=True)
+    add("generate-2fa", "secret-generated", json_body({"username": f"{USER_PREFIX}2fa_target"}), {200},
+        weight=3, needs_db=True)
+    add("generate-2fa", "idempotent-replay", lambda i: Event(
+        json.dumps({"username": f"{USER_PREFIX}2fa_target"}).encode('utf-8'),
+        {"Idempotency-Key": f"{USER_PREFIX}replay"}), {200}, weight=3, needs_db=True, postgres_only=True)
+
+    # check-user-status
+    add("check-user-status", "unknown-user", json_body({"username": f"{USER_PREFIX}missing"}), {200}, needs_db=True)
+    add("check-user-status", "existing-user", json_body({"username": f"{USER_PREFIX}mfa"}), {200}, needs_db=True)
+    add("check-user-status", "expired-user", json_body({"username": f"{USER_PREFIX}expired"}), {200}, needs_db=True)
+
+    # authenticate-user
+    add("authenticate-user", "missing-password", json_body({"username": f"{USER_PREFIX}plain"}), {400})
+    add("authenticate-user", "setup-missing-code", json_body(
+        {"username": f"{USER_PREFIX}mfa", "context": "2fa_setup_verification"}), {400})
+    add("authenticate-user", "unknown-user", json_body(
+        {"username": f"{USER_PREFIX}missing", "password": "x"}), {401}, needs_db=True)
+    if fx is not None:
+        password = fx.password
+        add("authenticate-user", "wrong-password", json_body(
+            {"username": f"{USER_PREFIX}plain", "password": "wrong"}), {401}, needs_db=True)
+        add("authenticate-user", "success", json_body(
+            {"username": f"{USER_PREFIX}plain", "password": password}), {200}, needs_db=True)
+        add("authenticate-user", "totp-required", json_body(
+            {"username": f"{USER_PREFIX}mfa", "password": password}), {403}, needs_db=True)
+        add("authenticate-user", "totp-invalid", json_body(
+            {"username": f"{USER_PREFIX}mfa", "password": password, "totp_code": "000000"}), {401}, needs_db=True)
+        add("authenticate-user", "success-with-totp", lambda i: Event(json.dumps(
+            {"username": f"{USER_PREFIX}mfa", "password": password, "totp_code": fx.totp.now()}).encode('utf-8')),
+            {200}, needs_db=True)
+        add("authenticate-user", "expired", json_body(
+            {"username": f"{USER_PREFIX}expired", "password": password}), {403}, needs_db=True)
+        add("authenticate-user", "setup-verified", lambda i: Event(json.dumps(
+            {"username": f"{USER_PREFIX}mfa", "totp_code": fx.totp.now(),
+             "context": "2fa_setup_verification"}).encode('utf-8')), {200}, needs_db=True)
+        add("authenticate-user", "setup-invalid-code", json_body(
+            {"username": f"{USER_PREFIX}mfa", "totp_code": "000000", "context": "2fa_setup_verification"}),
+            {401}, needs_db=True)
+        add("authenticate-user", "setup-not-pending", json_body(
+            {"username": f"{USER_PREFIX}plain", "totp_code": "000000", "context": "2fa_setup_verification"}),
+            {400}, needs_db=True)
+    else:
+        for scenario in scenarios:
+            if scenario.needs_db:
+                scenario.expected = DB_DOWN_STATUSES
+    return scenarios
+
+
+class Monitor:
+    """Collects resource samples over the run."""
+
+    def __init__(self, use_tracemalloc, db_conn):
+        self.use_tracemalloc = use_tracemalloc
+        self.db_conn = db_conn
+        self.samples = []
+        self.baseline_snapshot = None
+        self.last_snapshot = None
+
+    def server_connections(self):
+        if self.db_conn is None:
+            return -1
+        with self.db_conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            count = cursor.fetchone()[0]
+        self.db_conn.rollback()
+        return count
+
+    def sample(self, iteration):
+        gc.collect()
+        heap = -1
+        if self.use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            heap = sum(stat.size for stat in snapshot.statistics('filename'))
+            if self.baseline_snapshot is None:
+                self.baseline_snapshot = snapshot
+            self.last_snapshot = snapshot
+        sample = {
+            "iteration": iteration,
+            "time": time.monotonic(),
+            "rss": read_rss(),
+            "heap": heap,
+            "fds": count_fds(),
+            "db_connections": self.server_connections(),
+        }
+        self.samples.append(sample)
+        print(f"  [{iteration:>8}] rss={sample['rss'] / 2**20:8.1f} MiB  "
+              f"heap={heap / 2**20 if heap >= 0 else float('nan'):7.2f} MiB  "
+              f"fds={sample['fds']:4}  db_connections={sample['db_connections']}", flush=True)
+        return sample
+
+    def top_growth(self, limit=10):
+        if not (self.baseline_snapshot and self.last_snapshot):
+            return []
+        return self.last_snapshot.compare_to(self.baseline_snapshot, 'lineno')[:limit]
+
+
+def load_handlers(names):
+    sys.path.insert(0, os.path.abspath(FUNCTIONS_DIR))
+    from common.loader import load_handler
+    return {name: load_handler(os.path.join(FUNCTIONS_DIR, name)) for name in names}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Soak test the function handlers in-process.")
+    parser.add_argument("--iterations", type=int, default=300000, help="total handler invocations")
+    parser.add_argument("--warmup", type=int, default=5000, help="invocations before the baseline sample")
+    parser.add_argument("--sample-every", type=int, default=10000, help="invocations between samples")
+    parser.add_argument("--functions", nargs="+", choices=FUNCTION_NAMES, default=FUNCTION_NAMES)
+    parser.add_argument("--no-db", action="store_true", help="soak the database-down branches only")
+    parser.add_argument("--storage", choices=["postgres", "memory"], default="postgres",
+                        help="account storage used by the handlers (memory: no database)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="bcrypt cost used by the handlers during the run (the default 12 is far too slow)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip Python heap tracking (faster)")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=32.0)
+    parser.add_argument("--max-heap-growth-mb", type=float, default=4.0)
+    parser.add_argument("--max-fd-growth", type=int, default=4)
+    parser.add_argument("--max-db-connection-growth", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", help="write samples and verdict to this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.storage == "memory":
+        os.environ["STORAGE_BACKEND"] = "memory"
+        args.no_db = False
+    elif args.no_db:
+        os.environ["DB_HOST"] = "127.0.0.1"
+        os.environ["DB_PORT"] = "1"
+        os.environ.setdefault("DB_CONNECT_TIMEOUT", "1")
+    elif "DB_HOST" not in os.environ:
+        print("❌ Set DB_HOST (and DB_NAME, DB_USER, DB_PASSWORD) or use --no-db")
+        return 2
+    os.environ.setdefault("ENCRYPTION_KEY", "bA8tcGhp8hZsSSqIEv1hGUvrfUuiyB8XMCICfSmrV3k=")
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    handlers = load_handlers(args.functions)
+
+    fixtures = None
+    monitor_conn = None
+    if args.storage == "memory":
+        from common import repository
+        fixtures = Fixtures(args.bcrypt_rounds)
+        fixtures.install_in_repository(repository.get_repository())
+    elif not args.no_db:
+        import psycopg2
+        monitor_conn = psycopg2.connect(
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST'),
+            port=os.getenv('DB_PORT', '5432')
+        )
+        fixtures = Fixtures(args.bcrypt_rounds)
+        fixtures.install(monitor_conn)
+
+    scenarios = [s for s in build_scenarios(fixtures) if s.function in handlers
+                 and not (s.postgres_only and args.storage == "memory")]
+    weights = [s.weight for s in scenarios]
+    rng = random.Random(args.seed)
+    context = Context()
+
+    print("Starting soak test")
+    print(f"Functions: {', '.join(args.functions)}")
+    database = "none (memory storage)" if args.storage == "memory" else "down" if args.no_db else "up"
+    print(f"Scenarios: {len(scenarios)}, iterations: {args.iterations}, database: {database}")
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    monitor = Monitor(not args.no_tracemalloc, monitor_conn)
+
+    started = time.monotonic()
+    baseline = None
+    try:
+        for i in range(args.iterations):
+            scenario = rng.choices(scenarios, weights)[0]
+            response = handlers[scenario.function].handle(scenario.build(i), context)
+            status = (response or {}).get("statusCode", 200)
+            scenario.calls += 1
+            if status not in scenario.expected:
+                scenario.unexpected += 1
+                scenario.last_unexpected = f"{status}: {str(response.get('body'))[:200]}"
+
+            done = i + 1
+            if done == args.warmup:
+                baseline = monitor.sample(done)
+            elif done > args.warmup and done % args.sample_every == 0:
+                monitor.sample(done)
+    except KeyboardInterrupt:
+        print("\nInterrupted, evaluating what was collected")
+
+    final = monitor.sample(sum(s.calls for s in scenarios))
+    elapsed = time.monotonic() - started
+    if baseline is None:
+        baseline = monitor.samples[0]
+
+    print("\n" + "=" * 60)
+    print(f"Scenario coverage ({sum(s.calls for s in scenarios) / elapsed:.0f} calls/s)")
+    print("=" * 60)
+    for s in scenarios:
+        marker = "✅" if s.calls and not s.unexpected else "❌"
+        print(f"{marker} {s.function:18} {s.name:22} calls={s.calls:<8} unexpected={s.unexpected}")
+        if s.last_unexpected:
+            print(f"     last unexpected response {s.last_unexpected}")
+
+    checks = [
+        ("RSS", (final["rss"] - baseline["rss"]) / 2**20, args.max_rss_growth_mb, "MiB"),
+        ("Python heap", (final["heap"] - baseline["heap"]) / 2**20, args.max_heap_growth_mb, "MiB"),
+        ("File descriptors", final["fds"] - baseline["fds"], args.max_fd_growth, ""),
+        ("DB connections", final["db_connections"] - baseline["db_connections"],
+         args.max_db_connection_growth, ""),
+    ]
+    print("\n" + "=" * 60)
+    print("Resource growth since warm-up")
+    print("=" * 60)
+    failed = any(s.unexpected or not s.calls for s in scenarios)
+    for name, growth, limit, unit in checks:
+        if name == "Python heap" and args.no_tracemalloc:
+            continue
+        if name == "DB connections" and monitor_conn is None:
+            continue
+        ok = growth <= limit
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {name:17} {growth:+10.2f} {unit:3} (limit {limit} {unit})")
+
+    growth = monitor.top_growth()
+    if growth:
+        print("\nTop Python heap growth:")
+        for stat in growth:
+            print(f"  {stat}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({
+                "samples": monitor.samples,
+                "scenarios": {f"{s.function}/{s.name}": {"calls": s.calls, "unexpected": s.unexpected}
+                              for s in scenarios},
+                "failed": failed,
+            }, f, indent=2)
+
+    if monitor_conn is not None:
+        from common import stats
+        with monitor_conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (USER_PREFIX + '%',))
+            # Test users were inserted and deleted behind the handlers' back
+            stats.rebuild(cursor)
+        monitor_conn.commit()
+        monitor_conn.close()
+
+    print("\n" + ("❌ SOAK TEST FAILED" if failed else "✅ SOAK TEST PASSED"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
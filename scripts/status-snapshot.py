@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Build and verify the account status snapshot of check-user-status.
+
+    build   Read every account and write the snapshot file (see
+            functions/common/snapshot.py), replacing it atomically. Each
+            database is read in one REPEATABLE READ transaction; the xmin of
+            that transaction's MVCC snapshot is stored as the starting point of
+            the change feed, so writes committed during or after the build are
+            applied by the function replicas.
+    check   Compare a snapshot with the databases. Accounts written since the
+            build (changed_xid at or above the stored xmin) are expected to
+            differ and are only counted; any other difference is reported and
+            makes the command exit with status 1.
+    info    Print the snapshot metadata.
+
+The databases are the ones the functions use: DB_SHARDS (and
+DB_SHARDS_PREVIOUS during a resharding) or DB_HOST/DB_NAME/... The stored
+feed positions are keyed by these targets, so a snapshot built for another
+shard map is ignored by the functions.
+
+Run `build` as a periodic job (every few minutes to hours: only the size of
+the change feed overlay in each replica depends on it) writing to storage
+that the function replicas mount, and point STATUS_SNAPSHOT at the file.
+
+Usage:
+    python scripts/status-snapshot.py build /var/lib/cofrap/status.snap
+    python scripts/status-snapshot.py check /var/lib/cofrap/status.snap
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+from common import db, snapshot  # noqa: E402
+
+FETCH_SIZE = 50000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build or verify the account status snapshot.")
+    parser.add_argument("command", choices=["build", "check", "info"])
+    parser.add_argument("path", help="snapshot file")
+    parser.add_argument("--max-differences", type=int, default=20,
+                        help="differences printed by check (all are counted)")
+    return parser.parse_args()
+
+
+def read_accounts(target, stamps, with_xid=False):
+    """Stream the accounts of one database from a single MVCC snapshot.
+
+    Records the xmin of that snapshot in `stamps` before the first row.
+    """
+    conn = db.get_target_connection(target)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            # First statement: fixes the snapshot the whole scan reads
+            cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+            stamps[snapshot.target_key(target)] = int(cursor.fetchone()[0])
+        columns = snapshot.ROW_COLUMNS + (", changed_xid::text" if with_xid else "")
+        with conn.cursor(name="status_snapshot") as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(f"SELECT {columns} FROM users")
+            yield from cursor
+        conn.rollback()
+    finally:
+        db.release_db_connection(conn)
+
+
+def build(path):
+    stamps = {}
+    start = time.monotonic()
+
+    def rows():
+        for target in db.database_targets():
+            yield from read_accounts(target, stamps)
+
+    # write() consumes every row before the header, stamps included, is written
+    count = snapshot.write(path, rows(), stamps)
+    print(f"Wrote {count} accounts to {path} in {time.monotonic() - start:.1f}s "
+          f"({os.path.getsize(path) / 1e6:.1f} MB)")
+    return 0
+
+
+def check(path, max_differences):
+    snap = snapshot.Snapshot(path)
+    seen, present, changed, differences = 0, 0, 0, []
+    for target in db.database_targets():
+        key = snapshot.target_key(target)
+        if key not in snap.stamps:
+            print("The snapshot has no feed position for a configured database: shard map changed")
+            return 1
+        since = snap.stamps[key]
+        for username, user_id, version, has_2fa, expired, gendate, changed_xid in read_accounts(target, {}, True):
+            seen += 1
+            entry = snap.get(username)
+            present += entry is not None
+            if changed_xid is not None and int(changed_xid) >= since:
+                changed += 1
+            elif entry != snapshot.Entry(user_id, version, has_2fa, expired, gendate):
+                differences.append((username, entry, (user_id, version, has_2fa, expired, gendate)))
+
+    for username, entry, expected in differences[:max_differences]:
+        print(f"{username}: snapshot {tuple(entry) if entry else None}, database {expected}")
+    print(f"{seen} accounts in the databases, {len(snap)} in the snapshot, "
+          f"{changed} changed since the build, {len(differences)} differences")
+    # Deletions are not in the change feed: expected after a cleanup or a resharding
+    if len(snap) > present:
+        print(f"{len(snap) - present} accounts of the snapshot are no longer in the databases")
+    return 1 if differences else 0
+
+
+def info(path):
+    snap = snapshot.Snapshot(path)
+    meta = dict(snap.meta)
+    meta["built_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(meta["built_at"]))
+    meta["age_seconds"] = round(time.time() - snap.meta["built_at"])
+    print(json.dumps(meta, indent=2))
+    return 0
+
+
+def main():
+    args = parse_args()
+    if args.command == "build":
+        return build(args.path)
+    if args.command == "check":
+        return check(args.path, args.max_differences)
+    return info(args.path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())